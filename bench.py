@@ -0,0 +1,239 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import compiler
+import simpletron
+
+# ========== Gerador de programas SIMPLE ==========:
+# Programas válidos de qualquer tamanho: um prólogo inicializa todas as variáveis, depois vêm blocos
+# do formato escolhido e, no fim, 'print' e 'end'. As linhas são numeradas 1, 2, 3...
+
+VARIABLES = 'abcdefghijklmnopqrstuvwxyz'
+SHAPES = ('let_chain', 'symbols', 'loops', 'comments', 'mixed')
+PROLOGUE = ['input a'] + [f'let {var} = a' for var in VARIABLES[1:]]
+OPERATORS = '+-*/%'
+
+def let_chain_block(body, rng, limit): # 'let' em linha reta, cada um usando o resultado anterior
+    start = rng.randrange(len(VARIABLES))
+    for offset in range(8):
+        if len(body) >= limit:
+            return
+        target, source = VARIABLES[(start + offset + 1) % 26], VARIABLES[(start + offset) % 26]
+        body.append(f'let {target} = {source} {rng.choice(OPERATORS)} {rng.randint(1, 9)}')
+
+def symbols_block(body, rng, limit): # Muitas variáveis e muitas constantes diferentes
+    for _ in range(8):
+        if len(body) >= limit:
+            return
+        body.append(f'let {rng.choice(VARIABLES)} = {rng.choice(VARIABLES)} + {len(body) % 9999}')
+
+def loops_block(body, rng, limit): # Laço curto com desvio para trás e desvio para frente
+    start = len(body) + 1 # Número da linha do primeiro comando do bloco
+    statements = [
+        'let i = 0',
+        'let i = i + 1',
+        'let s = s + i',
+        f'if i < {rng.randint(2, 9)} goto {start + 1}',
+        f'if s == 0 goto {min(start + 5, limit + 1)}', # Próximo bloco, ou o 'print' final
+    ]
+    for statement in statements:
+        if len(body) >= limit:
+            return
+        body.append(statement)
+
+def comments_block(body, rng, limit): # Três comentários longos para cada comando
+    for index in range(4):
+        if len(body) >= limit:
+            return
+        if index < 3:
+            body.append('rem ' + ' '.join(rng.choice(('contador', 'soma', 'laço', 'valor', 'teste', 'fim')) for _ in range(10)))
+        else:
+            body.append(f'let {rng.choice(VARIABLES)} = {rng.choice(VARIABLES)} * 2')
+
+BLOCKS = {
+    'let_chain': let_chain_block,
+    'symbols': symbols_block,
+    'loops': loops_block,
+    'comments': comments_block,
+}
+
+
+def generate_program(lines, shape='mixed', seed=0):
+    if lines < len(PROLOGUE) + 2:
+        raise ValueError(f'O programa precisa de pelo menos {len(PROLOGUE) + 2} linhas')
+    rng = random.Random(seed)
+    body = list(PROLOGUE)
+    limit = lines - 2
+    while len(body) < limit:
+        kind = rng.choice(tuple(BLOCKS)) if shape == 'mixed' else shape
+        BLOCKS[kind](body, rng, limit)
+    body += ['print s', 'end']
+    return ''.join(f'{number} {statement}\n' for number, statement in enumerate(body, 1))
+
+
+# Programa pequeno (cabe na memória) para medir a Simpletron: m vezes um laço de n iterações
+VM_KERNEL = """10 input n
+20 input m
+30 let s = 0
+40 let j = 0
+50 let i = 0
+60 let s = s + i
+70 let s = s % 97
+80 let i = i + 1
+90 if i < n goto 60
+100 let j = j + 1
+110 if j < m goto 50
+120 print s
+130 end
+"""
+
+
+# ========== Medições ==========:
+DEFAULT_SIZES = (100, 1000, 10000, 100000) # 1000000 também é aceito, mas leva minutos
+MIN_TIME = 0.005 # Tempos abaixo disso (segundos) são ruído demais para comparar
+SUPERLINEAR = 1.5 # Expoente de crescimento acima do qual uma fase é marcada (1 = linear, 2 = quadrática)
+LARGE_VM_LINES = 3000 # Programa 'loops' executado na Simpletron ext10000
+
+def time_compile(text, opt_level, repeat):
+    # Menor tempo de cada fase em repeat compilações, sem medir memória (tracemalloc distorce os tempos)
+    best = {}
+    for _ in range(repeat):
+        result = compiler.compile_source(text, compiler.CompileOptions(opt_level, profile=True, profile_memory=False))
+        for record in result.profile['phases']:
+            best[record['phase']] = min(best.get(record['phase'], math.inf), record['wall'])
+        best['total'] = min(best.get('total', math.inf), result.profile['total']['wall'])
+    tokens = result.profile['phases'][0]['tokens']
+    return {'phases': best, 'tokens': tokens, 'words': len(result.code), 'errors': len(result.errors)}
+
+
+def vm_programs(n, m):
+    # (nome, imagem, entradas, perfil): o laço pequeno mede a velocidade de execução; o programa
+    # grande tem milhares de blocos básicos e mede quanto custa a tradução escolher o bloco de cada desvio
+    target = compiler.TARGETS['ext10000']
+    large = compiler.compile_source(generate_program(LARGE_VM_LINES, 'loops', seed=LARGE_VM_LINES), compiler.CompileOptions(2, target=target)).code
+    return [
+        ('kernel', compiler.compile_source(VM_KERNEL, compiler.CompileOptions(2)).code, [str(n), str(m)], compiler.DEFAULT_TARGET),
+        (f'loops_{LARGE_VM_LINES}', large, ['1'], target),
+    ]
+
+
+def time_vm(n, m, repeat):
+    records = []
+    for program, code, inputs, target in vm_programs(n, m):
+        for mode in ('interpreter', 'jit'):
+            best = math.inf
+            for _ in range(repeat):
+                machine = simpletron.Simpletron(code, inputs=inputs, max_cycles=10 ** 9, jit=mode == 'jit', target=target)
+                machine.run()
+                best = min(best, machine.elapsed)
+            records.append({'program': program, 'mode': mode, 'cycles': machine.cycles, 'seconds': best, 'instructions_per_second': machine.cycles / best})
+    return records
+
+
+def run_benchmarks(sizes, shapes, opt_levels, repeat, vm_scale, log=print):
+    results = {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')},
+        'compile': [],
+        'vm': [],
+    }
+    for shape in shapes:
+        for lines in sizes:
+            text = generate_program(lines, shape, seed=lines)
+            for opt_level in opt_levels:
+                record = {'shape': shape, 'lines': lines, 'opt_level': opt_level, **time_compile(text, opt_level, repeat)}
+                results['compile'].append(record)
+                log(format_compile(record))
+    if vm_scale:
+        for record in time_vm(1000, vm_scale, repeat):
+            results['vm'].append(record)
+            log(f"vm {record['program']:<12}{record['mode']:<12}{record['cycles']:>12,} instruções {record['seconds']:9.3f}s {record['instructions_per_second']:>14,.0f} instruções/s")
+    return results
+
+
+def format_compile(record):
+    phases = record['phases']
+    columns = ' '.join(f"{name} {phases[name] * 1000:9.1f}ms" for name in phases if name != 'total')
+    per_line = phases['total'] / record['lines'] * 1e6
+    return f"{record['shape']:<10}{record['lines']:>8} linhas -O{record['opt_level']} {columns} total {phases['total'] * 1000:9.1f}ms ({per_line:.1f}µs/linha)"
+
+
+# ========== Regressões ==========:
+def find_superlinear(results):
+    # Compara tamanhos consecutivos: tempo crescendo como n^k com k > SUPERLINEAR indica um caminho
+    # quadrático (pop(0), buscas lineares repetidas, ...)
+    flags = []
+    series = {}
+    for record in results['compile']:
+        series.setdefault((record['shape'], record['opt_level']), []).append(record)
+    for (shape, opt_level), records in series.items():
+        records.sort(key=lambda record: record['lines'])
+        for small, large in zip(records, records[1:]):
+            for phase, time_large in large['phases'].items():
+                time_small = small['phases'].get(phase)
+                if not time_small or time_small < MIN_TIME:
+                    continue
+                exponent = math.log(time_large / time_small) / math.log(large['lines'] / small['lines'])
+                if exponent > SUPERLINEAR:
+                    flags.append(f"{shape} -O{opt_level} {phase}: {small['lines']} -> {large['lines']} linhas cresce como n^{exponent:.2f}")
+    return flags
+
+
+def compare_baseline(results, baseline, tolerance):
+    flags = []
+    old = {(record['shape'], record['lines'], record['opt_level']): record for record in baseline.get('compile', [])}
+    for record in results['compile']:
+        previous = old.get((record['shape'], record['lines'], record['opt_level']))
+        if not previous:
+            continue
+        for phase, seconds in record['phases'].items():
+            before = previous['phases'].get(phase)
+            if before is not None and seconds > before * (1 + tolerance) and seconds - before > MIN_TIME:
+                flags.append(f"{record['shape']} {record['lines']} linhas -O{record['opt_level']} {phase}: {before * 1000:.1f}ms -> {seconds * 1000:.1f}ms")
+    old_vm = {(record.get('program', 'kernel'), record['mode']): record for record in baseline.get('vm', [])}
+    for record in results['vm']:
+        previous = old_vm.get((record['program'], record['mode']))
+        if previous and previous['cycles'] == record['cycles'] and record['seconds'] > previous['seconds'] * (1 + tolerance):
+            flags.append(f"vm {record['program']} {record['mode']}: {previous['seconds']:.3f}s -> {record['seconds']:.3f}s")
+    return flags
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Mede o compilador (cada fase) e a Simpletron com programas SIMPLE gerados.')
+    arg_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='número de linhas dos programas gerados')
+    arg_parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    arg_parser.add_argument('-O', '--opt-levels', type=int, nargs='+', choices=(0, 1, 2, 3), default=[0])
+    arg_parser.add_argument('--repeat', type=int, default=3, help='execuções de cada medição; vale a mais rápida')
+    arg_parser.add_argument('--vm-scale', type=int, default=20, help='repetições do laço de 1000 iterações na Simpletron (0: não mede)')
+    arg_parser.add_argument('--json', metavar='ARQUIVO', help='grava os resultados em JSON')
+    arg_parser.add_argument('--baseline', metavar='ARQUIVO', help='compara com resultados gravados antes por --save-baseline')
+    arg_parser.add_argument('--save-baseline', metavar='ARQUIVO', help='grava os resultados como nova referência')
+    arg_parser.add_argument('--tolerance', type=float, default=0.25, help='aumento de tempo tolerado em relação à referência (padrão: 0.25)')
+    arg_parser.add_argument('--generate', type=int, metavar='LINHAS', help='só imprime um programa gerado (com --shapes e --seed)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args(argv)
+
+    if args.generate:
+        sys.stdout.write(generate_program(args.generate, args.shapes[0] if len(args.shapes) == 1 else 'mixed', args.seed))
+        return 0
+
+    results = run_benchmarks(sorted(args.sizes), args.shapes, args.opt_levels, args.repeat, args.vm_scale)
+    flags = find_superlinear(results)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            flags += compare_baseline(results, json.load(file), args.tolerance)
+    results['flags'] = flags
+    for flag in flags:
+        print(f'***Regressão***: {flag}')
+    for path in (args.json, args.save_baseline):
+        if path:
+            compiler.write_atomic(path, json.dumps(results, indent=2, ensure_ascii=False) + '\n')
+    return 1 if flags else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
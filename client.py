@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+
+# Cliente do server.py: só usa a biblioteca padrão e não importa o compilador, para iniciar rápido.
+# O protocolo (JSON precedido do tamanho) está descrito em server.py
+
+HEADER = struct.Struct('>I')
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'simple-compiler.sock')
+EXIT_CODES = {'ok': 0, 'errors': 1, 'overflow': 3, 'io_error': 4} # Os mesmos do compiler.py
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+class CompileClient:
+    def __init__(self, socket_path=DEFAULT_SOCKET, host='127.0.0.1', port=None):
+        try:
+            if port is not None:
+                self.socket = socket.create_connection((host, port))
+            else:
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.connect(socket_path)
+        except OSError as error:
+            raise ServerError(f'Servidor não encontrado em {socket_path if port is None else f"{host}:{port}"} ({error}); inicie-o com python server.py')
+        self.file = self.socket.makefile('rb')
+        self.next_id = 0
+        self.pending = {} # id -> resposta recebida antes de ser pedida
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, request): # Envia sem esperar a resposta; devolve o id do pedido
+        self.next_id += 1
+        payload = json.dumps({**request, 'id': self.next_id}, ensure_ascii=False).encode()
+        self.socket.sendall(HEADER.pack(len(payload)) + payload)
+        return self.next_id
+
+    def receive(self, request_id): # Resposta de um pedido; as de outros pedidos ficam guardadas
+        while request_id not in self.pending:
+            header = self.file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ServerError('O servidor encerrou a conexão')
+            (size,) = HEADER.unpack(header)
+            response = json.loads(self.file.read(size))
+            if response.get('id') is None: # Erro de protocolo: o servidor encerra a conexão
+                raise ServerError(response.get('error', 'Resposta inválida'))
+            self.pending[response['id']] = response
+        return self.pending.pop(request_id)
+
+    def call(self, request):
+        response = self.receive(self.send(request))
+        if not response['ok']:
+            raise ServerError(response['error'])
+        return response
+
+
+def write_atomic(path, text): # Como em compiler.py
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(text)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def output_path(source, output, single):
+    if output and single:
+        return output
+    directory = output or os.path.dirname(source)
+    return os.path.join(directory, os.path.splitext(os.path.basename(source))[0] + '.sml')
+
+
+def report(source, response, output, args):
+    # Mesmo formato do compiler.py; com --run, também a saída do programa
+    if not response['ok']:
+        print(f"***Erro***: {source}: {response['error']}")
+        return EXIT_CODES['io_error']
+    result = response['result']
+    for message in result['errors']:
+        print(f'***Erro***: {source}: {message}')
+    if result['status'] == 'overflow':
+        print(f"***Erro***: {source}: código gerado ocupa {result['words']} endereços, a memória tem {result['memory_size']}")
+    status = EXIT_CODES[result['status']]
+    if result['status'] == 'ok' and output:
+        try:
+            write_atomic(output, ''.join(word + '\n' for word in result['code']))
+            print(f"{source} -> {output}: {result['words']} endereços")
+        except OSError as error:
+            print(f'***Erro***: {source}: Não foi possível gravar o arquivo: {error}')
+            status = EXIT_CODES['io_error']
+    if 'run' in result:
+        run = result['run']
+        print(f"{source}: {' '.join(map(str, run['output']))}")
+        if run['error']:
+            print(f"***Erro***: {source}: Simpletron: {run['error']}")
+            status = max(status, 1)
+    if args.timing:
+        timing = ' '.join(f'{name} {value * 1000:.2f}ms' for name, value in response['timing'].items() if not isinstance(value, bool))
+        print(f"***Tempo***: {source}: {timing}{' (memorizado)' if response['timing'].get('memo') else ''}")
+    return status
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compila (e executa) programas SIMPLE no servidor de compilação (server.py).')
+    arg_parser.add_argument('sources', nargs='*', help='arquivos com código SIMPLE')
+    arg_parser.add_argument('-o', '--output', help='arquivo de saída, se houver uma só fonte; senão, diretório das saídas (padrão: <nome>.sml ao lado da fonte)')
+    arg_parser.add_argument('-O', '--opt-level', type=int, choices=(0, 1, 2, 3), default=0)
+    arg_parser.add_argument('--target', default='classic', help='perfil da máquina alvo (padrão: %(default)s)')
+    arg_parser.add_argument('--max-errors', type=int, default=100, metavar='N')
+    arg_parser.add_argument('--run', action='store_true', help='também executa cada programa na Simpletron do servidor')
+    arg_parser.add_argument('-i', '--input', nargs='*', default=[], type=int, help='valores de entrada para --run')
+    arg_parser.add_argument('--max-cycles', type=int, default=1000000)
+    arg_parser.add_argument('--jit', action='store_true', help='executa com o tradutor para Python da Simpletron')
+    arg_parser.add_argument('--no-output', action='store_true', help='não grava os arquivos .sml')
+    arg_parser.add_argument('--timing', action='store_true', help='mostra o tempo de cada pedido no servidor')
+    arg_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='socket Unix do servidor (padrão: %(default)s)')
+    arg_parser.add_argument('--port', type=int, help='conecta nesta porta TCP em vez do socket Unix')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--ping', action='store_true', help='só verifica se o servidor responde')
+    arg_parser.add_argument('--stats', action='store_true', help='mostra as estatísticas do servidor')
+    arg_parser.add_argument('--shutdown', action='store_true', help='encerra o servidor')
+    args = arg_parser.parse_args(argv)
+
+    try:
+        with CompileClient(args.socket, args.host, args.port) as client:
+            for op in ('ping', 'stats', 'shutdown'):
+                if getattr(args, op):
+                    print(json.dumps(client.call({'op': op})['result'], indent=2, ensure_ascii=False))
+                    return 0
+            requests = []
+            exit_code = 0
+            for source in args.sources:
+                try:
+                    with open(source, 'r') as file:
+                        text = file.read()
+                except (OSError, UnicodeDecodeError) as error:
+                    print(f'***Erro***: {source}: Não foi possível ler o arquivo: {error}')
+                    exit_code = EXIT_CODES['io_error']
+                    continue
+                # Todos os pedidos são enviados antes de ler as respostas: o servidor compila em paralelo
+                request_id = client.send({
+                    'op': 'run' if args.run else 'compile', 'source': text, 'opt_level': args.opt_level, 'target': args.target,
+                    'max_errors': args.max_errors, 'inputs': args.input, 'max_cycles': args.max_cycles, 'jit': args.jit,
+                })
+                requests.append((source, request_id))
+            single = len(args.sources) == 1 and not os.path.isdir(args.sources[0])
+            for source, request_id in requests:
+                output = None if args.no_output else output_path(source, args.output, single)
+                exit_code = max(exit_code, report(source, client.receive(request_id), output, args))
+            return exit_code
+    except (ServerError, OSError) as error:
+        print(f'***Erro***: {error}')
+        return EXIT_CODES['io_error']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,460 +1,944 @@
-import re
+import argparse
+import array
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import json
 import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sml_image
+import sml_target
+from sml_target import (READ, WRITE, LOAD, STORE, ADD, SUBTRACT, DIVIDE, MULTIPLY, MODULE, BRANCH, BRANCHNEG, BRANCHZERO, HALT,
+                        BRANCH_OPCODES, Target, TARGETS, DEFAULT_TARGET)
+
+TOKEN_SPECIFICATION = [
+    ('LINE_NR', r'\d+'),
+    ('KW_INPUT', r'input'),
+    ('KW_LET', r'let'),
+    ('KW_PRINT', r'print'),
+    ('KW_GOTO', r'goto'),
+    ('KW_IF', r'if'),
+    ('KW_END', r'end'),
+    ('COMMENT', r'rem.*'),
+    ('WTSPACE', r'\s+'),  # Pular whitespace e comentários, tem que estar antes de identifier
+    ('IDENTIFIER', r'[a-z]'), # Tem que estar depois de tokens multi caractere
+    ('NUMBER', r'-?\d+'),
+    ('OPERATOR', r'[+\-*/%]'),
+    ('COMPARISON', r'>=|>|<=|<|==|!='), # Tem que estar antes de assign p/ ser avaliado corretamente
+    ('ASSIGN', r'='), # Tem que estar depois de comparison p/ não interferir em sua avaliação
+    ('PAREN', r'[()]'),
+]
+
+def build_master_regex(specification):
+    # Uma única regex com um grupo nomeado por tipo de token; a alternância do re tenta os grupos
+    # na ordem da lista, então a prioridade entre os padrões é a mesma de testá-los um a um
+    return re.compile('|'.join(f'(?P<{token_type}>{pattern})' for token_type, pattern in specification))
+
+# Compiladas uma vez por processo: no começo da linha LINE_NR é aceito, no resto da linha não.
+# O grupo i de TOKEN_REGEX é o tipo de código i (LINE_NR, o código 0, é o único que falta); em
+# LINE_START_REGEX, o grupo i é o código i - 1
+LINE_START_REGEX = build_master_regex(TOKEN_SPECIFICATION)
+TOKEN_REGEX = build_master_regex([spec for spec in TOKEN_SPECIFICATION if spec[0] != 'LINE_NR'])
 
-class Lexer:
-    def __init__(self, code):
+# Tipos de token como inteiros pequenos, na ordem de TOKEN_SPECIFICATION, com EOF no fim. As fases
+# comparam esses códigos; o nome só aparece no dump de depuração e nas mensagens de erro
+TOKEN_KINDS = tuple(token_type for token_type, _ in TOKEN_SPECIFICATION) + ('EOF',)
+(LINE_NR, KW_INPUT, KW_LET, KW_PRINT, KW_GOTO, KW_IF, KW_END, COMMENT, WTSPACE,
+ IDENTIFIER, NUMBER, OPERATOR, COMPARISON, ASSIGN, PAREN, EOF) = range(len(TOKEN_KINDS))
+NUMERIC_KINDS = tuple(code in (LINE_NR, NUMBER) for code in range(len(TOKEN_KINDS))) # Valor é um número
+
+
+# ========== Diagnósticos ==========:
+DEFAULT_MAX_ERRORS = 100 # Erros por compilação antes de interrompê-la (0: sem limite)
+
+class Diagnostic:
+    # Um erro de compilação: a fase, um código estável (p. ex. 'invalid_token'), a linha SIMPLE
+    # quando conhecida, o texto do token envolvido e a mensagem. str() dá a mensagem completa
+    def __init__(self, phase, code, message, line=None, token=None):
+        self.phase = phase
         self.code = code
-        self.tokens = []
-        self.token_specification = [
-            ('LINE_NR', r'\d+'),
-            ('KW_INPUT', r'input'),
-            ('KW_LET', r'let'),
-            ('KW_PRINT', r'print'),
-            ('KW_GOTO', r'goto'),
-            ('KW_IF', r'if'),
-            ('KW_END', r'end'),
-            ('COMMENT', r'rem.*'),
-            ('WTSPACE', r'\s+'),  # Pular whitespace e comentários, tem que estar antes de identifier
-            ('IDENTIFIER', r'[a-z]'), # Tem que estar depois de tokens multi caractere
-            ('NUMBER', r'-?\d+'),
-            ('OPERATOR', r'[+\-*/%]'),
-            ('COMPARISON', r'>=|>|<=|<|==|!='), # Tem que estar antes de assign p/ ser avaliado corretamente
-            ('ASSIGN', r'='), # Tem que estar depois de comparison p/ não interferir em sua avaliação
-        ]
+        self.message = message
+        self.line = line
+        self.token = token
+
+    def __str__(self):
+        return f'{self.phase}: {self.message}'
+
+    def as_dict(self):
+        return {'phase': self.phase, 'code': self.code, 'line': self.line, 'token': self.token, 'message': self.message}
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record['phase'], record['code'], record['message'], record['line'], record['token'])
+
+
+class TooManyErrors(Exception): # Interrompe a compilação quando o limite de erros é atingido
+    pass
+
+
+class Diagnostics:
+    # Limite e deduplicação compartilhados pelas fases de uma compilação. Um erro igual a outro já
+    # reportado (mesma fase, código, linha e token) não é repetido, só contado em suppressed
+    def __init__(self, max_errors=DEFAULT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.count = 0
+        self.suppressed = 0
+        self.seen = set()
+
+    def admit(self, record): # False se o erro é repetido
+        key = (record.phase, record.code, record.line, record.token)
+        if key in self.seen:
+            self.suppressed += 1
+            return False
+        self.seen.add(key)
+        self.count += 1
+        return True
+
+    @property
+    def exhausted(self):
+        return bool(self.max_errors) and self.count >= self.max_errors
+
+    def limit_record(self):
+        return Diagnostic('Compiler', 'too_many_errors', f'Limite de {self.max_errors} erros atingido, compilação interrompida')
+
+
+def collect_diagnostics(diagnostics, *phases): # Registros das fases, na ordem das fases
+    records = [record for phase in phases if phase for record in phase.records]
+    if diagnostics.exhausted:
+        records.append(diagnostics.limit_record())
+    return records
+
+
+class Phase:
+    # Base das fases de análise: acumula os erros (Diagnostic) e os imprime, a menos que quiet.
+    # As fases de uma compilação dividem um Diagnostics, que deduplica e interrompe a compilação
+    # com TooManyErrors quando o limite é atingido
+    name = 'Phase'
+
+    def __init__(self, quiet=False, diagnostics=None):
         self.error = False
+        self.records = []
+        self.quiet = quiet
+        self.diagnostics = diagnostics or Diagnostics(0)
+
+    @property
+    def messages(self):
+        return [str(record) for record in self.records]
+
+    def report(self, message, code, line=None, token=None): # Devolve o registro, ou None se era repetido
+        self.error = True
+        record = Diagnostic(self.name, code, message, line, token)
+        if not self.diagnostics.admit(record):
+            return None
+        self.records.append(record)
+        if not self.quiet:
+            print(f"\n***Erro***: {record}\n")
+        if self.diagnostics.exhausted:
+            raise TooManyErrors(self.diagnostics.max_errors)
+        return record
+
+
+class ParseError(SyntaxError): # Erro de sintaxe com o código do diagnóstico
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class SemanticError(RuntimeError): # Erro semântico com o código do diagnóstico e o token envolvido
+    def __init__(self, code, message, token=None):
+        super().__init__(message)
+        self.code = code
+        self.token = None if token is None else str(token)
+
+
+class Lexer(Phase):
+    name = 'Lexer'
+
+    def __init__(self, code, quiet=False, diagnostics=None):
+        super().__init__(quiet, diagnostics)
+        self.code = code # Texto, ou iterável de linhas (um arquivo aberto, lido aos poucos)
+        self.tokens = TokenTable()
+        self.token_specification = TOKEN_SPECIFICATION
+        self.line_nr = 1 # Texto do último LINE_NR, para as mensagens de erro
 
     def tokenize(self):
-        line_nr = 1
-        for linebuf in self.code.splitlines():
-            tk_pos = 0
-            while linebuf:
-                try:
-                    match = None
-                    for token_type, pattern in self.token_specification:
-                        regex = re.compile(pattern)
-                        match = regex.match(linebuf)
-                        if match:
-                            if token_type:
-                                if token_type == 'COMMENT': # Remover linhas de comentário
-                                    self.tokens.append((token_type, 'COMMENT'))
-                                    linebuf = linebuf[match.end():]
-                                    break
-                                if token_type == 'WTSPACE': # Pular tokens SKIP
-                                    linebuf = linebuf[match.end():]
-                                    break
-                                if tk_pos != 0 and token_type == 'LINE_NR': # Token só será LINE_NR se estiver no começo da linha
-                                    continue
-                                token_value = match.group(0)
-                                if token_type == 'LINE_NR': # Atualizar line_nr para as mensagens de erro
-                                    line_nr = token_value
-                                self.tokens.append((token_type, token_value))
-                            linebuf = linebuf[match.end():] # Remove tudo antes do fim do match do buffer
-                            break
-                    if not match:
-                        errmsg = f'Token inválido: \'{linebuf[0]}\', linha {line_nr}'
-                        raise SyntaxError(errmsg)
-                    tk_pos += 1
-                except SyntaxError as synerr:
-                    print(f"\n***Erro***: Lexer: {synerr}\n")
-                    self.error = True
-                    linebuf = linebuf[1:] # Remove o caracter atual do buffer
+        for linebuf in self.lines():
+            self.scan(linebuf, self.tokens)
         return self.tokens
 
+    def generate_tokens(self):
+        # Gera (código do tipo, valor) linha a linha, para o compile_stream: só os tokens da linha
+        # atual ficam na tabela de rascunho
+        line = TokenTable()
+        for linebuf in self.lines():
+            line.clear()
+            self.scan(linebuf, line)
+            for index in range(len(line)):
+                yield line.pair(index)
+
+    def lines(self):
+        # Um arquivo aberto é lido em blocos pelo próprio io: só a linha atual fica em memória. Cada
+        # pedaço passa por splitlines para separar as linhas exatamente como no texto inteiro
+        chunks = (self.code,) if isinstance(self.code, str) else self.code
+        for chunk in chunks:
+            yield from chunk.splitlines()
+
+    def scan(self, linebuf, table): # Acrescenta à tabela os tokens de uma linha
+        kinds, values = table.kinds.append, table.values.append
+        code = TOKEN_STRING_CODES.get
+        regex, shift = LINE_START_REGEX, 1 # Token só será LINE_NR se for o primeiro da linha
+        pos = 0
+        line_len = len(linebuf)
+        while pos < line_len:
+            match = regex.match(linebuf, pos)
+            if not match: # O resto da linha é descartado: lixo não gera um erro por caractere
+                line = int(self.line_nr) if str(self.line_nr).isdigit() else None
+                self.report(f"Token inválido: \'{linebuf[pos]}\', linha {self.line_nr}", 'invalid_token', line, linebuf[pos])
+                return
+            pos = match.end() # Avança a posição em vez de fatiar a linha
+            kind = match.lastindex - shift
+            regex, shift = TOKEN_REGEX, 0
+            if kind == WTSPACE: # Pular whitespace
+                continue
+            token_value = 'COMMENT' if kind == COMMENT else match.group() # Comentário consome o resto da linha
+            if kind == LINE_NR or kind == NUMBER:
+                if kind == LINE_NR: # Atualizar line_nr para as mensagens de erro
+                    self.line_nr = token_value
+                    table.line_starts.append(len(table.kinds))
+                if token_value[0] not in '-0' or token_value == '0' or token_value[0] == '-' and token_value[1] != '0':
+                    try:
+                        values(int(token_value))
+                        kinds(kind)
+                        continue
+                    except OverflowError:
+                        pass
+                table.raw[len(table.kinds)] = token_value # Número sem forma canônica ('007', '-0') ou grande demais
+                values(0)
+            else:
+                value = code(token_value)
+                values(intern_token(token_value) if value is None else value)
+            kinds(kind)
+
+
+TOKEN_STRINGS = [] # Valores de token que não são números, cada um guardado uma vez por processo
+TOKEN_STRING_CODES = {}
+
+def intern_token(text):
+    TOKEN_STRING_CODES[text] = len(TOKEN_STRINGS)
+    TOKEN_STRINGS.append(text)
+    return TOKEN_STRING_CODES[text]
+
 
-class Parser:
+class TokenTable:
+    # Tokens em arrays paralelos: o código do tipo (um byte) e um int, que é o próprio número em
+    # LINE_NR e NUMBER e o índice em TOKEN_STRINGS nos outros tipos (identificador, operador...).
+    # Números sem forma canônica ou fora do intervalo do array ficam em raw. line_starts guarda o
+    # índice de cada LINE_NR: o número da linha de um token fica só no LINE_NR que abre a linha.
+    # Indexar ou iterar a tabela devolve tuplas (nome do tipo, texto), como no dump de depuração
+    def __init__(self):
+        self.kinds = array.array('B')
+        self.values = array.array('i')
+        self.raw = {} # Índice -> texto do número
+        self.line_starts = array.array('I')
+
+    def append(self, kind, value): # value: int em LINE_NR e NUMBER, ou o texto como no Lexer
+        if kind == LINE_NR:
+            self.line_starts.append(len(self.kinds))
+        if not NUMERIC_KINDS[kind]:
+            self.values.append(TOKEN_STRING_CODES[value] if value in TOKEN_STRING_CODES else intern_token(value))
+        elif type(value) is int and -0x80000000 <= value <= 0x7fffffff:
+            self.values.append(value)
+        else:
+            self.raw[len(self.kinds)] = str(value)
+            self.values.append(0)
+        self.kinds.append(kind)
+
+    def clear(self):
+        del self.kinds[:], self.values[:], self.line_starts[:]
+        self.raw.clear()
+
+    def extend(self, other):
+        offset = len(self.kinds)
+        self.kinds.extend(other.kinds)
+        self.values.extend(other.values)
+        self.line_starts.extend(start + offset for start in other.line_starts)
+        for index, text in other.raw.items():
+            self.raw[index + offset] = text
+
+    def value(self, index): # int em LINE_NR e NUMBER (texto se não canônico), str nos outros tipos
+        return self.pair(index)[1]
+
+    def pair(self, index): # O token como as fases o leem: (código do tipo, valor)
+        kind = self.kinds[index]
+        if NUMERIC_KINDS[kind]:
+            return (kind, self.raw[index] if self.raw and index in self.raw else self.values[index])
+        return (kind, TOKEN_STRINGS[self.values[index]])
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): # Só passo 1: os tokens de algumas linhas, como no cache
+            start, stop, _ = index.indices(len(self.kinds))
+            table = TokenTable()
+            table.kinds = self.kinds[start:stop]
+            table.values = self.values[start:stop]
+            first, last = bisect.bisect_left(self.line_starts, start), bisect.bisect_left(self.line_starts, stop)
+            table.line_starts = array.array('I', (line_start - start for line_start in self.line_starts[first:last]))
+            table.raw = {position - start: text for position, text in self.raw.items() if start <= position < stop}
+            return table
+        if index < 0:
+            index += len(self.kinds)
+        return token_tuple(self.pair(index))
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield token_tuple(self.pair(index))
+
+
+def token_tuple(token): # (nome do tipo, texto), a forma usada no dump de depuração e nas mensagens
+    return (TOKEN_KINDS[token[0]], str(token[1]))
+
+
+EOF_TOKEN = (EOF, 'EOF')
+
+class TokenStream:
+    # Cursor sobre uma TokenTable compartilhada: as fases só leem a tabela e avançam o próprio
+    # índice, em vez de consumir (pop(0)) ou copiar os tokens
     def __init__(self, tokens):
         self.tokens = tokens
+        self.pos = 0
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens) - self.pos # Tokens ainda não consumidos
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        if index < len(self.tokens):
+            return self.tokens.pair(index)
+        return EOF_TOKEN
+
+    def advance(self):
+        index = self.pos
+        if index < len(self.tokens):
+            self.pos = index + 1
+            return self.tokens.pair(index)
+        return EOF_TOKEN
+
+    def mark(self):
+        return self.pos
+
+    def reset(self, mark):
+        self.pos = mark
+
+
+class TokenPipe:
+    # Como TokenStream, mas sobre um gerador de tokens: só os tokens já pedidos e ainda não
+    # consumidos ficam em memória, então o Parser lê o fonte enquanto o Lexer o produz
+    def __init__(self, tokens):
+        self.source = iter(tokens)
+        self.buffer = collections.deque()
+        self.count = 0 # Tokens já produzidos pelo gerador
+
+    def fill(self, size):
+        while len(self.buffer) < size:
+            token = next(self.source, None)
+            if token is None:
+                return False
+            self.buffer.append(token)
+            self.count += 1
+        return True
+
+    def peek(self, offset=0):
+        if self.fill(offset + 1):
+            return self.buffer[offset]
+        return EOF_TOKEN
+
+    def advance(self):
+        token = self.peek()
+        if self.buffer:
+            self.buffer.popleft()
+        return token
+
+    def drain(self): # Consome o resto do gerador (o Lexer ainda reporta os erros depois do 'end')
+        self.buffer.clear()
+        for _ in self.source:
+            self.count += 1
+
+
+# ========== AST ==========:
+# Uma instrução por linha SIMPLE; expressões são árvores de Num, Var e BinOp
+
+class Node:
+    __slots__ = ()
+
+    def __init__(self, *args):
+        for slot, value in zip(self.__slots__, args):
+            setattr(self, slot, value)
+
+    def fields(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __hash__(self):
+        return hash((type(self), self.fields()))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(repr(field) for field in self.fields())})"
+
+
+class Num(Node):
+    __slots__ = ('value',)
+
+class Var(Node):
+    __slots__ = ('name',)
+
+class BinOp(Node):
+    __slots__ = ('op', 'left', 'right')
+
+class Input(Node):
+    __slots__ = ('line', 'var')
+
+class Let(Node):
+    __slots__ = ('line', 'var', 'expr')
+
+class Print(Node):
+    __slots__ = ('line', 'var')
+
+class If(Node):
+    __slots__ = ('line', 'left', 'comp', 'right', 'target')
+
+class Goto(Node):
+    __slots__ = ('line', 'target')
+
+class Rem(Node): # Comentário ou linha sem instrução
+    __slots__ = ('line',)
+
+class End(Node):
+    __slots__ = ('line',)
+
+
+def mentions(expr, var): # A expressão lê a variável?
+    if isinstance(expr, Var):
+        return expr.name == var
+    if isinstance(expr, BinOp):
+        return mentions(expr.left, var) or mentions(expr.right, var)
+    return False
+
+
+MAX_NESTING = 100 # Parênteses aninhados numa expressão; o parser é recursivo
+
+class Parser(Phase):
+    name = 'Parser'
+
+    def __init__(self, tokens, quiet=False, diagnostics=None):
+        super().__init__(quiet, diagnostics)
+        self.tokens = TokenStream(tokens) if isinstance(tokens, TokenTable) else TokenPipe(tokens)
         self.current_token = None
         self.next_token()
         self.current_line = 1
-        self.error = False
+        self.depth = 0 # Parênteses abertos na expressão atual
+        self.program = [] # AST: lista de instruções, na ordem do código fonte
 
     def next_token(self):
-        if len(self.tokens) > 0:
-            self.current_token = self.tokens.pop(0)
-        else:
-            self.current_token = ('EOF', 'EOF')
+        self.current_token = self.tokens.advance()
 
     def parse_program(self):
-        while self.current_token[0] != 'EOF' and self.current_token[0] != 'KW_END':
+        self.program.extend(self.parse_statements())
+        return self.program
+
+    def parse_statements(self): # Gera cada instrução assim que ela é lida
+        while self.current_token[0] != EOF and self.current_token[0] != KW_END:
             try:
-                self.parse_keyword()
-            except SyntaxError as synerr:
-                print(f"\n***Erro***: Parser: {synerr}\n")
-                self.error = True
-                self.next_token()
-        try:
-            if self.current_token[0] == 'EOF': 
-                raise SyntaxError(f"\"end\" esperado após linha: {self.current_line}")
-        except SyntaxError as synerr:
-            print(f"\n***Erro***: Parser: {synerr}\n")
-            self.error = True
+                statement = self.parse_keyword()
+            except ParseError as synerr:
+                self.report(str(synerr), synerr.code, self.current_line, str(self.current_token[1]))
+                self.depth = 0
+                self.skip_line()
+                continue
+            yield statement
+        if self.current_token[0] == EOF:
+            self.report(f"\"end\" esperado após linha: {self.current_line}", 'missing_end', self.current_line)
 
+    def skip_line(self): # Recuperação de erro: descarta os tokens até o começo da próxima linha
+        while self.current_token[0] != LINE_NR and self.current_token[0] != EOF:
+            self.next_token()
 
     def parse_keyword(self):
-        if self.current_token[0] == 'LINE_NR':
+        if self.current_token[0] == LINE_NR:
             self.current_line = int(self.current_token[1])
             self.next_token()
-            if self.current_token[0] == 'KW_INPUT':
-                self.parse_input()
-            elif self.current_token[0] == 'KW_LET':
-                self.parse_assign()
-            elif self.current_token[0] == 'KW_PRINT':
-                self.parse_print()
-            elif self.current_token[0] == 'KW_IF':
-                self.parse_cond()
-            elif self.current_token[0] == 'KW_GOTO':
-                self.parse_goto()
-            elif self.current_token[0] == 'COMMENT':
+            if self.current_token[0] == KW_INPUT:
+                statement = self.parse_input()
+            elif self.current_token[0] == KW_LET:
+                statement = self.parse_assign()
+            elif self.current_token[0] == KW_PRINT:
+                statement = self.parse_print()
+            elif self.current_token[0] == KW_IF:
+                statement = self.parse_cond()
+            elif self.current_token[0] == KW_GOTO:
+                statement = Goto(self.current_line, self.parse_goto())
+            elif self.current_token[0] == COMMENT:
                 self.next_token()
-                return
-            elif self.current_token[0] == 'LINE_NR':
-                return
-            elif self.current_token[0] == 'KW_END':
-                return
-            elif self.current_token[0] == 'EOF':
-                raise SyntaxError(f"\"end\" esperado após linha: {self.current_line}")
+                statement = Rem(self.current_line)
+            elif self.current_token[0] == LINE_NR:
+                statement = Rem(self.current_line)
+            elif self.current_token[0] == KW_END:
+                statement = End(self.current_line)
+            elif self.current_token[0] == EOF:
+                raise ParseError('missing_end', f"\"end\" esperado após linha: {self.current_line}")
             else:
-                raise SyntaxError(f"Token inesperado: '{self.current_token}', linha: {self.current_line}")
+                raise ParseError('unexpected_token', f"Token inesperado: '{token_tuple(self.current_token)}', linha: {self.current_line}")
+            return statement
         else:
-            raise SyntaxError(f"Token inesperado: '{self.current_token}', linha: {self.current_line}")
+            raise ParseError('unexpected_token', f"Token inesperado: '{token_tuple(self.current_token)}', linha: {self.current_line}")
 
-    def parse_input(self):
+    def parse_target(self): # Variável que recebe o valor em input e let
         self.next_token()
-        if self.current_token[0] == 'IDENTIFIER':
+        if self.current_token[0] == IDENTIFIER:
+            var = self.current_token[1]
             self.next_token()
-        else:
-            raise SyntaxError(f"Identificador esperado após input ou let, linha: {self.current_line}")
+            return var
+        raise ParseError('expected_identifier', f"Identificador esperado após input ou let, linha: {self.current_line}")
+
+    def parse_input(self):
+        return Input(self.current_line, self.parse_target())
 
     def parse_assign(self):
-        self.parse_input()
-        if self.current_token[0] == 'ASSIGN':
-            self.next_token()
-            self.parse_expr()
+        var = self.parse_target()
+        if self.current_token[0] != ASSIGN:
+            raise ParseError('expected_assign', f"'=' esperado após identificador, linha: {self.current_line}")
+        self.next_token()
+        return Let(self.current_line, var, self.parse_expr())
 
     def parse_print(self):
         self.next_token()
-        if self.current_token[0] == 'IDENTIFIER':
+        if self.current_token[0] == IDENTIFIER:
+            var = self.current_token[1]
             self.next_token()
-        else:
-            raise SyntaxError(f"Identificador esperado após 'print', linha: {self.current_line}")
+            return Print(self.current_line, var)
+        raise ParseError('expected_identifier', f"Identificador esperado após 'print', linha: {self.current_line}")
 
     def parse_cond(self):
         self.next_token()
-        self.parse_expr()
-        if self.current_token[0] == 'COMPARISON':
+        left = self.parse_expr()
+        if self.current_token[0] == COMPARISON:
+            comp = self.current_token[1]
             self.next_token()
-            self.parse_expr()
-            if self.current_token[0] == 'KW_GOTO':
-                self.parse_goto()
+            right = self.parse_expr()
+            if self.current_token[0] == KW_GOTO:
+                return If(self.current_line, left, comp, right, self.parse_goto())
             else:
-                raise SyntaxError(f"'goto' esperado após condicional, linha: {self.current_line}, token: {self.current_token}")
+                raise ParseError('expected_goto', f"'goto' esperado após condicional, linha: {self.current_line}, token: {token_tuple(self.current_token)}")
         else:
-            raise SyntaxError(f"Operador de comparação esperado (>, >=, <, <=, ==, !=), linha: {self.current_line}, token: {self.current_token}")
+            raise ParseError('expected_comparison', f"Operador de comparação esperado (>, >=, <, <=, ==, !=), linha: {self.current_line}, token: {token_tuple(self.current_token)}")
 
-    def parse_goto(self):
+    def parse_goto(self): # Retorna a linha alvo
         self.next_token()
-        if self.current_token[0] == 'NUMBER':
+        if self.current_token[0] == NUMBER:
+            target = int(self.current_token[1])
             self.next_token()
+            return target
         else:
-            raise SyntaxError(f"Número da linha esperado após 'goto', linha: {self.current_line}")
+            raise ParseError('expected_line_number', f"Número da linha esperado após 'goto', linha: {self.current_line}")
 
+    # Expressões com precedência: * / % antes de + -, da esquerda para a direita, e parênteses
     def parse_expr(self):
-        self.parse_factor()
-        if self.current_token[0] == 'OPERATOR':
+        expr = self.parse_term()
+        while True:
+            if self.current_token[0] == OPERATOR and self.current_token[1] in '+-':
+                op = self.current_token[1]
+                self.next_token()
+                expr = BinOp(op, expr, self.parse_term())
+            elif self.current_token[0] == NUMBER and str(self.current_token[1])[0] == '-':
+                # 'a-1' chega como identificador e número negativo: é uma subtração
+                number = Num(int(str(self.current_token[1])[1:]))
+                self.next_token()
+                expr = BinOp('-', expr, self.parse_term(number))
+            else:
+                return expr
+
+    def parse_term(self, factor=None):
+        expr = factor or self.parse_factor()
+        while self.current_token[0] == OPERATOR and self.current_token[1] in '*/%':
+            op = self.current_token[1]
             self.next_token()
-            self.parse_factor()
+            expr = BinOp(op, expr, self.parse_factor())
+        return expr
 
     def parse_factor(self):
-        if self.current_token[0] in ['IDENTIFIER', 'NUMBER']:
+        if self.current_token[0] == IDENTIFIER:
+            factor = Var(self.current_token[1])
+        elif self.current_token[0] == NUMBER:
+            factor = Num(int(self.current_token[1]))
+        elif self.current_token[0] == PAREN and self.current_token[1] == '(':
+            if self.depth >= MAX_NESTING:
+                raise ParseError('nesting_too_deep', f"Mais de {MAX_NESTING} parênteses aninhados, linha: {self.current_line}")
             self.next_token()
+            self.depth += 1
+            factor = self.parse_expr()
+            self.depth -= 1
+            if self.current_token[0] != PAREN or self.current_token[1] != ')':
+                raise ParseError('expected_paren', f"')' esperado, linha: {self.current_line}, token: {token_tuple(self.current_token)}")
         else:
-            raise SyntaxError(f"Identificador ou número esperado, linha: {self.current_line}, token: {self.current_token}")
+            raise ParseError('expected_operand', f"Identificador ou número esperado, linha: {self.current_line}, token: {token_tuple(self.current_token)}")
+        self.next_token()
+        return factor
 
 
-class SemanticAnalyzer:
-    def __init__(self, tokens):
+class SemanticAnalyzer(Phase):
+    name = 'SemanticAnalyzer'
+
+    def __init__(self, program, quiet=False, diagnostics=None):
+        super().__init__(quiet, diagnostics)
         self.current_line = None
         self.last_line = 1 # Última linha analisada
-        self.valid_lines = [] # Armazena todas as linhas válidas
-        self.read_lines = [] # Armazena todas as linhas já lidas
-        self.tokens = tokens
-        self.current_token = None
+        self.valid_lines = set() # Armazena todas as linhas válidas
+        self.read_lines = set() # Armazena todas as linhas já lidas
+        self.program = program
         self.symbol_table = []
-        self.error = False
+        self.held = None # Em analyze_statements: alvos ainda não lidos e os erros reportados depois deles
+        self.held_keys = set() # Erros distintos em held
+        self.analyzers = {
+            Input: self.analyze_input,
+            Let: self.analyze_let,
+            Print: self.analyze_print,
+            If: self.analyze_if,
+            Goto: self.analyze_goto,
+        }
 
     def collect_valid_lines(self):
         # Recolhe todas as linhas válidas
-        for token in self.tokens:
-            if token[0] == 'LINE_NR':
-                self.valid_lines.append(int(token[1]))
-
-    def next_token(self):
-        if len(self.tokens) > 0:
-            self.current_token = self.tokens.pop(0)
-        else:
-            self.current_token = ('EOF', 'EOF')
+        for statement in self.program:
+            self.valid_lines.add(statement.line)
 
     def analyze_program(self):
         self.collect_valid_lines() # Coletar todas as linhas válidas antes da análise
-        self.next_token()
-        while self.current_token[0] != 'EOF' and self.current_token[0] != 'KW_END':
-            try:
-                if self.current_token[0] == 'LINE_NR':
-                    self.current_line = int(self.current_token[1])
-                    if self.current_line < self.last_line: 
-                        print(f"\n***Erro***: SemanticAnalyzer: Número de linha fora de ordem: {self.current_line}")
-                        self.error = True
-                    try:
-                        if self.current_line in self.read_lines:
-                            raise RuntimeError(f"Linha Duplicada: {self.current_line}")
-                    except RuntimeError as semerr:
-                        print(f"\n***Erro***: SemanticAnalyzer: {semerr}\n")
-                        self.error = True
-                    self.read_lines.append(self.current_line)
-                    self.next_token()
-                    self.analyze_keyword()
-                    self.last_line = self.current_line
-                    
-                else:
-                    self.next_token()
-            except RuntimeError as semerr:
-                print(f"\n***Erro***: SemanticAnalyzer: {semerr}\n")
-                self.error = True
-
-    def analyze_keyword(self):
-        if self.current_token[0] == 'KW_INPUT':
-            self.analyze_input()
-        elif self.current_token[0] == 'KW_LET':
-            self.analyze_let()
-        elif self.current_token[0] == 'KW_PRINT':
-            self.analyze_print()
-        elif self.current_token[0] == 'KW_IF':
-            self.analyze_if()
-        elif self.current_token[0] == 'KW_GOTO':
-            self.analyze_goto()
-        elif self.current_token[0] == 'COMMENT':
-            self.next_token()
-            return
-        elif self.current_token[0] == 'LINE_NR':
-            return
-        elif self.current_token[0] == 'KW_END':
-            return
-        else:
-            raise RuntimeError(f"Token inesperado '{self.current_token}', linha {self.current_line}")
+        for statement in self.program:
+            self.analyze_statement(statement)
 
-    def analyze_input(self):
-        self.next_token()
-        if self.current_token[0] == 'IDENTIFIER':
-            var_name = self.current_token[1]
-            if var_name not in self.symbol_table:
-                self.symbol_table.append(var_name)
-            self.next_token()
-        else:
-            raise RuntimeError(f"Identificador esperado após 'input', linha {self.current_line}")
+    def analyze_statements(self, statements):
+        # Análise em streaming: cada instrução é analisada e repassada assim que chega. Um desvio
+        # pode apontar para uma linha que ainda não foi lida: o alvo e os erros que vêm depois dele
+        # esperam em held até a linha aparecer ou o fonte acabar (check_pending_targets). Assim os
+        # erros são contados na ordem de analyze_program, que decide quais cabem em max_errors
+        self.held = collections.deque()
+        for statement in statements:
+            self.valid_lines.add(statement.line)
+            self.release()
+            self.analyze_statement(statement)
+            yield statement
 
-    def analyze_let(self):
-        self.next_token()
-        if self.current_token[0] == 'IDENTIFIER':
-            var_name = self.current_token[1]
-            if var_name not in self.symbol_table:
-                self.symbol_table.append(var_name)
-            self.next_token()
-            if self.current_token[0] == 'ASSIGN':
-                self.next_token()
-                self.analyze_expr()
-            else:
-                raise RuntimeError(f"'=' esperado após identificador, linha {self.current_line}")
-        else:
-            raise RuntimeError(f"Identificador esperado após 'let', linha {self.current_line}")
+    def check_pending_targets(self):
+        self.release(final=True)
 
-    def analyze_print(self):
-        self.next_token()
-        if self.current_token[0] == 'IDENTIFIER':
-            var_name = self.current_token[1]
-            if var_name not in self.symbol_table:
-                raise RuntimeError(f"Variável '{var_name}' não inicializada, linha {self.current_line}")
-            self.next_token()
-        else:
-            raise RuntimeError(f"Identificador esperado após 'print', linha {self.current_line}")
+    def release(self, final=False): # Reporta os erros que não esperam mais por um alvo
+        while self.held:
+            target, args = self.held[0]
+            if target is not None and target not in self.valid_lines and not final:
+                return
+            self.held.popleft()
+            if target is None:
+                self.held_keys.discard((self.name, args[1], args[2], args[3]))
+            elif target in self.valid_lines:
+                continue
+            super().report(*args)
 
-    def analyze_if(self):
-        self.next_token()
-        self.analyze_expr()
-        if self.current_token[0] == 'COMPARISON':
-            self.next_token()
-            self.analyze_expr()
-            if self.current_token[0] == 'KW_GOTO':
-                self.analyze_goto()
-            else:
-                raise RuntimeError(f"'Goto' esperado após expressão condicional, linha {self.current_line}")
-        else:
-            raise RuntimeError(f"Operador de comparação esperado após expressão, linha {self.current_line}")
+    def report(self, message, code, line=None, token=None):
+        if not self.held:
+            return super().report(message, code, line, token)
+        self.error = True
+        key = (self.name, code, line, token)
+        if key not in self.held_keys and key not in self.diagnostics.seen:
+            if self.diagnostics.max_errors and len(self.held_keys) >= self.diagnostics.max_errors - self.diagnostics.count:
+                return None # Os erros já retidos esgotam o limite antes deste
+            self.held_keys.add(key)
+        self.held.append((None, (message, code, line, token)))
+        return None
 
-    def analyze_goto(self):
-        self.next_token()
-        if self.current_token[0] != 'NUMBER':
-            raise RuntimeError(f"Número esperado após 'goto', linha {self.current_line}")
-        line_number = int(self.current_token[1])
+    def analyze_statement(self, statement):
+        try:
+            self.current_line = statement.line
+            if self.current_line < self.last_line:
+                self.report(f"Número de linha fora de ordem: {self.current_line}", 'line_order', self.current_line)
+            if self.current_line in self.read_lines:
+                self.report(f"Linha Duplicada: {self.current_line}", 'duplicate_line', self.current_line)
+            self.read_lines.add(self.current_line)
+            self.last_line = self.current_line # Mesmo que a análise da instrução falhe abaixo
+            analyzer = self.analyzers.get(type(statement))
+            if analyzer: # Rem e End não têm o que analisar
+                analyzer(statement)
+        except SemanticError as semerr:
+            self.report(str(semerr), semerr.code, self.current_line, semerr.token)
+
+    def add_symbol(self, var_name):
+        if var_name not in self.symbol_table:
+            self.symbol_table.append(var_name)
+
+    def analyze_input(self, statement):
+        self.add_symbol(statement.var)
+
+    def analyze_let(self, statement):
+        self.add_symbol(statement.var)
+        self.analyze_expr(statement.expr)
+
+    def analyze_print(self, statement):
+        self.check_initialized(statement.var)
+
+    def analyze_if(self, statement):
+        self.analyze_expr(statement.left)
+        self.analyze_expr(statement.right)
+        self.check_target(statement.target)
+
+    def analyze_goto(self, statement):
+        self.check_target(statement.target)
+
+    def check_target(self, line_number):
         if line_number <= 0:
-            raise RuntimeError(f"Número da linha inválido após 'goto', linha {self.current_line}")
-        if line_number not in self.valid_lines: # Verifica se o número da linha existe
-            raise RuntimeError(f"Linha {line_number} não existe, linha {self.current_line}")
-        self.next_token()
+            raise SemanticError('invalid_target', f"Número da linha inválido após 'goto', linha {self.current_line}", line_number)
+        if line_number not in self.valid_lines and self.held is not None: # A linha ainda pode aparecer
+            self.held.append((line_number, (f"Linha {line_number} não existe, linha {self.current_line}", 'undefined_line', self.current_line, str(line_number))))
+        elif line_number not in self.valid_lines: # Verifica se o número da linha existe
+            raise SemanticError('undefined_line', f"Linha {line_number} não existe, linha {self.current_line}", line_number)
 
-    def analyze_expr(self):
-        if self.current_token[0] == 'IDENTIFIER':
-            self.check_initialized(self.current_token[1])
-            self.next_token()
-            self.analyze_op()
-        elif self.current_token[0] == 'NUMBER':
-            self.next_token()
-            self.analyze_op()
-        else:
-            raise RuntimeError(f"Identificador ou número esperado, linha {self.current_line}")
+    def analyze_expr(self, expr):
+        if isinstance(expr, Var):
+            self.check_initialized(expr.name)
+        elif isinstance(expr, BinOp):
+            self.analyze_expr(expr.left)
+            if expr.op == '/' and expr.right == Num(0):
+                raise SemanticError('division_by_zero', f"Divisão por zero, linha {self.current_line}")
+            self.analyze_expr(expr.right)
 
-    def check_initialized(self, var_name): # Deve ser usada só com variáveis ('IDENTIFIER's), passando o nome (self.current_token[1])
+    def check_initialized(self, var_name):
         if var_name not in self.symbol_table:
-            raise RuntimeError(f"Variável '{var_name}' não inicializada, linha {self.current_line}")
+            raise SemanticError('uninitialized_variable', f"Variável '{var_name}' não inicializada, linha {self.current_line}", var_name)
 
-    def analyze_op(self):
-        if self.current_token[0] == 'OPERATOR':
-            if self.current_token[1] == '/':
-                self.next_token()
-                if self.current_token[0] == 'IDENTIFIER':
-                    self.check_initialized(self.current_token[1])
-                    self.next_token()
-                elif self.current_token[0] == 'NUMBER':
-                    if self.current_token[1] == '0':
-                        raise RuntimeError(f"Divisão por zero, linha {self.current_line}")
-                    self.next_token()
-                else:
-                    raise RuntimeError(f"Identificador ou número esperado, linha {self.current_line}")
-            else:
-                self.next_token()
-                if self.current_token[0] == 'IDENTIFIER':
-                    self.check_initialized(self.current_token[1])
-                    self.next_token()
-                elif self.current_token[0] == 'NUMBER':
-                    self.next_token()
-                else:
-                    raise RuntimeError(f"Identificador ou número esperado, linha {self.current_line}")
 
+# Opcodes da SML e perfis da máquina alvo (Target, TARGETS) vêm de sml_target
+ARITHMETIC_OPCODES = {'+': ADD, '-': SUBTRACT, '/': DIVIDE, '*': MULTIPLY, '%': MODULE}
+
+# Referências simbólicas dos operandos, resolvidas na relocação:
+#   ('C', valor) constante, ('V', nome) variável, ('B', linha) linha SIMPLE, ('L', id) label interno
+
+UNINITIALIZED = -7777 # Valor inicial das vars
 
 class CodeGen:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.current_token = None
-        self.code = []
-        self.vars = []
-        self.consts = []
-        self.equiv_lines = {}
+    def __init__(self, program, opt_level=0, target=DEFAULT_TARGET):
+        self.program = program
+        self.opt_level = opt_level # 0: sem otimizações
+        self.target = target # Perfil da máquina: largura das palavras e dos endereços
+        self.instructions = [] # Instruções antes da relocação: (opcode, referência ou None)
+        self.code = [] # Palavras SML, preenchido na relocação
+        self.vars = {} # Nome -> endereço
+        self.consts = {} # Valor -> endereço
+        self.equiv_lines = {} # Linha SIMPLE -> endereço da primeira instrução
+        self.labels = {} # Label interno -> endereço
+        self.fixups = {} # Referência -> índices das instruções que a usam
+        self.aliases = {} # Var -> referência do endereço que ela divide com outro símbolo
+        self.opt_stats = {} # Resultados das otimizações, para o relatório
+        self.acc = set() # Expressões cujo valor está no acumulador (só rastreado com opt_level >= 1)
+        self.free_temps = [] # Temporários liberados, reaproveitados pela próxima subexpressão
+        self.temp_count = 0
+        self.targets = set() # Linhas alvo de desvio
+        self.branches = BranchLowering(self)
+        self.profiler = None # CompileProfiler opcional: tempo e memória das fases e tamanho antes/depois de cada passe
+        self.generators = {
+            Input: self.read_input,
+            Let: self.read_let,
+            Print: self.read_print,
+            If: self.read_if,
+            Goto: self.read_goto,
+            End: self.read_end,
+        }
 
-    def next_token(self):
-        if len(self.tokens) > 0:
-            self.current_token = self.tokens.pop(0)
-        else:
-            self.current_token = ('EOF', 'EOF')
+    def emit(self, opcode, ref=None):
+        self.instructions.append((opcode, ref))
+
+    def new_label(self): # Label interno, ligado depois com bind_label
+        label = ('L', len(self.labels))
+        self.labels[label[1]] = None
+        return label
+
+    def bind_label(self, label):
+        self.labels[label[1]] = len(self.instructions)
 
-    def add_var_to_list(self):
-        if self.current_token[0] == 'IDENTIFIER':
-            # self.vars[self.current_token[1]] = None
-            if self.current_token[1] not in self.vars:
-                self.vars.append(self.current_token[1])
+    def remove_instructions(self, keep):
+        # Remove as instruções marcadas com False; um alvo que apontava para uma instrução removida
+        # passa a apontar para a primeira instrução mantida depois dela
+        new_index = []
+        kept = 0
+        for flag in keep:
+            new_index.append(kept)
+            kept += flag
+        new_index.append(kept)
+        self.instructions[:] = [instruction for instruction, flag in zip(self.instructions, keep) if flag]
+        for targets in (self.equiv_lines, self.labels):
+            for key, address in targets.items():
+                targets[key] = new_index[address]
+
+    def memory_words(self): # Palavras que o programa ocupará: instruções + consts e vars referenciadas
+        return len(self.instructions) + len({ref for _, ref in self.instructions if ref and ref[0] in 'CV'})
+
+    def add_var_to_list(self, var):
+        if var not in self.vars:
+            self.vars[var] = None
+
+    def operand(self, expr):
+        if isinstance(expr, Num):
+            if expr.value not in self.consts:
+                self.consts[expr.value] = None
+            return ('C', expr.value)
+        return ('V', expr.name)
 
     def read_program(self):
-        self.next_token()
-        while self.current_token[0] != 'EOF' and self.current_token[0] != 'KW_END':
-            if self.current_token[0] == 'LINE_NR':
-                self.equiv_lines[self.current_token[1]] = len(self.code)
-                self.next_token()
-                self.read_keyword()
-            else:
-                self.next_token()
+        with profile_phase(self.profiler, 'codegen'):
+            program = self.optimize_program()
+            self.targets = {statement.target for statement in program if isinstance(statement, (If, Goto))}
+            self.read_statements(program)
+        with profile_phase(self.profiler, 'optimization'):
+            self.optimize()
+        with profile_phase(self.profiler, 'relocation'):
+            self.proc_end()
 
-    def read_keyword(self):
-        if self.current_token[0] == 'KW_INPUT':
-            self.read_input()
-        elif self.current_token[0] == 'KW_LET':
-            self.read_let()
-        elif self.current_token[0] == 'KW_PRINT':
-            self.read_print()
-        elif self.current_token[0] == 'KW_IF':
-            self.read_if()
-        elif self.current_token[0] == 'KW_GOTO':
-            self.read_goto()
-        elif self.current_token[0] == 'COMMENT':
-            self.next_token()
-        elif self.current_token[0] == 'LINE_NR':
+    def read_statements(self, statements): # statements pode ser um gerador: no nível 0 cada instrução só é vista uma vez
+        for statement in statements:
+            if statement.line in self.targets: # Chega-se aqui por desvio: nada se sabe sobre o acumulador
+                self.acc = set()
+            if statement.line is not None: # Instruções criadas por LoopOptimizer não têm linha própria
+                self.equiv_lines[statement.line] = len(self.instructions)
+            generator = self.generators.get(type(statement))
+            if generator: # Rem não gera código
+                generator(statement)
+
+    def optimize_program(self): # Passes sobre a AST, antes da geração de código
+        program = self.program
+        if self.opt_level >= 2:
+            program = self.ast_pass('constant_folding', ConstantFolder(program, self.target).run, program)
+        if self.opt_level >= 3:
+            loops = LoopOptimizer(program)
+            program = self.ast_pass('loop_optimization', loops.run, program)
+            self.opt_stats['hoisted'] = loops.hoisted
+        if self.opt_level >= 1:
+            program = self.ast_pass('branch_merging', lambda: BranchLowering.merge_gotos(program), program)
+        return program
+
+    def optimize(self): # Passes sobre as instruções ainda não relocadas
+        if self.opt_level >= 1:
+            self.instruction_pass('peephole', Peephole(self).run)
+        if self.opt_level >= 2:
+            self.instruction_pass('slot_allocation', SlotAllocator(self).run)
+            self.instruction_pass('peephole', Peephole(self).run) # Vars no endereço de uma const podem tornar loads/stores redundantes
+
+    def ast_pass(self, name, run, program): # O tamanho é o número de instruções SIMPLE que geram código
+        start = time.perf_counter()
+        result = run()
+        if self.profiler:
+            size = lambda statements: sum(not isinstance(statement, Rem) for statement in statements)
+            self.profiler.record_pass(name, 'statements', size(program), size(result), time.perf_counter() - start)
+        return result
+
+    def instruction_pass(self, name, run):
+        before = len(self.instructions)
+        start = time.perf_counter()
+        run()
+        if self.profiler:
+            self.profiler.record_pass(name, 'instructions', before, len(self.instructions), time.perf_counter() - start)
+
+    def memory_usage(self): # Palavras ocupadas por código, consts e vars, depois da relocação
+        consts = sum(('C', const) in self.fixups for const in self.consts)
+        return {'code': len(self.instructions), 'consts': consts, 'vars': len(self.data) - consts, 'total': len(self.code)}
+
+    def read_input(self, statement):
+        self.add_var_to_list(statement.var)
+        self.emit(READ, ('V', statement.var))
+        self.acc = {expr for expr in self.acc if not mentions(expr, statement.var)}
+
+    def read_let(self, statement):
+        self.add_var_to_list(statement.var)
+        self.read_expr(statement.expr)
+        self.emit(STORE, ('V', statement.var))
+        if self.opt_level >= 1:
+            self.acc = {Var(statement.var)}
+            if not mentions(statement.expr, statement.var):
+                self.acc.add(statement.expr)
+
+    def read_expr(self, expr): # Deixa o valor da expressão no acumulador
+        if expr in self.acc:
             return
-        elif self.current_token[0] == 'KW_END':
-            self.proc_end()
+        if not isinstance(expr, BinOp):
+            self.emit(LOAD, self.operand(expr))
+        else:
+            first, second = self.evaluation_order(expr)
+            if isinstance(second, BinOp): # O operando da direita precisa estar na memória
+                self.read_expr(second)
+                temp = self.new_temp()
+                self.emit(STORE, temp)
+                self.read_expr(first)
+                self.emit(ARITHMETIC_OPCODES[expr.op], temp)
+                self.free_temps.append(temp)
+            else:
+                self.read_expr(first)
+                self.emit(ARITHMETIC_OPCODES[expr.op], self.operand(second))
+        if self.opt_level >= 1:
+            self.acc = {expr}
 
-    def read_input(self):
-        self.next_token()
-        self.add_var_to_list()
-        self.code.append(f'+10{self.current_token[1]}')
-
-    def read_let(self):
-        self.next_token() # var
-        self.add_var_to_list()
-        var = self.current_token[1]
-        self.next_token() # '='
-        self.next_token() # arg1
-        if self.current_token[0] == 'NUMBER':
-            num1 = int(self.current_token[1])
-        else: # se arg1 for variável:
-            arg1 = self.current_token[1]
-        self.next_token() # op
-        
-        if self.current_token[0] != 'OPERATOR': # Se tivermos o formato 'let var = arg1':
-            if 'num1' in locals(): # Se arg1 é número:
-                if num1 not in self.consts:
-                    self.consts.append(int(num1))
-                self.code.append(f'+20C{self.consts.index(num1)}')
-            elif 'arg1' in locals(): # Se arg1 é var:
-                self.code.append(f'+20{arg1}')
-            self.code.append(f'+21{var}')
-
-        else: # Se tivermos o formato 'let var = arg1 op arg2':
-            op = self.current_token[1]
-            self.next_token() # arg2
-            if 'num1' in locals(): # Se arg1 é número:
-                if num1 not in self.consts:
-                    self.consts.append(int(num1))
-                self.code.append(f'+20C{self.consts.index(int(num1))}')
-            elif 'arg1' in locals(): # Se arg1 é var:
-                self.code.append(f'+20{arg1}')
-            if self.current_token[0] == 'NUMBER': # Se arg2 é número:
-                if int(self.current_token[1]) not in self.consts:
-                    self.consts.append(int(self.current_token[1]))
-                match op:
-                    case '+':
-                        self.code.append(f'+30C{self.consts.index(int(self.current_token[1]))}')
-                    case '-':
-                        self.code.append(f'+31C{self.consts.index(int(self.current_token[1]))}')
-                    case '*':
-                        self.code.append(f'+33C{self.consts.index(int(self.current_token[1]))}')
-                    case '/':
-                        self.code.append(f'+32C{self.consts.index(int(self.current_token[1]))}')
-                    case '%':
-                        self.code.append(f'+34C{self.consts.index(int(self.current_token[1]))}')
-            else: # Se arg2 é var:
-                match op:
-                    case '+':
-                        self.code.append(f'+30{self.current_token[1]}')
-                    case '-':
-                        self.code.append(f'+31{self.current_token[1]}')
-                    case '*':
-                        self.code.append(f'+33{self.current_token[1]}')
-                    case '/':
-                        self.code.append(f'+32{self.current_token[1]}')
-                    case '%':
-                        self.code.append(f'+34{self.current_token[1]}')
-            self.code.append(f'+21{var}')
-
-
-    def calculate(self, x, op, y):
+    # Ordem de avaliação: a Simpletron só opera o acumulador com um endereço da memória, então
+    # numa subexpressão à direita o valor tem que ir para um temporário. Os temporários que uma
+    # expressão precisa são contados como nos números de Sethi-Ullman, e só + e * podem trocar
+    # os operandos de lugar
+    def evaluation_order(self, expr): # (calculado no acumulador, operando na memória)
+        left, right = expr.left, expr.right
+        if expr.op not in '+*':
+            return left, right
+        if isinstance(left, BinOp) != isinstance(right, BinOp):
+            return (left, right) if isinstance(left, BinOp) else (right, left)
+        if isinstance(left, BinOp): # Primeiro (e guardado) o lado que precisa de mais temporários
+            left_need, right_need = self.temps_needed(left), self.temps_needed(right)
+            if left_need > right_need or left_need == right_need and left in self.acc:
+                return right, left
+            return left, right
+        return (right, left) if right in self.acc and left not in self.acc else (left, right)
+
+    def temps_needed(self, expr):
+        if not isinstance(expr, BinOp):
+            return 0
+        first, second = self.evaluation_order(expr)
+        if not isinstance(second, BinOp):
+            return self.temps_needed(first)
+        return max(self.temps_needed(second), self.temps_needed(first) + 1)
+
+    def expr_cost(self, expr, acc): # Instruções que read_expr emitiria com acc no acumulador
+        if expr in acc:
+            return 0
+        if not isinstance(expr, BinOp):
+            return 1
+        first, second = self.evaluation_order(expr)
+        if isinstance(second, BinOp):
+            return self.expr_cost(second, acc) + self.expr_cost(first, set()) + 2
+        return self.expr_cost(first, acc) + 1
+
+    def new_temp(self): # Endereço de rascunho; nomes que não são identificadores SIMPLE
+        if self.free_temps:
+            return self.free_temps.pop()
+        self.temp_count += 1
+        return ('V', f'${self.temp_count - 1}')
+
+    @staticmethod
+    def calculate(x, op, y): # Mesma aritmética da Simpletron: divisão truncada em direção ao zero
         match op:
             case '+':
                 return x + y
@@ -463,174 +947,1378 @@ class CodeGen:
             case '*':
                 return x * y
             case '/':
-                return x / y
+                quotient = abs(x) // abs(y)
+                return -quotient if (x < 0) != (y < 0) else quotient
             case '%':
-                return x % y
+                return x - y * CodeGen.calculate(x, '/', y) # Resto com o sinal do dividendo
 
+    def read_print(self, statement):
+        self.emit(WRITE, ('V', statement.var))
 
-    def read_print(self):
-        self.next_token()
-        self.code.append(f'+11{self.current_token[1]}')
-
-    def read_if(self):
-        self.next_token() # arg1
-        if self.current_token[0] == 'NUMBER':
-            if int(self.current_token[1]) not in self.consts:
-                self.consts.append(int(self.current_token[1]))
-            arg1 = f'C{self.consts.index(int(self.current_token[1]))}'
-        else:
-            arg1 = self.current_token[1]
-        self.next_token() # comp
-        comp = self.current_token[1]
-        self.next_token() # arg2
-        if self.current_token[0] == 'NUMBER':
-            if int(self.current_token[1]) not in self.consts:
-                self.consts.append(int(self.current_token[1]))
-            arg2 = f'C{self.consts.index(int(self.current_token[1]))}'
-        else:
-            arg2 = self.current_token[1]
-        match comp:
+    def read_if(self, statement):
+        if self.opt_level >= 1:
+            self.branches.lower(statement)
+            return
+        left, right = statement.left, statement.right
+        for side in (left, right): # Constantes registradas na ordem do fonte, mesmo quando a direita é carregada antes
+            if isinstance(side, Num):
+                self.operand(side)
+        target = ('B', statement.target)
+        match statement.comp:
             case '==':
-                self.code.append(f'+20{arg1}')
-                self.code.append(f'+31{arg2}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+42B{self.current_token[1]}')
+                self.read_expr(BinOp('-', left, right))
+                self.emit(BRANCHZERO, target)
             case '>':
-                self.code.append(f'+20{arg2}')
-                self.code.append(f'+31{arg1}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+41B{self.current_token[1]}')
+                self.read_expr(BinOp('-', right, left))
+                self.emit(BRANCHNEG, target)
             case '<':
-                self.code.append(f'+20{arg1}')
-                self.code.append(f'+31{arg2}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+41B{self.current_token[1]}')
+                self.read_expr(BinOp('-', left, right))
+                self.emit(BRANCHNEG, target)
             case '!=':
-                self.code.append(f'+20{arg1}')
-                self.code.append(f'+31{arg2}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+42{"%02d" % (len(self.code) + 2)}')
-                self.code.append(f'+40B{self.current_token[1]}')
+                skip = self.new_label()
+                self.read_expr(BinOp('-', left, right))
+                self.emit(BRANCHZERO, skip)
+                self.emit(BRANCH, target)
+                self.bind_label(skip)
             case '>=':
-                self.code.append(f'+20{arg2}')
-                self.code.append(f'+31{arg1}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+41B{self.current_token[1]}')
-                self.code.append(f'+42B{self.current_token[1]}')
+                self.read_expr(BinOp('-', right, left))
+                self.emit(BRANCHNEG, target)
+                self.emit(BRANCHZERO, target)
             case '<=':
-                self.code.append(f'+20{arg1}')
-                self.code.append(f'+31{arg2}')
-                self.next_token() # goto
-                self.next_token() # target line
-                self.code.append(f'+41B{self.current_token[1]}')
-                self.code.append(f'+42B{self.current_token[1]}')
+                self.read_expr(BinOp('-', left, right))
+                self.emit(BRANCHNEG, target)
+                self.emit(BRANCHZERO, target)
+
+    def read_goto(self, statement):
+        self.emit(BRANCH, ('B', statement.target))
+        self.acc = set()
+
+    def read_end(self, statement):
+        self.emit(HALT)
 
-    def read_goto(self):
-        self.next_token() # target line
-        self.code.append(f'+40B{self.current_token[1]}')
+    def fragment(self, statement):
+        # Instruções de uma instrução SIMPLE isolada (nível 0), com os símbolos na ordem em que
+        # são registrados e os labels numerados a partir de 0; remontadas por read_fragments.
+        # Usa este CodeGen como rascunho: o estado anterior é descartado
+        self.instructions, self.consts, self.vars, self.labels = [], {}, {}, {}
+        generator = self.generators.get(type(statement))
+        if generator:
+            generator(statement)
+        return self.instructions, list(self.consts), list(self.vars), self.labels
+
+    def read_fragments(self, fragments):
+        # Equivale a read_program no nível 0, mas com as instruções já geradas: só a relocação é refeita
+        for statement, (instructions, consts, vars, labels) in zip(self.program, fragments):
+            base, label_base = len(self.instructions), len(self.labels)
+            self.equiv_lines[statement.line] = base
+            for const in consts:
+                self.consts.setdefault(const, None)
+            for var in vars:
+                self.add_var_to_list(var)
+            if not labels:
+                self.instructions.extend(instructions)
+                continue
+            for label, index in labels.items():
+                self.labels[label_base + label] = base + index
+            self.instructions.extend((opcode, ('L', label_base + ref[1]) if ref and ref[0] == 'L' else ref) for opcode, ref in instructions)
+        self.proc_end()
 
     def proc_end(self):
-        self.code.append('+4300')
+        # Memória: instruções, depois consts, depois vars. Cada símbolo guarda a lista de
+        # instruções que o referenciam (fixups), resolvida numa única passada linear
+        self.collect_fixups()
+        self.operands = [0] * len(self.instructions)
+        self.data = []
         self.proc_consts()
         self.proc_vars()
         self.proc_goto()
-    
+        instruction = self.target.instruction
+        self.code = [instruction(opcode, operand) for (opcode, _), operand in zip(self.instructions, self.operands)]
+        self.code.extend(self.data)
+
+    def collect_fixups(self):
+        self.fixups = {}
+        for index, (opcode, ref) in enumerate(self.instructions):
+            if ref is not None:
+                self.fixups.setdefault(ref, []).append(index)
+                if ref[0] == 'V': # Var usada sem ser atribuída (só em programas com erros)
+                    self.add_var_to_list(ref[1])
+
+    def place_data(self, ref, word):
+        # Adiciona o dado após o código e aponta para ele as instruções que o referenciam
+        address = len(self.instructions) + len(self.data)
+        self.data.append(word)
+        for index in self.fixups[ref]:
+            self.operands[index] = address
+        return address
+
     def proc_consts(self):
-        for c_id, const in enumerate(self.consts):
-            # Adicionar const após end:
-            if const < 0:
-                sign = '-'
-            else:
-                sign = '+'
-            self.code.append(f'{sign}{"%0004d" % abs(const)}') # Formatar const no padrão da SML
-            # Substituir menções de const pelo endereço de const:
-            for l_id, line in enumerate(self.code):
-                if f'C{c_id}' in line:
-                    self.code[l_id] = f'{line[:3]}{"%02d" % (len(self.code) - 1)}' # Manter 3 primeiros caracteres, substituir 2 últimos por len(self.code) - 1
+        for const in self.consts:
+            if ('C', const) in self.fixups: # Consts que não são mais usadas não ocupam memória
+                self.consts[const] = self.place_data(('C', const), self.target.word(const))
 
     def proc_vars(self):
         for var in self.vars:
-            self.code.append('-7777')
-            # Substituir menções de var pelo endereço de var:
-            for l_id, line in enumerate(self.code):
-                if var in line:
-                    self.code[l_id] = f'{line[:3]}{"%02d" % (len(self.code) - 1)}' # Manter 3 primeiros caracteres, substituir 2 últimos por len(self.code) - 1
+            if ('V', var) in self.fixups:
+                self.vars[var] = self.place_data(('V', var), self.target.word(UNINITIALIZED))
+        for var, (kind, key) in self.aliases.items():
+            self.vars[var] = self.consts[key] if kind == 'C' else self.vars[key]
 
     def proc_goto(self):
-        for simple_line in self.equiv_lines:
-            for l_id, line in enumerate(self.code):
-                if f'B{simple_line}' in line:
-                    self.code[l_id] = f'{line[:3]}{"%02d" % (self.equiv_lines[simple_line])}' # Manter 3 primeiros caracteres, substituir 2 últimos por self.equiv_lines[simple_line]
+        for kind, targets in (('B', self.equiv_lines), ('L', self.labels)):
+            for target, address in targets.items():
+                for index in self.fixups.get((kind, target), ()):
+                    self.operands[index] = address
+
+class ConstantFolder:
+    # Avalia em tempo de compilação as operações entre constantes e propaga os valores conhecidos
+    # das variáveis em código linear; 'if' com os dois lados constantes vira 'goto' ou some
+    def __init__(self, program, target=DEFAULT_TARGET):
+        self.program = program
+        self.target = target # Resultados fora da palavra do alvo ficam para a execução (overflow)
+        self.known = {} # Variável -> valor conhecido neste ponto do programa
+        # Numa linha alvo de desvio os valores podem vir de outro caminho: nada é conhecido
+        self.targets = {statement.target for statement in program if isinstance(statement, (If, Goto))}
+
+    def run(self):
+        folded = []
+        for statement in self.program:
+            if statement.line in self.targets:
+                self.known = {}
+            folded.append(self.fold_statement(statement))
+        return folded
+
+    def fold_statement(self, statement):
+        if isinstance(statement, Input):
+            self.known.pop(statement.var, None)
+        elif isinstance(statement, Let):
+            expr = self.fold(statement.expr)
+            if isinstance(expr, Num):
+                self.known[statement.var] = expr.value
+            else:
+                self.known.pop(statement.var, None)
+            return Let(statement.line, statement.var, expr)
+        elif isinstance(statement, If):
+            left, right = self.fold(statement.left), self.fold(statement.right)
+            difference = left.value - right.value if isinstance(left, Num) and isinstance(right, Num) else None
+            # A comparação é uma subtração na execução (esq - dir ou dir - esq): se ela estoura, fica para a execução
+            if difference is not None and self.target.word_min <= min(difference, -difference) and max(difference, -difference) <= self.target.word_max:
+                if self.compare(left.value, statement.comp, right.value):
+                    self.known = {} # A próxima linha só é alcançada por desvio
+                    return Goto(statement.line, statement.target)
+                return Rem(statement.line)
+            return If(statement.line, left, statement.comp, right, statement.target)
+        elif isinstance(statement, Goto):
+            self.known = {}
+        return statement
+
+    def fold(self, expr):
+        if isinstance(expr, Var):
+            if expr.name in self.known:
+                return Num(self.known[expr.name])
+            return expr
+        if isinstance(expr, BinOp):
+            left, right = self.fold(expr.left), self.fold(expr.right)
+            if isinstance(left, Num) and isinstance(right, Num):
+                if not (expr.op in '/%' and right.value == 0): # Divisão por zero fica para a execução
+                    value = CodeGen.calculate(left.value, expr.op, right.value)
+                    if self.target.word_min <= value <= self.target.word_max: # Overflow também
+                        return Num(value)
+            elif isinstance(right, Num) and (right.value == 0 and expr.op in '+-' or right.value == 1 and expr.op in '*/'):
+                return left # x + 0, x - 0, x * 1, x / 1
+            elif isinstance(left, Num) and (left.value == 0 and expr.op == '+' or left.value == 1 and expr.op == '*'):
+                return right # 0 + x, 1 * x
+            return BinOp(expr.op, left, right)
+        return expr
+
+    @staticmethod
+    def compare(x, comp, y):
+        match comp:
+            case '==':
+                return x == y
+            case '!=':
+                return x != y
+            case '<':
+                return x < y
+            case '>':
+                return x > y
+            case '<=':
+                return x <= y
+            case '>=':
+                return x >= y
+
+
+class LoopOptimizer:
+    # Laços naturais no grafo de fluxo das instruções SIMPLE: um desvio para uma instrução que o
+    # domina fecha um laço. Cálculos invariantes (operandos que o laço não altera) vão para um
+    # pré-cabeçalho, instruções sem linha própria (line None) logo antes do cabeçalho, executadas
+    # só na entrada do laço. Só há pré-cabeçalho quando a única entrada no laço é a instrução
+    # anterior ao cabeçalho: os desvios continuam indo para as mesmas linhas
+    def __init__(self, program):
+        self.program = list(program)
+        self.index = {statement.line: index for index, statement in enumerate(self.program)}
+        used = set()
+        for statement in self.program:
+            used.update(self.defined_var(statement) or ())
+            for expr in self.exprs(statement):
+                used.update(leaf.name for leaf in self.leaves(expr) if isinstance(leaf, Var))
+        self.free = [var for var in 'abcdefghijklmnopqrstuvwxyz' if var not in used] # Para os temporários
+        self.preheaders = {} # Índice do cabeçalho -> instruções do pré-cabeçalho
+        self.hoisted = 0 # Cálculos levados para fora de um laço
+
+    @staticmethod
+    def defined_var(statement):
+        return (statement.var,) if isinstance(statement, (Let, Input)) else None
+
+    @staticmethod
+    def exprs(statement):
+        if isinstance(statement, Let):
+            return (statement.expr,)
+        if isinstance(statement, If):
+            return (statement.left, statement.right)
+        if isinstance(statement, Print):
+            return (Var(statement.var),)
+        return ()
+
+    @classmethod
+    def leaves(cls, expr):
+        if isinstance(expr, BinOp):
+            return cls.leaves(expr.left) + cls.leaves(expr.right)
+        return [expr]
+
+    def run(self):
+        if not self.program:
+            return self.program
+        successors = [self.successors(index) for index in range(len(self.program))]
+        predecessors = [[] for _ in successors]
+        for index, targets in enumerate(successors):
+            for target in targets:
+                predecessors[target].append(index)
+        loops = self.natural_loops(successors, predecessors)
+        for header, body in sorted(loops.items(), key=lambda loop: -len(loop[1])): # De fora para dentro
+            self.hoist(header, body, predecessors)
+        self.hoisted = sum(map(len, self.preheaders.values()))
+        optimized = []
+        for index, statement in enumerate(self.program):
+            optimized.extend(self.preheaders.get(index, ()))
+            optimized.append(statement)
+        return optimized
+
+    def successors(self, index):
+        statement = self.program[index]
+        following = [index + 1] if index + 1 < len(self.program) else []
+        if isinstance(statement, End):
+            return []
+        if isinstance(statement, (If, Goto)):
+            target = self.index.get(statement.target)
+            jump = [target] if target is not None else []
+            return jump if isinstance(statement, Goto) else following + jump
+        return following
+
+    @staticmethod
+    def natural_loops(successors, predecessors):
+        # Dominadores pelo algoritmo de Cooper, Harvey e Kennedy, sobre a ordem pós-fixada de uma
+        # busca em profundidade a partir da primeira instrução
+        count = len(successors)
+        postorder = []
+        visited = [False] * count
+        visited[0] = True
+        stack = [(0, iter(successors[0]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if not visited[child]:
+                    visited[child] = True
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(node)
+        number = [-1] * count
+        for position, node in enumerate(postorder):
+            number[node] = position
+        idom = [None] * count
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for node in reversed(postorder):
+                if node == 0:
+                    continue
+                new = None
+                for predecessor in predecessors[node]:
+                    if idom[predecessor] is None:
+                        continue
+                    if new is None:
+                        new = predecessor
+                        continue
+                    first, second = predecessor, new
+                    while first != second:
+                        while number[first] < number[second]:
+                            first = idom[first]
+                        while number[second] < number[first]:
+                            second = idom[second]
+                    new = first
+                if idom[node] != new:
+                    idom[node] = new
+                    changed = True
+        # Numeração da árvore de dominadores: h domina u se o intervalo de u está dentro do de h
+        children = [[] for _ in range(count)]
+        for node in postorder:
+            if node != 0:
+                children[idom[node]].append(node)
+        enter, leave = [0] * count, [0] * count
+        clock = 0
+        stack = [(0, False)]
+        while stack:
+            node, done = stack.pop()
+            clock += 1
+            if done:
+                leave[node] = clock
+                continue
+            enter[node] = clock
+            stack.append((node, True))
+            stack.extend((child, False) for child in children[node])
+        loops = {} # Cabeçalho -> corpo (índices), juntando os laços com o mesmo cabeçalho
+        for node in postorder:
+            for header in successors[node]:
+                if enter[header] <= enter[node] and leave[node] <= leave[header]: # Desvio para trás
+                    body = loops.setdefault(header, {header})
+                    pending = [node]
+                    while pending:
+                        current = pending.pop()
+                        if current not in body:
+                            body.add(current)
+                            pending.extend(predecessor for predecessor in predecessors[current] if idom[predecessor] is not None)
+        return loops
+
+    def hoist(self, header, body, predecessors):
+        entry = header - 1
+        if entry < 0 or entry in body or any(predecessor not in body and predecessor != entry for predecessor in predecessors[header]):
+            return
+        statement = self.program[entry]
+        if entry not in predecessors[header] or isinstance(statement, (If, Goto)) and statement.target == self.program[header].line:
+            return # Sem pré-cabeçalho: a entrada no laço é (também) um desvio, que pularia o pré-cabeçalho
+        program = self.program
+        definitions = collections.Counter(var for index in body for var in self.defined_var(program[index]) or ())
+        # Prefixo: instruções a partir do cabeçalho executadas em toda iteração antes de qualquer
+        # efeito visível (print, input) ou desvio. Só nelas um cálculo que pode falhar (overflow,
+        # divisão por zero) é antecipado: a falha aconteceria na primeira iteração do mesmo jeito
+        prefix = []
+        index = header
+        while index in body and isinstance(program[index], (Let, Rem)):
+            prefix.append(index)
+            index += 1
+        preheader = self.preheaders.setdefault(header, [])
+        temps = {} # Expressão invariante -> temporário que a guarda
+        mentioned = set() # Vars lidas no prefixo antes da instrução atual
+        for index in prefix:
+            statement = program[index]
+            if isinstance(statement, Rem):
+                continue
+            var, expr = statement.var, statement.expr
+            if definitions[var] == 1 and var not in mentioned and self.invariant(expr, definitions):
+                # A instrução inteira sai do laço: o valor de var é o mesmo em toda iteração
+                preheader.append(Let(None, var, expr))
+                program[index] = Rem(statement.line)
+                del definitions[var]
+            else:
+                program[index] = Let(statement.line, var, self.hoist_expr(expr, definitions, temps, preheader, False))
+            mentioned.update(leaf.name for leaf in self.leaves(expr) if isinstance(leaf, Var))
+        for index in sorted(body): # Fora do prefixo, só cálculos que não podem falhar
+            statement = program[index]
+            if index in prefix:
+                continue
+            if isinstance(statement, Let):
+                program[index] = Let(statement.line, statement.var, self.hoist_expr(statement.expr, definitions, temps, preheader, True))
+            elif isinstance(statement, If):
+                left = self.hoist_expr(statement.left, definitions, temps, preheader, True)
+                right = self.hoist_expr(statement.right, definitions, temps, preheader, True)
+                program[index] = If(statement.line, left, statement.comp, right, statement.target)
+
+    def invariant(self, expr, definitions):
+        return all(isinstance(leaf, Num) or leaf.name not in definitions for leaf in self.leaves(expr))
+
+    @classmethod
+    def safe(cls, expr): # Não falha nem estoura: divisões e restos por constantes diferentes de zero
+        if not isinstance(expr, BinOp):
+            return True
+        return expr.op in '/%' and isinstance(expr.right, Num) and expr.right.value != 0 and cls.safe(expr.left)
+
+    def hoist_expr(self, expr, definitions, temps, preheader, speculative):
+        # Troca as subexpressões invariantes por temporários calculados no pré-cabeçalho
+        if not isinstance(expr, BinOp):
+            return expr
+        if self.invariant(expr, definitions) and (self.safe(expr) or not speculative):
+            if expr not in temps:
+                if not self.free:
+                    return expr
+                temps[expr] = Var(self.free.pop(0))
+                preheader.append(Let(None, temps[expr].name, expr))
+            return temps[expr]
+        left = self.hoist_expr(expr.left, definitions, temps, preheader, speculative)
+        right = self.hoist_expr(expr.right, definitions, temps, preheader, speculative)
+        return BinOp(expr.op, left, right)
+
+
+class BranchLowering:
+    # Escolhe a sequência de desvios de cada 'if'. A comparação vira uma diferença D no acumulador
+    # (esq - dir ou dir - esq; só um operando quando o outro é zero) e o desvio é tomado para
+    # certos sinais de D. Das duas ordens possíveis, fica a que custa menos instruções, contando
+    # como grátis a parte de D que já estiver no acumulador (ex.: dois 'if' seguidos com os mesmos
+    # operandos, ou um 'if' logo depois do 'let' que calculou a diferença)
+    TAKEN_SIGNS = {'<': '-', '==': '0', '<=': '-0', '>': '+', '!=': '-+', '>=': '0+'} # Sinais de esq - dir
+    MIRROR = str.maketrans('-+', '+-')
+    # Sinais em que o desvio é tomado -> desvios para o alvo (T) ou para depois do 'if' (S)
+    SEQUENCES = {
+        '-': ((BRANCHNEG, 'T'),),
+        '0': ((BRANCHZERO, 'T'),),
+        '-0': ((BRANCHNEG, 'T'), (BRANCHZERO, 'T')),
+        '-+': ((BRANCHZERO, 'S'), (BRANCH, 'T')),
+        '0+': ((BRANCHNEG, 'S'), (BRANCH, 'T')),
+        '+': ((BRANCHNEG, 'S'), (BRANCHZERO, 'S'), (BRANCH, 'T')),
+    }
+    INVERSE = {'<': '>=', '>=': '<', '>': '<=', '<=': '>', '==': '!=', '!=': '=='}
+
+    def __init__(self, code_gen):
+        self.code_gen = code_gen
+
+    @classmethod
+    def merge_gotos(cls, program):
+        # 'if c goto X' seguido de 'goto Y', com X logo depois do 'goto': vira 'if not c goto Y'.
+        # A linha do 'goto' não pode ser alvo de desvio, senão quem desvia para ela iria para X
+        targets = {statement.target for statement in program if isinstance(statement, (If, Goto))}
+        merged = list(program)
+        for index in range(len(merged) - 1):
+            statement, following = merged[index], merged[index + 1]
+            if not (isinstance(statement, If) and isinstance(following, Goto)):
+                continue
+            if following.line in targets or following.target == following.line:
+                continue
+            next_lines = set() # Linhas com o mesmo endereço da instrução depois do 'goto'
+            for later in merged[index + 2:]:
+                next_lines.add(later.line)
+                if not isinstance(later, Rem):
+                    break
+            if statement.target in next_lines:
+                merged[index] = If(statement.line, statement.left, cls.INVERSE[statement.comp], statement.right, following.target)
+                merged[index + 1] = Rem(following.line)
+        return merged
+
+    def difference(self, first, second): # Expressão que fica no acumulador
+        return first if second == Num(0) else BinOp('-', first, second)
+
+    def cost(self, first, second, signs):
+        return self.code_gen.expr_cost(self.difference(first, second), self.code_gen.acc) + len(self.SEQUENCES[signs])
+
+    def lower(self, statement):
+        code_gen = self.code_gen
+        signs = self.TAKEN_SIGNS[statement.comp]
+        options = [(statement.left, statement.right, signs),
+                   (statement.right, statement.left, signs.translate(self.MIRROR)[::-1])]
+        first, second, signs = min(options, key=lambda option: self.cost(*option)) # Empate: ordem original
+        difference = self.difference(first, second)
+        code_gen.read_expr(difference)
+        code_gen.acc = {difference}
+        skip = None
+        for opcode, destination in self.SEQUENCES[signs]:
+            if destination == 'T':
+                code_gen.emit(opcode, ('B', statement.target))
+            else:
+                skip = skip or code_gen.new_label()
+                code_gen.emit(opcode, skip)
+        if skip:
+            code_gen.bind_label(skip)
+
+
+class Peephole:
+    # Otimizações locais sobre as instruções antes da relocação. Os alvos dos desvios continuam
+    # simbólicos; quando instruções são removidas, equiv_lines e labels são remapeados
+    def __init__(self, code_gen):
+        self.code_gen = code_gen
+        self.instructions = code_gen.instructions
+
+    def run(self):
+        changed = True
+        while changed:
+            changed = self.thread_jumps()
+            changed = self.remove_redundant() or changed
+
+    def target(self, ref): # Índice da instrução alvo de um desvio, None se a linha não existe
+        targets = self.code_gen.equiv_lines if ref[0] == 'B' else self.code_gen.labels
+        return targets.get(ref[1])
+
+    def thread_jumps(self):
+        # Desvio para um '40': desvia direto para o destino final da cadeia
+        changed = False
+        for index, (opcode, ref) in enumerate(self.instructions):
+            if opcode not in BRANCH_OPCODES:
+                continue
+            final = ref
+            seen = set()
+            address = self.target(ref)
+            while address is not None and address < len(self.instructions) and address not in seen:
+                seen.add(address)
+                next_opcode, next_ref = self.instructions[address]
+                if next_opcode != BRANCH:
+                    break
+                final = next_ref
+                address = self.target(next_ref)
+            if final != ref:
+                self.instructions[index] = (opcode, final)
+                changed = True
+        return changed
+
+    def remove_redundant(self):
+        targets = {self.target(ref) for opcode, ref in self.instructions if opcode in BRANCH_OPCODES}
+        keep = [True] * len(self.instructions)
+        reachable = True
+        in_acc = set() # Referências cuja memória tem o mesmo valor que o acumulador
+        for index, (opcode, ref) in enumerate(self.instructions):
+            if index in targets: # Chega-se aqui por desvio: nada se sabe sobre o acumulador
+                reachable = True
+                in_acc = set()
+            if not reachable: # Depois de '40' ou '43', sem desvio para cá
+                keep[index] = False
+            elif opcode in BRANCH_OPCODES and self.target(ref) == index + 1: # Desvio para a próxima instrução
+                keep[index] = False
+            elif (opcode == LOAD or opcode == STORE) and ref in in_acc: # Valor já está no acumulador/memória
+                keep[index] = False
+            elif opcode == LOAD:
+                in_acc = {ref}
+            elif opcode == STORE:
+                in_acc.add(ref)
+            elif opcode == READ:
+                in_acc.discard(ref)
+            elif opcode in ARITHMETIC_OPCODES.values():
+                in_acc = set()
+            elif opcode == BRANCH or opcode == HALT:
+                reachable = False
+        if all(keep):
+            return False
+        self.code_gen.remove_instructions(keep)
+        return True
+
+
+
+ACC = ('A', None) # O acumulador, como símbolo da análise de vivacidade
+
+class SlotAllocator:
+    # Análise de vivacidade sobre as instruções antes da relocação: remove stores e loads cujo
+    # valor nunca é lido e faz símbolos cujos intervalos de vida não se sobrepõem dividirem o
+    # mesmo endereço. Uma const é um símbolo vivo desde o início que nunca é escrito, então uma
+    # var também pode reaproveitar o endereço de uma const que não será mais lida
+    def __init__(self, code_gen):
+        self.code_gen = code_gen
+        self.instructions = code_gen.instructions
+
+    def run(self):
+        words = self.code_gen.memory_words()
+        while self.remove_dead_code():
+            pass
+        self.share_slots()
+        self.code_gen.opt_stats['saved_words'] = words - self.code_gen.memory_words()
+
+    @staticmethod
+    def uses_defs(opcode, ref):
+        if opcode == LOAD:
+            return (ref,), (ACC,)
+        if opcode == STORE:
+            return (ACC,), (ref,)
+        if opcode in ARITHMETIC_OPCODES.values():
+            return (ACC, ref), (ACC,)
+        if opcode == READ:
+            return (), (ref,)
+        if opcode == WRITE:
+            return (ref,), ()
+        if opcode == BRANCHNEG or opcode == BRANCHZERO:
+            return (ACC,), ()
+        return (), ()
+
+    def successors(self, index):
+        opcode, ref = self.instructions[index]
+        following = [index + 1] if index + 1 < len(self.instructions) else []
+        if opcode == HALT:
+            return []
+        if opcode in BRANCH_OPCODES:
+            targets = self.code_gen.equiv_lines if ref[0] == 'B' else self.code_gen.labels
+            target = targets.get(ref[1])
+            jump = [target] if target is not None and target < len(self.instructions) else []
+            return jump if opcode == BRANCH else jump + following
+        return following
+
+    def symbol_bits(self): # Bit de cada símbolo nos conjuntos de vivos; o acumulador é o bit 0
+        bits = {ACC: 1}
+        for _, ref in self.instructions:
+            if ref and ref[0] in 'CV' and ref not in bits:
+                bits[ref] = 1 << len(bits)
+        return bits
 
-# ========== Código SIMPLE a ser compilado ==========:
-if not os.path.exists("source.txt"):
-    print('\n***Erro***: Por favor coloque o código no arquivo "source.txt" no diretório do compilador!')
-    print('***Importante***: Se já estiver lá, confira o path do seu shell!\n')
-src_file = open("source.txt", "r")
-code = src_file.read()
-src_file.close()
+    def liveness(self, bits):
+        # Retorna (vivos na entrada, vivos na saída) de cada instrução. Os conjuntos são inteiros
+        # usados como conjuntos de bits: com milhares de consts vivas ao mesmo tempo, conjuntos
+        # Python por instrução esgotam a memória em programas grandes
+        count = len(self.instructions)
+        successors = [self.successors(index) for index in range(count)]
+        predecessors = [[] for _ in range(count)]
+        for index, targets in enumerate(successors):
+            for target in targets:
+                predecessors[target].append(index)
+        uses_defs = []
+        for opcode, ref in self.instructions:
+            uses, defs = self.uses_defs(opcode, ref)
+            uses_defs.append((sum(bits[symbol] for symbol in uses), sum(bits[symbol] for symbol in defs)))
+        live_in = [0] * count
+        live_out = [0] * count
+        pending = list(range(count)) # Processadas de trás para frente
+        queued = [True] * count
+        while pending:
+            index = pending.pop()
+            queued[index] = False
+            live = 0
+            for target in successors[index]:
+                live |= live_in[target]
+            live_out[index] = live
+            uses, defs = uses_defs[index]
+            live = live & ~defs | uses
+            if live != live_in[index]:
+                live_in[index] = live
+                for predecessor in predecessors[index]:
+                    if not queued[predecessor]:
+                        queued[predecessor] = True
+                        pending.append(predecessor)
+        return live_in, live_out
 
-lexer = Lexer(code)
-tokens = lexer.tokenize()
+    def remove_dead_code(self):
+        # Stores numa var que não será lida e loads cujo valor não será usado. Operações
+        # aritméticas mortas ficam: podem gerar overflow ou divisão por zero na execução
+        bits = self.symbol_bits()
+        live_in, live_out = self.liveness(bits)
+        keep = [True] * len(self.instructions)
+        for index, (opcode, ref) in enumerate(self.instructions):
+            if opcode == STORE and not live_out[index] & bits[ref] or opcode == LOAD and not live_out[index] & 1:
+                keep[index] = False
+        if all(keep):
+            return False
+        self.code_gen.remove_instructions(keep)
+        return True
 
-parser = Parser(tokens[:])
-parser.parse_program()
+    def share_slots(self):
+        if not self.instructions:
+            return
+        bits = self.symbol_bits()
+        live_in, live_out = self.liveness(bits)
+        symbols = list(bits)[1:]
+        # interference[X]: símbolos vivos quando X é escrito (escrever em X destruiria o valor deles).
+        # A relação é simétrica, mas em vez de preencher os dois lados o teste de cada endereço
+        # olha também para a união das interferências dos símbolos que já estão nele
+        interference = dict.fromkeys(symbols, 0)
+        for index, (opcode, ref) in enumerate(self.instructions):
+            if opcode == STORE or opcode == READ:
+                interference[ref] |= live_out[index] & ~(bits[ref] | 1)
+        # Vars lidas antes de serem escritas dependem do valor inicial do endereço (-7777): não
+        # podem ficar no endereço de uma const. Consts nunca dividem endereço entre si
+        consts = sum(bits[symbol] for symbol in symbols if symbol[0] == 'C')
+        for symbol in symbols:
+            if symbol[0] == 'V' and live_in[0] & bits[symbol]:
+                interference[symbol] |= consts
+        # Consts primeiro, para que cada endereço com uma const seja representado por ela
+        slots = [] # [representante, membros, interferências dos membros]
+        for symbol in sorted(symbols, key=lambda symbol: symbol[0] != 'C'):
+            for slot in slots if symbol[0] == 'V' else ():
+                if not interference[symbol] & slot[1] and not slot[2] & bits[symbol]:
+                    slot[1] |= bits[symbol]
+                    slot[2] |= interference[symbol]
+                    self.code_gen.aliases[symbol[1]] = slot[0]
+                    break
+            else:
+                slots.append([symbol, bits[symbol], interference[symbol]])
+        if len(slots) == len(symbols):
+            return
+        renamed = {('V', var): slot for var, slot in self.code_gen.aliases.items()}
+        self.instructions[:] = [(opcode, renamed.get(ref, ref)) for opcode, ref in self.instructions]
+
+
+# ========== Profiling ==========:
+class CompileProfiler:
+    # Tempo de parede, tempo de CPU e pico de memória (tracemalloc) de cada fase, e o tamanho do
+    # programa antes e depois de cada passe de otimização. O relatório é um dict serializável em JSON
+    def __init__(self, memory=True):
+        self.memory = memory # tracemalloc deixa a compilação bem mais lenta
+        self.phases = []
+        self.passes = []
+        self.memory_words = None
+        self.started_tracing = False
+        self.start = time.perf_counter(), time.process_time()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    @contextlib.contextmanager
+    def phase(self, name): # O corpo do with pode acrescentar métricas ao registro
+        record = {'phase': name}
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            if self.memory:
+                record['peak_memory'] = tracemalloc.get_traced_memory()[1] - base # Bytes acima do início da fase
+            self.phases.append(record)
+
+    def record_pass(self, name, unit, before, after, wall):
+        self.passes.append({'pass': name, 'unit': unit, 'before': before, 'after': after, 'wall': wall})
+
+    def close(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def report(self):
+        phases = []
+        for record in self.phases:
+            record = dict(record)
+            if 'tokens' in record:
+                record['tokens_per_second'] = record['tokens'] / record['wall'] if record['wall'] else None
+            phases.append(record)
+        wall, cpu = self.start
+        return {
+            'phases': phases,
+            'passes': self.passes,
+            'memory_words': self.memory_words,
+            'total': {'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu},
+        }
+
+
+def profile_phase(profiler, name):
+    return profiler.phase(name) if profiler else contextlib.nullcontext({})
+
+
+# ========== API ==========:
+class CompileOptions:
+    def __init__(self, opt_level=0, profile=False, profile_memory=True, on_profile=None, max_errors=DEFAULT_MAX_ERRORS, target=DEFAULT_TARGET):
+        self.opt_level = opt_level # 0 = nenhuma, 1 = peephole e desvios mais curtos, 2 = + propagação de constantes e alocação de endereços, 3 = + otimização de laços
+        self.target = TARGETS[target] if isinstance(target, str) else target # Perfil (ou nome em TARGETS) da máquina alvo
+        self.max_errors = max_errors # Erros antes de interromper a compilação (0: sem limite)
+        self.profile = profile or on_profile is not None # Relatório do CompileProfiler em result.profile
+        self.profile_memory = profile_memory
+        self.on_profile = on_profile # Chamada com o relatório ao fim de cada compilação
+
+
+class CompileResult:
+    def __init__(self, tokens, program, code_gen, diagnostics, elapsed, target=DEFAULT_TARGET):
+        self.target = target
+        self.tokens = tokens # None quando o resultado vem do cache
+        self.program = program
+        self.code_gen = code_gen # None se o programa com erros não pôde ser traduzido, ou se veio do cache
+        self.code = code_gen.code if code_gen else []
+        self.consts = dict(code_gen.consts) if code_gen else {}
+        self.vars = dict(code_gen.vars) if code_gen else {}
+        self.equiv_lines = dict(code_gen.equiv_lines) if code_gen else {}
+        self.opt_stats = dict(code_gen.opt_stats) if code_gen else {}
+        self.diagnostics = diagnostics # Erros da análise (Diagnostic), na ordem em que foram encontrados
+        self.errors = [str(record) for record in diagnostics]
+        self.suppressed = 0 # Erros repetidos que não entraram em diagnostics
+        self.elapsed = elapsed
+        self.cached = False
+        self.profile = None
+
+    @classmethod
+    def from_image(cls, image, elapsed): # Resultado guardado pelo cache, sem tokens nem AST
+        result = cls(None, None, None, [Diagnostic.from_dict(record) for record in image['diagnostics']], elapsed, TARGETS[image['target']])
+        result.code = image['code']
+        result.consts = {int(const): address for const, address in image['consts']}
+        result.vars = dict(image['vars'])
+        result.equiv_lines = {int(line): address for line, address in image['equiv_lines']}
+        result.opt_stats = image['opt_stats']
+        result.suppressed = image['suppressed']
+        result.cached = True
+        return result
+
+    def image(self): # O que o cache guarda (JSON)
+        return {
+            'target': self.target.name,
+            'code': self.code,
+            'diagnostics': [record.as_dict() for record in self.diagnostics],
+            'suppressed': self.suppressed,
+            'consts': list(self.consts.items()),
+            'vars': list(self.vars.items()),
+            'equiv_lines': list(self.equiv_lines.items()),
+            'opt_stats': self.opt_stats,
+        }
+
+    def regions(self): # Palavras de código, de consts e de vars, nessa ordem na memória
+        const_addresses = {address for address in self.consts.values() if address is not None}
+        data = sorted(const_addresses | {address for address in self.vars.values() if address is not None})
+        code = data[0] if data else len(self.code)
+        return code, len(const_addresses), len(self.code) - code - len(const_addresses)
+
+    def line_map(self, source=None):
+        # Linha SIMPLE -> endereço da primeira instrução, para o perfil de execução da Simpletron
+        return {
+            'target': self.target.name,
+            'source': os.path.abspath(source) if source else None,
+            'regions': self.regions(),
+            'equiv_lines': sorted(self.equiv_lines.items()),
+        }
+
+    def packed_image(self): # Imagem binária (sml_image): cabeçalho, mapa de linhas e palavras
+        words = [int(word) for word in self.code]
+        return sml_image.SMLImage(words, self.target.operand_digits, self.regions(), self.equiv_lines).pack()
+
+    @property
+    def overflow(self): # O código gerado não cabe na memória
+        return len(self.code) > self.target.memory_size
+
+    @property
+    def ok(self):
+        return not self.errors and not self.overflow
+
+    @property
+    def status(self):
+        if self.errors:
+            return 'errors'
+        if self.overflow:
+            return 'overflow'
+        return 'ok'
+
+    def summary(self): # Resumo serializável em JSON
+        return {
+            'status': self.status,
+            'errors': self.errors,
+            'diagnostics': [record.as_dict() for record in self.diagnostics],
+            **({'suppressed_errors': self.suppressed} if self.suppressed else {}),
+            'target': self.target.name,
+            'words': len(self.code),
+            'memory_size': self.target.memory_size,
+            'consts': len(self.consts),
+            'vars': len(self.vars),
+            'elapsed': round(self.elapsed, 6),
+            'cached': self.cached,
+            **self.opt_stats,
+            **({'profile': self.profile} if self.profile else {}),
+        }
+
+
+def compile_source(text, options=None):
+    # Compila o código SIMPLE sem imprimir nada nem perguntar nada: erros vão para result.errors
+    options = options or CompileOptions()
+    start = time.perf_counter()
+    profiler = CompileProfiler(options.profile_memory) if options.profile else None
+    diagnostics = Diagnostics(options.max_errors)
+    parser = semantic_analyzer = code_gen = program = None
+    try:
+        try:
+            with profile_phase(profiler, 'lexing') as record:
+                lexer = Lexer(text, quiet=True, diagnostics=diagnostics)
+                tokens = lexer.tokenize()
+                record['tokens'] = len(tokens)
+            with profile_phase(profiler, 'parsing') as record:
+                parser = Parser(tokens, quiet=True, diagnostics=diagnostics)
+                program = parser.parse_program()
+                record['statements'] = len(program)
+            with profile_phase(profiler, 'semantic'):
+                semantic_analyzer = SemanticAnalyzer(program, quiet=True, diagnostics=diagnostics)
+                semantic_analyzer.analyze_program()
+        except TooManyErrors: # O resto do programa não é analisado nem traduzido
+            tokens = lexer.tokens
+        errors = collect_diagnostics(diagnostics, lexer, parser, semantic_analyzer)
+        if not diagnostics.exhausted:
+            code_gen = CodeGen(program, options.opt_level, options.target)
+            code_gen.profiler = profiler
+            try:
+                code_gen.read_program()
+            except Exception:
+                if not errors:
+                    raise
+                code_gen = None # Programa com erros pode não ter tradução
+        result = CompileResult(tokens, program, code_gen, errors, time.perf_counter() - start, options.target)
+        result.suppressed = diagnostics.suppressed
+    finally:
+        if profiler:
+            profiler.close()
+    if profiler:
+        if code_gen:
+            profiler.memory_words = code_gen.memory_usage()
+        result.profile = profiler.report()
+        if options.on_profile:
+            options.on_profile(result.profile)
+    return result
+
+
+def compile_stream(lines, options=None):
+    # Como compile_source, mas o fonte é um iterável de linhas (um arquivo aberto) e cada token e
+    # cada instrução segue para a próxima fase assim que é produzido: nem o texto, nem a lista de
+    # linhas, nem a lista de tokens ficam em memória. No nível 0 a AST também não fica
+    # (result.program é None); nos outros níveis as otimizações precisam do programa inteiro
+    options = options or CompileOptions()
+    start = time.perf_counter()
+    profiler = CompileProfiler(options.profile_memory) if options.profile else None
+    diagnostics = Diagnostics(options.max_errors)
+    program = None
+    try:
+        with profile_phase(profiler, 'front_end') as record: # Lexer, Parser e análise semântica intercalados
+            lexer = Lexer(lines, quiet=True, diagnostics=diagnostics)
+            semantic_analyzer = SemanticAnalyzer(None, quiet=True, diagnostics=diagnostics)
+            code_gen = CodeGen(None, options.opt_level, options.target)
+            code_gen.profiler = profiler
+            parser = failure = None
+            try:
+                # O Parser já lê o primeiro token, que pode esgotar o limite de erros
+                parser = Parser(lexer.generate_tokens(), quiet=True, diagnostics=diagnostics)
+                statements = semantic_analyzer.analyze_statements(parser.parse_statements())
+                try:
+                    if options.opt_level == 0:
+                        code_gen.read_statements(statements)
+                    else:
+                        program = list(statements)
+                except TooManyErrors:
+                    raise
+                except Exception as error:
+                    failure = error
+                    for _ in statements: # Continua a análise para reportar todos os erros
+                        pass
+                parser.tokens.drain()
+                semantic_analyzer.check_pending_targets()
+            except TooManyErrors: # O resto do fonte não é lido
+                pass
+            record['tokens'] = parser.tokens.count if parser else 0
+        errors = collect_diagnostics(diagnostics, lexer, parser, semantic_analyzer)
+        try:
+            if diagnostics.exhausted:
+                code_gen = None
+            elif failure:
+                raise failure
+            elif program is None:
+                with profile_phase(profiler, 'optimization'):
+                    code_gen.optimize()
+                with profile_phase(profiler, 'relocation'):
+                    code_gen.proc_end()
+            else:
+                code_gen.program = program
+                code_gen.read_program()
+        except Exception:
+            if not errors:
+                raise
+            code_gen = None # Programa com erros pode não ter tradução
+        result = CompileResult(None, program, code_gen, errors, time.perf_counter() - start, options.target)
+        result.suppressed = diagnostics.suppressed
+    finally:
+        if profiler:
+            profiler.close()
+    if profiler:
+        if code_gen:
+            profiler.memory_words = code_gen.memory_usage()
+        result.profile = profiler.report()
+        if options.on_profile:
+            options.on_profile(result.profile)
+    return result
+
+
+# ========== Cache ==========:
+# Imagens compiladas ficam em <diretório>/images, com a chave sendo o hash do fonte, das opções e do
+# próprio compilador. Os fragmentos de cada linha (tokens, instrução da AST e instruções do nível 0)
+# ficam em memória: quando só algumas linhas mudam, as outras não passam de novo pelo
+# Lexer/Parser/CodeGen e só a relocação é refeita. A análise semântica sempre roda sobre o programa
+# inteiro, pois uma linha pode invalidar outras. Os fragmentos não vão para o disco: carregá-los
+# custa mais do que compilar as linhas de novo.
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024 # Bytes em disco; as entradas usadas há mais tempo saem primeiro
+MAX_FRAGMENTS = 1 << 18 # Fragmentos de linha mantidos em memória
+COMPILER_HASH = None
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def compiler_hash(): # Qualquer mudança no compilador (ou nos perfis da máquina) invalida o cache
+    global COMPILER_HASH
+    if COMPILER_HASH is None:
+        digest = hashlib.sha256()
+        for path in (__file__, sml_target.__file__):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+        COMPILER_HASH = digest.hexdigest()
+    return COMPILER_HASH
+
+
+class LineFragment:
+    # Tokens e instrução de uma linha do fonte, que só dependem do texto da linha. statement é None
+    # se a linha tem tokens mas não forma uma instrução completa: o programa é compilado do jeito
+    # normal, que gera as mensagens de erro
+    def __init__(self, tokens, statement, valid=True):
+        self.tokens = tokens
+        self.statement = statement
+        self.valid = valid # Sem erros do lexer
+        self.code = None # Fragmento do CodeGen, gerado quando usado no nível 0
 
-semantic_analyzer = SemanticAnalyzer(tokens[:])
-semantic_analyzer.analyze_program()
+    @classmethod
+    def parse(cls, text):
+        lexer = Lexer(text, quiet=True)
+        tokens = lexer.tokenize()
+        if lexer.error or not tokens:
+            return cls(tokens, None, not lexer.error)
+        if len(tokens) == 1 and tokens.kinds[0] == LINE_NR: # Número sem instrução
+            return cls(tokens, Rem(int(tokens.value(0))))
+        parser = Parser(tokens, quiet=True)
+        try:
+            statement = parser.parse_keyword()
+        except SyntaxError:
+            return cls(tokens, None)
+        if isinstance(statement, End) or parser.current_token[0] == EOF: # Depois do 'end' nada é lido
+            return cls(tokens, statement)
+        return cls(tokens, None)
+
+    def instructions(self, scratch): # scratch: CodeGen de nível 0 usado só para gerar fragmentos
+        if self.code is None:
+            self.code = scratch.fragment(self.statement)
+        return self.code
+
+
+class CompileCache:
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fragments = {} # Texto da linha -> LineFragment, do usado há mais tempo para o mais recente
+        self.scratch = CodeGen([])
+        self.hits = 0
+        self.misses = 0
+        self.entries = {} # Arquivo -> tamanho, do usado há mais tempo para o mais recente
+        files = []
+        os.makedirs(os.path.join(directory, 'images'), exist_ok=True)
+        for entry in os.scandir(os.path.join(directory, 'images')):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        for _, path, size in sorted(files):
+            self.entries[path] = size
+        self.size = sum(self.entries.values())
+        self.evict() # O limite pode ter diminuído desde a última vez
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.entries[path] = self.entries.pop(path, 0)
+
+    def store(self, path, data):
+        write_atomic(path, data)
+        self.size += len(data) - self.entries.pop(path, 0)
+        self.entries[path] = len(data)
+        self.evict()
+
+    def evict(self): # Remove as imagens usadas há mais tempo até o cache caber no limite
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self.size -= self.entries.pop(oldest)
+            try:
+                os.remove(oldest)
+            except FileNotFoundError: # Outro processo usando o mesmo cache já removeu
+                pass
+
+    def compile(self, text, options=None):
+        # Como compile_source, mas devolve a imagem guardada se o mesmo fonte já foi compilado com as
+        # mesmas opções; senão reaproveita as linhas já vistas por este cache
+        options = options or CompileOptions()
+        start = time.perf_counter()
+        path = os.path.join(self.directory, 'images', content_hash(compiler_hash(), options.opt_level, options.max_errors, options.target.name, text) + '.json')
+        try:
+            with open(path, 'rb') as file:
+                image = json.loads(file.read())
+        except (OSError, ValueError):
+            image = None
+        if image is not None:
+            self.hits += 1
+            self.touch(path)
+            return CompileResult.from_image(image, time.perf_counter() - start)
+        self.misses += 1
+        lines = text.splitlines()
+        if sum(line not in self.fragments for line in lines) > len(lines) // 2:
+            # Muitas linhas novas: compilar tudo de uma vez é mais rápido do que linha por linha
+            result = compile_source(text, options)
+            self.harvest(lines, result)
+        else:
+            result = self.compile_fragments(self.line_fragments(lines), options) or compile_source(text, options)
+        result.elapsed = time.perf_counter() - start
+        self.store(path, json.dumps(result.image()).encode())
+        return result
 
-print("\nAnálise concluída!\n")
+    def line_fragments(self, lines):
+        fragments = []
+        for line in lines:
+            fragment = self.fragments.pop(line, None) or LineFragment.parse(line)
+            self.fragments[line] = fragment # Mais recente no fim
+            fragments.append(fragment)
+        while len(self.fragments) > MAX_FRAGMENTS:
+            del self.fragments[next(iter(self.fragments))]
+        return fragments
 
-code_gen = CodeGen(tokens[:])
-code_gen.read_program()
+    def harvest(self, lines, result):
+        # Guarda os fragmentos das linhas de uma compilação completa sem erros: os tokens são
+        # repartidos entre as linhas (cada uma começa com LINE_NR) e as instruções da AST também
+        if result.errors:
+            return
+        tokens, program = result.tokens, result.program
+        starts = list(tokens.line_starts)
+        filled = [line for line in lines if line.strip()] # Linhas com tokens
+        if len(filled) != len(starts): # Alguma instrução continua na linha seguinte
+            return
+        statements = program + [None] * (len(filled) - len(program)) # Nada depois do 'end' é analisado
+        for line, start, end, statement in zip(filled, starts, starts[1:] + [len(tokens)], statements):
+            if line not in self.fragments:
+                self.fragments[line] = LineFragment(tokens[start:end], statement)
+        while len(self.fragments) > MAX_FRAGMENTS:
+            del self.fragments[next(iter(self.fragments))]
 
-debug = True # Flag p/ imprimir tudo de debug
+    def compile_fragments(self, fragments, options):
+        # None se alguma linha tem erro de sintaxe: só o compilador completo gera as mesmas mensagens
+        tokens = TokenTable()
+        program = []
+        used = []
+        ended = False
+        for fragment in fragments:
+            if not fragment.valid:
+                return None
+            tokens.extend(fragment.tokens)
+            if ended or not fragment.tokens:
+                continue
+            if fragment.statement is None:
+                return None
+            program.append(fragment.statement)
+            used.append(fragment)
+            ended = isinstance(fragment.statement, End)
+        if not ended:
+            return None
+        semantic_analyzer = SemanticAnalyzer(program, quiet=True, diagnostics=Diagnostics(options.max_errors))
+        try:
+            semantic_analyzer.analyze_program()
+        except TooManyErrors:
+            return None
+        code_gen = CodeGen(program, options.opt_level, options.target)
+        try:
+            if options.opt_level == 0: # Nos outros níveis as otimizações olham o programa inteiro
+                code_gen.read_fragments([fragment.instructions(self.scratch) for fragment in used])
+            else:
+                code_gen.read_program()
+        except Exception:
+            if not semantic_analyzer.error:
+                raise
+            code_gen = None
+        result = CompileResult(tokens, program, code_gen, semantic_analyzer.records, 0, options.target)
+        result.suppressed = semantic_analyzer.diagnostics.suppressed
+        return result
 
-if debug:
-    # Debug: Listar todos os tokens
-    print('***Debug***: Tokens:')
-    for token in tokens:
-        if token[0] == 'LINE_NR' and token != tokens[0]:
-            print()
-        print(token)
 
-    # Debug: Comprimento, consts, vars e linhas
-    print(f'\n***Debug***: Endereços ocupados: {len(code_gen.code)}')
+# ========== Linha de comando ==========:
+DEFAULT_SOURCE, DEFAULT_OUTPUT = 'source.txt', 'binary.txt'
+OUTPUT_EXTENSIONS = {'text': '.sml', 'binary': '.smb'}
+EXIT_CODES = {'ok': 0, 'errors': 1, 'overflow': 3, 'io_error': 4} # O maior código entre os arquivos é o da execução
+STREAM_THRESHOLD = 16 * 1024 * 1024 # Fontes maiores que isso (bytes) são compilados com compile_stream
+
+def write_atomic(path, text):
+    # Grava num arquivo temporário no mesmo diretório e o renomeia: quem lê a saída nunca a vê pela metade
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(text, bytes) else 'w') as file:
+            file.write(text)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def print_debug(result):
+    if result.tokens is not None:
+        print('***Debug***: Tokens:')
+        first = result.tokens[0] if len(result.tokens) else None
+        for token in result.tokens:
+            if token[0] == 'LINE_NR' and token != first:
+                print()
+            print(token)
+    print(f'\n***Debug***: Endereços ocupados: {len(result.code)}')
     print('\n***Debug***: Consts:')
-    print(code_gen.consts)
+    print(result.consts)
     print('\n***Debug***: Vars:')
-    print(code_gen.vars)
+    print(result.vars)
     print('\n***Debug***: SIMPLE Line | SML Line:')
-    print(code_gen.equiv_lines)
-
-# Conferir erros e avisar:
-if lexer.error or parser.error or semantic_analyzer.error:
-    print('\n***Info***: Erros encontrados na análise!\n')
-    if input('***Importante***: Tentar compilar mesmo assim? [S/n]: ') in ['n', 'N']:
-        print('Abortando!')
-        os._exit(0)
+    print(result.equiv_lines)
+    if 'saved_words' in result.opt_stats:
+        print(f"\n***Debug***: Endereços economizados pela alocação: {result.opt_stats['saved_words']}")
+    if 'hoisted' in result.opt_stats:
+        print(f"\n***Debug***: Cálculos levados para fora dos laços: {result.opt_stats['hoisted']}")
+    print('\n***Debug***: Código:')
+    for word in result.code:
+        print(word)
+
+
+CACHES = {} # (diretório, tamanho) -> CompileCache deste processo
+
+def open_cache(directory, max_bytes):
+    if (directory, max_bytes) not in CACHES:
+        CACHES[directory, max_bytes] = CompileCache(directory, max_bytes)
+    return CACHES[directory, max_bytes]
+
+
+def compile_file(source, output, options, force=False, debug=False, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, line_map=False, output_format='text'):
+    # Uma tarefa do pool: lê, compila e grava a saída; devolve o resumo do arquivo
+    entry = {'source': source, 'output': None}
+    result = None
+    try:
+        if not cache_dir and not debug and os.path.getsize(source) > STREAM_THRESHOLD:
+            with open(source, 'r') as file: # Lido aos poucos, sem o texto inteiro nem a lista de tokens em memória
+                result = compile_stream(file, options)
+        else:
+            with open(source, 'r') as file:
+                text = file.read()
+    except (OSError, UnicodeDecodeError) as error:
+        record = Diagnostic('Compiler', 'io_error', f'Não foi possível ler o arquivo: {error}')
+        entry.update(status='io_error', errors=[record.message], diagnostics=[record.as_dict()])
+        return entry
+    if result is None and cache_dir:
+        result = open_cache(cache_dir, cache_size).compile(text, options)
+    elif result is None:
+        result = compile_source(text, options)
+    if debug:
+        print_debug(result)
+    entry.update(result.summary())
+    if result.ok or force and result.code: # Com force, grava mesmo o código inoperante
+        try:
+            if output_format == 'binary':
+                write_atomic(output, result.packed_image())
+            else:
+                write_atomic(output, ''.join(word + '\n' for word in result.code))
+            entry['output'] = output
+            if line_map:
+                write_atomic(output + '.map', json.dumps(result.line_map(source)) + '\n')
+                entry['line_map'] = output + '.map'
+        except OSError as error:
+            record = Diagnostic('Compiler', 'io_error', f'Não foi possível gravar o arquivo: {error}')
+            entry['status'] = 'io_error'
+            entry['errors'] = entry['errors'] + [record.message]
+            entry['diagnostics'] = entry['diagnostics'] + [record.as_dict()]
+    return entry
+
+
+def collect_sources(paths, pattern):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            sources.append(path)
+    return sources
+
+
+def output_path(source, output, single, output_format='text'):
+    if output and single:
+        return output
+    directory = output or os.path.dirname(source)
+    return os.path.join(directory, os.path.splitext(os.path.basename(source))[0] + OUTPUT_EXTENSIONS[output_format])
+
+
+def print_profile(source, profile):
+    print(f'***Perfil***: {source}')
+    for record in profile['phases']:
+        line = f"  {record['phase']:<13}{record['wall'] * 1000:10.2f} ms  cpu {record['cpu'] * 1000:10.2f} ms"
+        if 'peak_memory' in record:
+            line += f"  pico {record['peak_memory'] / 1024:10.1f} KiB"
+        if record.get('tokens_per_second'):
+            line += f"  {record['tokens_per_second']:,.0f} tokens/s"
+        print(line)
+    for record in profile['passes']:
+        print(f"  {record['pass']:<17}{record['before']:>8} -> {record['after']:<8}{record['unit']}")
+    if profile['memory_words']:
+        words = profile['memory_words']
+        print(f"  memória: {words['code']} código + {words['consts']} consts + {words['vars']} vars = {words['total']} palavras")
+
+
+def report(entry, diagnostics='text'):
+    source = entry['source']
+    if diagnostics == 'text':
+        for message in entry['errors']:
+            print(f'***Erro***: {source}: {message}')
+        if entry.get('suppressed_errors'):
+            print(f"***Info***: {source}: {entry['suppressed_errors']} erros repetidos omitidos")
+    if entry['status'] == 'overflow':
+        print(f"***Erro***: {source}: código gerado ocupa {entry['words']} endereços, a memória tem {entry['memory_size']}")
+    if entry['output'] and entry['status'] != 'ok':
+        print(f"***Info***: {source}: código inoperante gravado em {entry['output']}")
+    elif entry['output']:
+        print(f"{source} -> {entry['output']}: {entry['words']} endereços")
+    if 'profile' in entry:
+        print_profile(source, entry['profile'])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compilador SIMPLE -> SML. Nunca pede confirmação: o resultado de cada arquivo vai para o resumo e para o código de saída.')
+    arg_parser.add_argument('sources', nargs='*', help=f'arquivos ou diretórios com código SIMPLE (padrão: {DEFAULT_SOURCE}, gravando {DEFAULT_OUTPUT})')
+    arg_parser.add_argument('-o', '--output', help='arquivo de saída, se houver uma só fonte; senão, diretório das saídas (padrão: <nome>.sml ao lado da fonte)')
+    arg_parser.add_argument('-O', '--opt-level', type=int, choices=(0, 1, 2, 3), default=0, help='nível de otimização (padrão: 0)')
+    arg_parser.add_argument('--target', choices=tuple(TARGETS), default=DEFAULT_TARGET.name, help='máquina alvo: classic (100 palavras de 4 dígitos), ext1000 ou ext10000 (memória e palavras maiores; padrão: %(default)s)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1, help='processos em paralelo (0: um por CPU)')
+    arg_parser.add_argument('--pattern', default='*.txt', help='arquivos compilados dentro de um diretório (padrão: *.txt)')
+    arg_parser.add_argument('--summary', help="grava o resumo em JSON neste arquivo ('-' para a saída padrão)")
+    arg_parser.add_argument('--force', action='store_true', help='grava a saída mesmo com erros ou sem caber na memória')
+    arg_parser.add_argument('--cache', metavar='DIR', help='reaproveita compilações anteriores guardadas neste diretório')
+    arg_parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB', help='tamanho máximo do cache (padrão: %(default)s MB)')
+    arg_parser.add_argument('--profile', nargs='?', const='full', choices=('full', 'time'), help="mede tempo, CPU e pico de memória de cada fase e o efeito de cada passe, também no resumo; 'time' não mede memória, que deixa a compilação mais lenta")
+    arg_parser.add_argument('--debug', action='store_true', help='imprime tokens, consts, vars e o código de cada arquivo')
+    arg_parser.add_argument('--format', choices=tuple(OUTPUT_EXTENSIONS), default='text', help="formato da saída: 'text' (uma palavra por linha) ou 'binary' (imagem compacta .smb, carregada sem interpretação pela Simpletron)")
+    arg_parser.add_argument('--line-map', action='store_true', help='grava <saída>.map com o endereço de cada linha SIMPLE, para o perfil de execução da Simpletron')
+    arg_parser.add_argument('--max-errors', type=int, default=DEFAULT_MAX_ERRORS, metavar='N', help='interrompe a compilação de um arquivo depois de N erros (0: sem limite; padrão: %(default)s)')
+    arg_parser.add_argument('--diagnostics', choices=('text', 'json'), default='text', help="formato dos erros: 'text' (uma linha por erro) ou 'json' (uma lista de registros no fim, na saída padrão)")
+    args = arg_parser.parse_args(argv)
+
+    if args.sources:
+        sources = collect_sources(args.sources, args.pattern)
+        outputs = [output_path(source, args.output, len(sources) == 1 and not os.path.isdir(args.sources[0]), args.format) for source in sources]
     else:
-        print('Código inoperante (compilado com erros):')
-elif len(code_gen.code) > 100:
-    print('\n***Erro***: Código gerado ocupa mais de 100 endereços!\n')
-    if input('***Importante***: Compilar mesmo assim? [S/n]: ') in ['n', 'N']:
-        print('Abortando!')
-        os._exit(0)
+        if not os.path.exists(DEFAULT_SOURCE):
+            print(f'\n***Erro***: Por favor coloque o código no arquivo "{DEFAULT_SOURCE}" no diretório do compilador!')
+            print('***Importante***: Se já estiver lá, confira o path do seu shell!\n')
+        sources, outputs = [DEFAULT_SOURCE], [args.output or (DEFAULT_OUTPUT if args.format == 'text' else 'binary.smb')]
+    options = CompileOptions(args.opt_level, profile=bool(args.profile), profile_memory=args.profile == 'full', max_errors=args.max_errors, target=args.target)
+    start = time.perf_counter()
+    tasks = [(source, output, options, args.force, args.debug, args.cache, args.cache_size * 1024 * 1024, args.line_map, args.format) for source, output in zip(sources, outputs)]
+    if args.jobs == 1 or len(tasks) <= 1:
+        entries = [compile_file(*task) for task in tasks]
     else:
-        print('Código inoperante (não cabe na memória):')
-else:
-    print('\nCompilado com sucesso!\n\nCódigo:')
-
-if os.path.exists("binary.txt"):
-    os.remove("binary.txt")
-bin_file = open("binary.txt", "w")
-for instr in code_gen.code:
-    print(instr)
-    bin_file.write(instr + "\n")
-bin_file.close()
-print('\n"binary.txt" gerado!')
+        workers = args.jobs or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            entries = list(pool.map(compile_file, *zip(*tasks), chunksize=max(1, len(tasks) // (workers * 4))))
+    exit_code = max((EXIT_CODES[entry['status']] for entry in entries), default=0)
+
+    if args.summary != '-':
+        for entry in entries:
+            report(entry, args.diagnostics)
+        if args.diagnostics == 'json':
+            records = [{'source': entry['source'], **record} for entry in entries for record in entry['diagnostics']]
+            print(json.dumps(records, indent=2, ensure_ascii=False))
+    if args.summary:
+        summary = {
+            'files': entries,
+            'total': len(entries),
+            'failed': sum(entry['status'] != 'ok' for entry in entries),
+            'elapsed': round(time.perf_counter() - start, 6),
+            'exit_code': exit_code,
+        }
+        text = json.dumps(summary, indent=2, ensure_ascii=False) + '\n'
+        if args.summary == '-':
+            sys.stdout.write(text)
+        else:
+            write_atomic(args.summary, text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+import compiler
+import simpletron
+
+# ========== Protocolo ==========:
+# Cada mensagem é um JSON em UTF-8 precedido do seu tamanho em bytes (4 bytes, big-endian). Um
+# cliente pode enviar vários pedidos sem esperar as respostas: cada pedido é atendido assim que
+# chega, e as respostas voltam na ordem em que ficam prontas, com o 'id' do pedido.
+#
+# Pedido:   {"id": 1, "op": "compile", "source": "10 end\n", "opt_level": 2, "target": "classic"}
+#           "op": "run" também executa o programa ("inputs": [...], "max_cycles": N, "jit": true);
+#           "ping", "stats" e "shutdown" não têm outros campos
+# Resposta: {"id": 1, "ok": true, "result": {...}, "timing": {...}}, ou {"id": 1, "ok": false, "error": "..."}
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 64 * 1024 * 1024 # Mensagens maiores que isso encerram a conexão
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'simple-compiler.sock')
+MEMO_SIZE = 256 # Respostas guardadas em memória pelo servidor, as usadas há mais tempo saem primeiro
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+async def read_frame(reader): # None quando o cliente fecha a conexão entre duas mensagens
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise ProtocolError('Conexão encerrada no meio de uma mensagem')
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ProtocolError(f'Mensagem de {size} bytes, o máximo é {MAX_FRAME}')
+    try:
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('Conexão encerrada no meio de uma mensagem')
+
+
+def encode_frame(message):
+    payload = json.dumps(message, ensure_ascii=False).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+# ========== Processos do pool ==========:
+# Cada processo importa o compilador uma vez e o mantém aquecido (regexes compiladas, cache de
+# linhas do CompileCache) entre os pedidos
+WORKER_CACHE = None # (diretório, tamanho) do CompileCache, se o servidor usa um
+
+def init_worker(cache_dir, cache_size):
+    global WORKER_CACHE
+    WORKER_CACHE = (cache_dir, cache_size) if cache_dir else None
+
+
+def handle_compile(request): # Executado num processo do pool; devolve (resultado, tempos)
+    start = time.perf_counter()
+    options = compiler.CompileOptions(request.get('opt_level', 0), max_errors=request.get('max_errors', compiler.DEFAULT_MAX_ERRORS),
+                                      target=request.get('target', compiler.DEFAULT_TARGET.name))
+    if WORKER_CACHE:
+        result = compiler.open_cache(*WORKER_CACHE).compile(request['source'], options)
+    else:
+        result = compiler.compile_source(request['source'], options)
+    response = {**result.summary(), 'code': result.code, 'equiv_lines': sorted(result.equiv_lines.items())}
+    timing = {'compile': time.perf_counter() - start}
+    if request['op'] == 'run' and result.ok:
+        start = time.perf_counter()
+        machine = simpletron.Simpletron(result.code, inputs=[str(value) for value in request.get('inputs', [])],
+                                        max_cycles=request.get('max_cycles', simpletron.DEFAULT_MAX_CYCLES),
+                                        jit=request.get('jit', False), target=simpletron.TARGETS[result.target.name])
+        error = None
+        try:
+            machine.run()
+        except (ValueError, simpletron.SimpletronError) as vmerr:
+            error = str(vmerr)
+        response['run'] = {'output': machine.output, 'cycles': machine.cycles, 'halted': machine.halted, 'error': error}
+        timing['run'] = time.perf_counter() - start
+    return response, timing
+
+
+# ========== Servidor ==========:
+def remove_stale_socket(path):
+    # Remove o socket de um servidor que não foi encerrado direito; se outro servidor ainda escuta
+    # nele, não o tira desse servidor
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f'Já há um servidor escutando em {path}')
+
+
+class CompileServer:
+    def __init__(self, workers=0, cache_dir=None, cache_size=compiler.DEFAULT_CACHE_SIZE):
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=init_worker,
+                                                           initargs=(cache_dir, cache_size))
+        self.memo = collections.OrderedDict() # Chave do pedido -> resultado
+        self.stats = {'requests': 0, 'memo_hits': 0, 'failed': 0, 'connections': 0}
+        self.started = time.time()
+        self.stopping = None # asyncio.Event, criado no laço de eventos
+
+    @staticmethod
+    def request_key(request):
+        fields = ('op', 'source', 'opt_level', 'target', 'max_errors', 'inputs', 'max_cycles', 'jit')
+        return compiler.content_hash(compiler.compiler_hash(), *(json.dumps(request.get(field)) for field in fields))
+
+    async def handle_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        lock = asyncio.Lock() # As respostas de pedidos simultâneos não se misturam no socket
+        tasks = set()
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader)
+                except (ProtocolError, ValueError) as error:
+                    await self.send(writer, lock, {'id': None, 'ok': False, 'error': f'Mensagem inválida: {error}'})
+                    break
+                if request is None:
+                    break
+                task = asyncio.create_task(self.serve_request(request, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError: # Cliente foi embora sem ler as respostas
+            pass
+        except asyncio.CancelledError: # O servidor está encerrando com a conexão ainda aberta
+            for task in tasks:
+                task.cancel()
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError, asyncio.CancelledError):
+                await writer.wait_closed()
+
+    async def send(self, writer, lock, message):
+        async with lock:
+            writer.write(encode_frame(message))
+            await writer.drain()
+
+    async def serve_request(self, request, writer, lock):
+        received = time.perf_counter()
+        self.stats['requests'] += 1
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            response = {'id': request_id, 'ok': True, **await self.dispatch(request)}
+        except (KeyError, TypeError, ValueError) as error:
+            self.stats['failed'] += 1
+            response = {'id': request_id, 'ok': False, 'error': f'Pedido inválido: {error}'}
+        except concurrent.futures.process.BrokenProcessPool:
+            self.stats['failed'] += 1
+            response = {'id': request_id, 'ok': False, 'error': 'Processo do pool encerrado durante a compilação'}
+        except Exception as error: # Erro interno do compilador: o servidor continua atendendo
+            self.stats['failed'] += 1
+            response = {'id': request_id, 'ok': False, 'error': f'Erro interno: {type(error).__name__}: {error}'}
+        response.setdefault('timing', {})['total'] = time.perf_counter() - received
+        await self.send(writer, lock, response)
+        if response['ok'] and request.get('op') == 'shutdown':
+            self.stopping.set()
+
+    async def dispatch(self, request):
+        if not isinstance(request, dict):
+            raise TypeError('o pedido deve ser um objeto JSON')
+        op = request.get('op')
+        if op == 'ping':
+            return {'result': 'pong'}
+        if op == 'stats':
+            return {'result': {**self.stats, 'memo_size': len(self.memo), 'uptime': round(time.time() - self.started, 3)}}
+        if op == 'shutdown': # O servidor para depois de enviar a resposta (ver serve_request)
+            return {'result': 'bye'}
+        if op not in ('compile', 'run'):
+            raise ValueError(f"operação desconhecida: {op!r}")
+        if not isinstance(request.get('source'), str):
+            raise TypeError("'source' deve ser o texto do programa")
+        if request.get('target', compiler.DEFAULT_TARGET.name) not in compiler.TARGETS:
+            raise ValueError(f"perfil desconhecido: {request['target']!r}")
+        key = self.request_key(request)
+        if key in self.memo:
+            self.stats['memo_hits'] += 1
+            self.memo.move_to_end(key)
+            return {'result': self.memo[key], 'timing': {'memo': True}}
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        result, timing = await loop.run_in_executor(self.pool, handle_compile, request)
+        timing['queue'] = max(0.0, time.perf_counter() - start - sum(timing.values())) # Espera no pool e transferência
+        self.memo[key] = result
+        while len(self.memo) > MEMO_SIZE:
+            self.memo.popitem(last=False)
+        return {'result': result, 'timing': timing}
+
+    async def serve(self, socket_path=None, host='127.0.0.1', port=None, ready=None):
+        self.stopping = asyncio.Event()
+        if port is not None:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            address = f'{host}:{server.sockets[0].getsockname()[1]}'
+        else:
+            remove_stale_socket(socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, socket_path)
+            address = socket_path
+        if ready:
+            ready(address)
+        try:
+            async with server:
+                await self.stopping.wait()
+        finally:
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Servidor de compilação SIMPLE: mantém o compilador carregado e atende pedidos de client.py.')
+    arg_parser.add_argument('--socket', default=DEFAULT_SOCKET, help='socket Unix em que o servidor escuta (padrão: %(default)s)')
+    arg_parser.add_argument('--port', type=int, help='escuta nesta porta TCP em vez do socket Unix (0: uma porta livre)')
+    arg_parser.add_argument('--host', default='127.0.0.1', help='endereço da porta TCP (padrão: %(default)s)')
+    arg_parser.add_argument('-j', '--workers', type=int, default=0, help='processos de compilação (padrão: um por CPU)')
+    arg_parser.add_argument('--cache', metavar='DIR', help='usa um CompileCache neste diretório em cada processo')
+    arg_parser.add_argument('--cache-size', type=int, default=compiler.DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB')
+    args = arg_parser.parse_args(argv)
+
+    server = CompileServer(args.workers, args.cache, args.cache_size * 1024 * 1024)
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port, ready=lambda address: print(f'***Info***: servidor escutando em {address}', flush=True)))
+    except KeyboardInterrupt:
+        pass
+    except OSError as error:
+        print(f'***Erro***: Não foi possível iniciar o servidor: {error}')
+        return 4
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
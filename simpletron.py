@@ -0,0 +1,736 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import sml_image
+from sml_target import (READ, WRITE, LOAD, STORE, ADD, SUBTRACT, DIVIDE, MULTIPLY, MODULE, BRANCH, BRANCHNEG, BRANCHZERO, HALT,
+                        BRANCH_OPCODES, Target, TARGETS, DEFAULT_TARGET)
+
+try:
+    import numpy as np
+except ImportError: # numpy só é necessário para BatchSimpletron
+    np = None
+
+DEFAULT_MAX_CYCLES = 1000000
+SCALAR_LANES = 64 # Abaixo disso, BatchSimpletron termina as máquinas restantes no interpretador
+
+
+class SimpletronError(RuntimeError):
+    pass
+
+
+def sml_divide(x, y): # Divisão inteira truncada em direção ao zero, como na Simpletron
+    quotient = abs(x) // abs(y)
+    return -quotient if (x < 0) != (y < 0) else quotient
+
+def sml_module(x, y): # Resto com o sinal do dividendo
+    return x - y * sml_divide(x, y)
+
+
+def parse_word(text, target=DEFAULT_TARGET):
+    word = int(text.strip())
+    if not target.word_min <= word <= target.word_max:
+        raise SimpletronError(f"Palavra inválida: '{text.strip()}'")
+    return word
+
+def detect_target(lines):
+    # O compilador grava todas as palavras com a largura do perfil: o menor perfil em que a
+    # palavra mais larga cabe é o do programa
+    digits = max((len(line.strip().lstrip('+-')) for line in lines if line.strip()), default=0)
+    for target in sorted(TARGETS.values(), key=lambda target: target.memory_size):
+        if digits <= target.word_digits:
+            return target
+    raise SimpletronError(f"Palavras de {digits} dígitos não correspondem a nenhum perfil")
+
+def load_words(path, target=None):
+    # Lê um binary.txt (uma palavra por linha, linhas vazias são ignoradas) ou uma imagem binária
+    # (sml_image); devolve as palavras, o perfil e o mapa de linhas SIMPLE (vazio no texto). Sem
+    # target, o perfil é o da imagem, ou detectado pela largura das palavras do texto
+    if sml_image.is_image(path):
+        with sml_image.SMLImage.load(path) as image: # As palavras são copiadas e o mmap, fechado
+            target = target or image_target(image)
+            if len(image.words) > target.memory_size:
+                raise SimpletronError(f"Programa ocupa {len(image.words)} endereços, a memória tem {target.memory_size}")
+            return image.words.tolist() if isinstance(image.words, memoryview) else list(image.words), target, image.equiv_lines
+    with open(path, "r") as bin_file:
+        lines = [line for line in bin_file if line.strip()]
+    target = target or detect_target(lines)
+    return [parse_word(line, target) for line in lines], target, {}
+
+def image_target(image):
+    for target in TARGETS.values():
+        if target.operand_digits == image.operand_digits:
+            return target
+    raise SimpletronError(f"Imagem com operandos de {image.operand_digits} dígitos não corresponde a nenhum perfil")
+
+
+class Simpletron:
+    def __init__(self, program, inputs=None, max_cycles=DEFAULT_MAX_CYCLES, echo=False, jit=False, target=DEFAULT_TARGET, profile=False):
+        # program: palavras SML como strings ('+2017', como em CodeGen.code) ou ints
+        if len(program) > target.memory_size:
+            raise SimpletronError(f"Programa ocupa {len(program)} endereços, a memória tem {target.memory_size}")
+        self.target = target
+        self.memory = [0] * target.memory_size
+        if not isinstance(program, memoryview): # Um memoryview (imagem binária) é copiado de uma vez
+            program = [parse_word(word, target) if isinstance(word, str) else word for word in program]
+        self.memory[:len(program)] = program
+        self.inputs = iter(inputs) if inputs is not None else None # None: lê do stdin
+        self.max_cycles = max_cycles
+        self.echo = echo
+        self.jit = jit # Executa o programa traduzido para Python (ver translate)
+        # Com profile, o interpretador conta as execuções de cada endereço e os desvios condicionais
+        # tomados (ver ExecutionProfile); o código traduzido não é usado
+        self.hits = [0] * target.memory_size if profile else None
+        self.taken = [0] * target.memory_size if profile else None
+        self.output = []
+        self.accumulator = 0
+        self.pc = 0
+        self.cycles = 0
+        self.elapsed = 0.0
+        self.halted = False
+
+    @classmethod
+    def from_file(cls, path, target=None, **kwargs):
+        words, target, equiv_lines = load_words(path, target)
+        machine = cls(words, target=target, **kwargs)
+        machine.equiv_lines = equiv_lines # Mapa de linhas da imagem binária, para o perfil de execução
+        return machine
+
+    @property
+    def instructions_per_second(self):
+        return self.cycles / self.elapsed if self.elapsed > 0 else 0.0
+
+    def read_input(self):
+        if self.inputs is None:
+            text = input('? ')
+        else:
+            text = next(self.inputs, None)
+            if text is None:
+                raise SimpletronError("Entrada esgotada")
+        value = int(text)
+        if not self.target.word_min <= value <= self.target.word_max:
+            raise SimpletronError(f"Entrada fora do intervalo ({self.target.word_min} a {self.target.word_max}): {value}")
+        return value
+
+    def write_output(self, value):
+        self.output.append(value)
+        if self.echo:
+            print(value)
+
+    def run(self):
+        if self.jit and not self.halted and self.hits is None:
+            translated = translate(self.memory, self.pc, self.target)
+            if translated is not None:
+                start = time.perf_counter()
+                try:
+                    translated(self, self.memory, self.read_input, self.write_output)
+                finally:
+                    self.elapsed += time.perf_counter() - start
+                if self.halted:
+                    return self.output
+                # O código traduzido devolve o controle antes do limite de ciclos ou de uma falha;
+                # o interpretador reexecuta a partir daí e para exatamente no mesmo ponto
+        return self.interpret()
+
+    def interpret(self):
+        # Laço de decodificação/despacho: estado em variáveis locais, opcodes mais comuns primeiro
+        memory = self.memory
+        acc = self.accumulator
+        pc = self.pc
+        cycles = self.cycles
+        max_cycles = self.max_cycles
+        memory_size, scale = self.target.memory_size, self.target.scale
+        hits, taken = self.hits, self.taken
+        word_min, word_max = self.target.word_min, self.target.word_max
+        start = time.perf_counter()
+        try:
+            while True:
+                if cycles >= max_cycles:
+                    raise SimpletronError(f"Limite de {max_cycles} ciclos excedido, endereço {pc}")
+                if not 0 <= pc < memory_size:
+                    raise SimpletronError(f"Contador de instruções fora da memória: {pc}")
+                opcode, operand = divmod(memory[pc], scale)
+                if hits is not None:
+                    hits[pc] += 1
+                cycles += 1
+                pc += 1
+                if opcode == LOAD:
+                    acc = memory[operand]
+                elif opcode == STORE:
+                    memory[operand] = acc
+                elif opcode == ADD:
+                    acc += memory[operand]
+                    if not word_min <= acc <= word_max:
+                        raise SimpletronError(f"Overflow do acumulador: {acc}, endereço {pc - 1}")
+                elif opcode == SUBTRACT:
+                    acc -= memory[operand]
+                    if not word_min <= acc <= word_max:
+                        raise SimpletronError(f"Overflow do acumulador: {acc}, endereço {pc - 1}")
+                elif opcode == BRANCHNEG:
+                    if acc < 0:
+                        if taken is not None:
+                            taken[pc - 1] += 1
+                        pc = operand
+                elif opcode == BRANCHZERO:
+                    if acc == 0:
+                        if taken is not None:
+                            taken[pc - 1] += 1
+                        pc = operand
+                elif opcode == BRANCH:
+                    pc = operand
+                elif opcode == MULTIPLY:
+                    acc *= memory[operand]
+                    if not word_min <= acc <= word_max:
+                        raise SimpletronError(f"Overflow do acumulador: {acc}, endereço {pc - 1}")
+                elif opcode == DIVIDE or opcode == MODULE:
+                    if memory[operand] == 0:
+                        raise SimpletronError(f"Divisão por zero, endereço {pc - 1}")
+                    if opcode == DIVIDE:
+                        acc = sml_divide(acc, memory[operand])
+                    else:
+                        acc = sml_module(acc, memory[operand])
+                elif opcode == READ:
+                    memory[operand] = self.read_input()
+                elif opcode == WRITE:
+                    self.write_output(memory[operand])
+                elif opcode == HALT:
+                    self.halted = True
+                    break
+                else:
+                    raise SimpletronError(f"Opcode inválido: {memory[pc - 1]}, endereço {pc - 1}")
+        finally:
+            self.pc = pc
+            self.accumulator = acc
+            self.cycles = cycles
+            self.elapsed += time.perf_counter() - start
+        return self.output
+
+
+# ========== Tradução SML -> Python ==========:
+# Cada bloco básico alcançável a partir do ponto de entrada vira uma sequência de comandos Python
+# numa única função gerada; a memória usada pelo programa vira variáveis locais (m<endereço>) e os
+# desvios 40/41/42 viram trocas de bloco. Falhas (overflow, divisão por zero, limite de ciclos)
+# não são tratadas no código gerado: ele desfaz a instrução, devolve o controle no endereço dela e
+# o interpretador a reexecuta, gerando o mesmo erro com o mesmo estado.
+
+VALID_OPCODES = {READ, WRITE, LOAD, STORE, ADD, SUBTRACT, DIVIDE, MULTIPLY, MODULE, BRANCH, BRANCHNEG, BRANCHZERO, HALT}
+TRANSLATION_CACHE = {} # (hash da imagem, entrada) -> função traduzida, ou None se não traduzível
+
+
+def find_blocks(memory, entry, target=DEFAULT_TARGET):
+    # Retorna {início do bloco: [endereços]} com os blocos básicos alcançáveis a partir de entry,
+    # ou None se o programa escreve sobre as próprias instruções (código automodificável)
+    leaders = {entry}
+    reachable = set()
+    pending = [entry]
+    while pending:
+        address = pending.pop()
+        if address in reachable or not 0 <= address < target.memory_size:
+            continue
+        reachable.add(address)
+        opcode, operand = divmod(memory[address], target.scale)
+        if opcode == HALT or opcode not in VALID_OPCODES:
+            continue
+        if opcode == BRANCH:
+            leaders.add(operand)
+            pending.append(operand)
+        elif opcode == BRANCHNEG or opcode == BRANCHZERO:
+            leaders.update((operand, address + 1))
+            pending.extend((operand, address + 1))
+        else:
+            pending.append(address + 1)
+    for address in reachable:
+        opcode, operand = divmod(memory[address], target.scale)
+        if (opcode == STORE or opcode == READ) and operand in reachable:
+            return None
+    blocks = {}
+    for leader in sorted(leaders & reachable):
+        block = [leader]
+        while True:
+            opcode = memory[block[-1]] // target.scale
+            following = block[-1] + 1
+            if opcode in BRANCH_OPCODES or opcode == HALT or opcode not in VALID_OPCODES:
+                break
+            if following in leaders or following not in reachable:
+                break
+            block.append(following)
+        blocks[leader] = block
+    return blocks
+
+
+def dispatch(code, leaders, indent):
+    # Árvore de comparações sobre os inícios de bloco ordenados: escolher o bloco de pc custa
+    # log2(blocos) comparações, em vez de uma por bloco anterior numa cadeia de ifs
+    pad = ' ' * indent
+    if not leaders:
+        return []
+    if len(leaders) == 1:
+        return [f'{pad}if pc == {leaders[0]}:'] + [f'{pad}    {line}' for line in code[leaders[0]]]
+    middle = len(leaders) // 2
+    return ([f'{pad}if pc < {leaders[middle]}:'] + dispatch(code, leaders[:middle], indent + 4) +
+            [f'{pad}else:'] + dispatch(code, leaders[middle:], indent + 4))
+
+
+def generate_source(memory, entry, target=DEFAULT_TARGET):
+    blocks = find_blocks(memory, entry, target)
+    if blocks is None:
+        return None
+    loaded = set()
+    stored = set()
+    code = {} # Início do bloco -> linhas do bloco, sem a indentação
+    for leader, block in blocks.items():
+        size = len(block)
+        body = code[leader] = []
+        body.append(f'if cycles + {size} > limit:')
+        body.append(f'    break')
+        body.append(f'cycles += {size}')
+        for position, address in enumerate(block):
+            opcode, operand = divmod(memory[address], target.scale)
+            var = f'm{operand}'
+            # Desfaz a instrução atual: pc volta para ela e os ciclos ainda não executados são devolvidos
+            bailout = f'pc = {address}; cycles -= {size - position}; break'
+            if opcode in (LOAD, ADD, SUBTRACT, MULTIPLY, DIVIDE, MODULE, WRITE):
+                loaded.add(operand)
+            if opcode == LOAD:
+                body.append(f'a = {var}')
+            elif opcode == STORE:
+                stored.add(operand)
+                body.append(f'{var} = a')
+            elif opcode in (ADD, SUBTRACT, MULTIPLY):
+                operator, inverse = {ADD: ('+=', '-='), SUBTRACT: ('-=', '+='), MULTIPLY: ('*=', '//=')}[opcode]
+                body.append(f'a {operator} {var}')
+                body.append(f'if a > {target.word_max} or a < {target.word_min}:')
+                body.append(f'    a {inverse} {var}; {bailout}')
+            elif opcode in (DIVIDE, MODULE):
+                body.append(f'if not {var}:')
+                body.append(f'    {bailout}')
+                body.append(f'a = {"divide" if opcode == DIVIDE else "module"}(a, {var})')
+            elif opcode == READ:
+                # Estado exato antes da leitura, caso ela falhe (entrada esgotada ou inválida)
+                stored.add(operand)
+                remaining = size - position - 1
+                body.append(f'pc = {address + 1}; cycles -= {remaining}')
+                body.append(f'{var} = read()')
+                body.append(f'cycles += {remaining}')
+            elif opcode == WRITE:
+                body.append(f'write({var})')
+            elif opcode == HALT:
+                body.append(f'pc = {address + 1}')
+                body.append(f'vm.halted = True')
+                body.append(f'return')
+            elif opcode == BRANCH:
+                body.append(f'pc = {operand}')
+                body.append(f'continue')
+            elif opcode == BRANCHNEG or opcode == BRANCHZERO:
+                test = 'a < 0' if opcode == BRANCHNEG else 'a == 0'
+                body.append(f'pc = {operand} if {test} else {address + 1}')
+                body.append(f'continue')
+            else: # Opcode inválido: o interpretador gera o erro
+                body.append(bailout)
+        last = memory[block[-1]] // target.scale
+        if last not in BRANCH_OPCODES + (HALT,) and last in VALID_OPCODES:
+            body.append(f'pc = {block[-1] + 1}') # Continua no bloco seguinte
+            body.append(f'continue')
+    # Endereços só lidos também são cacheados em locais: como o código não é modificado,
+    # só os endereços escritos precisam ser devolvidos à memória
+    lines = ['def translated(vm, m, read, write):',
+             '    a = vm.accumulator',
+             '    pc = vm.pc',
+             '    cycles = vm.cycles',
+             '    limit = vm.max_cycles']
+    lines += [f'    m{address} = m[{address}]' for address in sorted(loaded | stored)]
+    lines += ['    try:', '        while True:']
+    lines += dispatch(code, sorted(code), 12)
+    lines += ['            break # pc fora dos blocos traduzidos']
+    lines += ['    finally:']
+    lines += [f'        m[{address}] = m{address}' for address in sorted(stored)]
+    lines += ['        vm.pc = pc', '        vm.accumulator = a', '        vm.cycles = cycles']
+    return '\n'.join(lines) + '\n'
+
+
+def image_hash(memory):
+    return hashlib.sha256(','.join(map(str, memory)).encode()).hexdigest()
+
+def translate(memory, entry=0, target=DEFAULT_TARGET):
+    key = (image_hash(memory), entry, target.name)
+    if key not in TRANSLATION_CACHE:
+        source = generate_source(memory, entry, target)
+        if source is None:
+            TRANSLATION_CACHE[key] = None
+        else:
+            namespace = {'divide': sml_divide, 'module': sml_module}
+            exec(compile(source, f'<sml {key[0][:12]}>', 'exec'), namespace)
+            TRANSLATION_CACHE[key] = namespace['translated']
+    return TRANSLATION_CACHE[key]
+
+
+# ========== Execução em lote (numpy) ==========:
+# N máquinas independentes executam a mesma imagem em passo sincronizado: a memória é uma matriz
+# N x tamanho da memória, o acumulador e o pc são vetores, e cada passo executa uma instrução em todas as máquinas
+# ativas (cada uma no próprio pc, desvios resolvidos com máscaras)
+
+class BatchSimpletron:
+    def __init__(self, program, inputs, max_cycles=DEFAULT_MAX_CYCLES, target=DEFAULT_TARGET):
+        # inputs: matriz N x k; a i-ésima leitura da máquina n lê a coluna i da linha n
+        if np is None:
+            raise ImportError('BatchSimpletron requer o pacote numpy')
+        if len(program) > target.memory_size:
+            raise SimpletronError(f"Programa ocupa {len(program)} endereços, a memória tem {target.memory_size}")
+        self.target = target
+        self.inputs = np.asarray(inputs, dtype=np.int64)
+        if self.inputs.ndim != 2:
+            raise SimpletronError('As entradas devem ser uma matriz (máquinas x valores)')
+        if self.inputs.size and (self.inputs.min() < target.word_min or self.inputs.max() > target.word_max):
+            raise SimpletronError(f"Entrada fora do intervalo ({target.word_min} a {target.word_max})")
+        self.lanes = self.inputs.shape[0]
+        image = np.zeros(target.memory_size, dtype=np.int32)
+        image[:len(program)] = [parse_word(word, target) if isinstance(word, str) else word for word in program]
+        self.memory = np.tile(image, (self.lanes, 1))
+        self.accumulator = np.zeros(self.lanes, dtype=np.int64)
+        self.pc = np.zeros(self.lanes, dtype=np.int64)
+        self.cycles = np.zeros(self.lanes, dtype=np.int64)
+        self.input_pos = np.zeros(self.lanes, dtype=np.int64)
+        self.running = np.ones(self.lanes, dtype=bool)
+        self.halted = np.zeros(self.lanes, dtype=bool)
+        self.max_cycles = max_cycles
+        self.errors = [None] * self.lanes # Mensagem de erro de cada máquina, como na Simpletron
+        self.writes = [] # (máquinas, valores) de cada instrução 11 executada, em ordem
+
+    @property
+    def outputs(self):
+        outputs = [[] for _ in range(self.lanes)]
+        for lanes, values in self.writes:
+            for lane, value in zip(lanes.tolist(), values.tolist()):
+                outputs[lane].append(value)
+        return outputs
+
+    def fail(self, lanes, messages):
+        self.running[lanes] = False
+        for lane, message in zip(lanes.tolist(), messages):
+            self.errors[lane] = message
+
+    def run(self):
+        max_cycles = self.max_cycles
+        while True:
+            active = np.flatnonzero(self.running)
+            if active.size <= SCALAR_LANES:
+                # Poucas máquinas restantes (a cauda de programas com laços de duração variável):
+                # o custo fixo de cada passo do numpy passa a ser maior que interpretá-las uma a uma
+                for lane in active.tolist():
+                    self.run_scalar(lane)
+                break
+            pcs = self.pc[active]
+            exceeded = self.cycles[active] >= max_cycles
+            if exceeded.any():
+                self.fail(active[exceeded], [f"Limite de {max_cycles} ciclos excedido, endereço {pc}" for pc in pcs[exceeded].tolist()])
+                active, pcs = active[~exceeded], pcs[~exceeded]
+            outside = pcs >= self.target.memory_size
+            if outside.any():
+                self.fail(active[outside], [f"Contador de instruções fora da memória: {pc}" for pc in pcs[outside].tolist()])
+                active, pcs = active[~outside], pcs[~outside]
+            if not active.size:
+                continue
+            if (pcs == pcs[0]).all(): # Caso comum: todas as máquinas na mesma instrução
+                address = int(pcs[0])
+                words = self.memory[active, address]
+                if (words == words[0]).all():
+                    opcode, operand = divmod(int(words[0]), self.target.scale)
+                    self.execute(opcode, active, address, operand)
+                    continue
+            # Máquinas em instruções diferentes: cada opcode presente é executado uma vez, com
+            # máscaras selecionando as máquinas e operandos/pcs por máquina
+            opcodes, operands = np.divmod(self.memory[active, pcs], self.target.scale)
+            for opcode in np.unique(opcodes).tolist():
+                selected = opcodes == opcode
+                self.execute(opcode, active[selected], pcs[selected], operands[selected])
+        return self.outputs
+
+    def execute(self, opcode, lanes, addresses, operands):
+        # addresses e operands são escalares (todas as máquinas na mesma instrução) ou vetores
+        memory = self.memory
+        self.cycles[lanes] += 1
+        self.pc[lanes] = addresses + 1
+        if opcode == LOAD:
+            self.accumulator[lanes] = memory[lanes, operands]
+        elif opcode == STORE:
+            memory[lanes, operands] = self.accumulator[lanes]
+        elif opcode in (ADD, SUBTRACT, MULTIPLY):
+            values = memory[lanes, operands].astype(np.int64)
+            if opcode == ADD:
+                result = self.accumulator[lanes] + values
+            elif opcode == SUBTRACT:
+                result = self.accumulator[lanes] - values
+            else:
+                result = self.accumulator[lanes] * values
+            self.accumulator[lanes] = result
+            overflow = (result > self.target.word_max) | (result < self.target.word_min)
+            if overflow.any():
+                self.fail_at(lanes, addresses, overflow, lambda acc: f"Overflow do acumulador: {acc}", result)
+        elif opcode == DIVIDE or opcode == MODULE:
+            divisors = memory[lanes, operands].astype(np.int64)
+            zero = divisors == 0
+            if zero.any():
+                self.fail_at(lanes, addresses, zero, lambda _: "Divisão por zero", divisors)
+                lanes, divisors = lanes[~zero], divisors[~zero]
+                operands = np.broadcast_to(operands, zero.shape)[~zero]
+            dividends = self.accumulator[lanes]
+            quotients = np.abs(dividends) // np.abs(divisors) # Truncada em direção ao zero
+            quotients = np.where((dividends < 0) != (divisors < 0), -quotients, quotients)
+            if opcode == DIVIDE:
+                self.accumulator[lanes] = quotients
+            else:
+                self.accumulator[lanes] = dividends - divisors * quotients
+        elif opcode == READ:
+            positions = self.input_pos[lanes]
+            exhausted = positions >= self.inputs.shape[1]
+            if exhausted.any():
+                self.fail(lanes[exhausted], ['Entrada esgotada'] * int(exhausted.sum()))
+                lanes, positions = lanes[~exhausted], positions[~exhausted]
+                operands = np.broadcast_to(operands, exhausted.shape)[~exhausted]
+            memory[lanes, operands] = self.inputs[lanes, positions]
+            self.input_pos[lanes] += 1
+        elif opcode == WRITE:
+            self.writes.append((lanes, memory[lanes, operands]))
+        elif opcode == BRANCH:
+            self.pc[lanes] = operands
+        elif opcode == BRANCHNEG:
+            self.pc[lanes] = np.where(self.accumulator[lanes] < 0, operands, addresses + 1)
+        elif opcode == BRANCHZERO:
+            self.pc[lanes] = np.where(self.accumulator[lanes] == 0, operands, addresses + 1)
+        elif opcode == HALT:
+            self.halted[lanes] = True
+            self.running[lanes] = False
+        else:
+            words = (opcode * self.target.scale + np.broadcast_to(operands, lanes.shape)).tolist()
+            addresses = np.broadcast_to(addresses, lanes.shape).tolist()
+            self.fail(lanes, [f"Opcode inválido: {word}, endereço {address}" for word, address in zip(words, addresses)])
+
+    def run_scalar(self, lane):
+        machine = Simpletron(self.memory[lane].tolist(), inputs=self.inputs[lane, self.input_pos[lane]:].tolist(),
+                             max_cycles=self.max_cycles, target=self.target)
+        machine.accumulator = int(self.accumulator[lane])
+        machine.pc = int(self.pc[lane])
+        machine.cycles = int(self.cycles[lane])
+        try:
+            machine.run()
+        except SimpletronError as vmerr:
+            self.errors[lane] = str(vmerr)
+        self.memory[lane] = machine.memory
+        self.accumulator[lane] = machine.accumulator
+        self.pc[lane] = machine.pc
+        self.cycles[lane] = machine.cycles
+        self.input_pos[lane] = self.inputs.shape[1] - len(list(machine.inputs))
+        self.halted[lane] = machine.halted
+        self.running[lane] = False
+        if machine.output:
+            self.writes.append((np.full(len(machine.output), lane), np.array(machine.output)))
+
+    def fail_at(self, lanes, addresses, mask, describe, values):
+        addresses = np.broadcast_to(addresses, mask.shape)[mask].tolist()
+        self.fail(lanes[mask], [f"{describe(value)}, endereço {address}" for value, address in zip(values[mask].tolist(), addresses)])
+
+# ========== Perfil de execução ==========:
+# Os contadores por endereço de uma execução com profile=True são atribuídos às linhas SIMPLE pelo
+# mapa linha -> endereço da primeira instrução (equiv_lines do compilador, gravado com --line-map).
+# Um desvio para trás tomado é uma iteração do laço entre o alvo e o desvio
+
+def load_line_map(path): # Devolve (equiv_lines, texto de cada linha SIMPLE ou {})
+    with open(path, "r") as map_file:
+        line_map = json.load(map_file)
+    equiv_lines = {int(line): address for line, address in line_map['equiv_lines']}
+    source_lines = {}
+    if line_map.get('source'):
+        try:
+            with open(line_map['source'], "r") as source_file:
+                for text in source_file:
+                    number = text.split(maxsplit=1)[0] if text.strip() else ''
+                    if number.isdigit():
+                        source_lines[int(number)] = text.strip()
+        except (OSError, UnicodeDecodeError): # O relatório fica sem o texto das linhas
+            pass
+    return equiv_lines, source_lines
+
+
+class ExecutionProfile:
+    def __init__(self, machine, equiv_lines=None, source_lines=None):
+        if machine.hits is None:
+            raise SimpletronError('A máquina não foi executada com profile=True')
+        self.hits = machine.hits
+        self.taken = machine.taken
+        self.source_lines = source_lines or {}
+        self.cycles = machine.cycles
+        scale = machine.target.scale
+        self.opcodes = [word // scale for word in machine.memory]
+        self.operands = [word % scale for word in machine.memory]
+        self.owners = self.attribute(equiv_lines, len(machine.memory))
+        self.loops = self.find_loops()
+
+    @staticmethod
+    def attribute(equiv_lines, size):
+        # Linha dona de cada endereço: a de maior endereço inicial <= endereço. Linhas que não geram
+        # código dividem o endereço inicial com a seguinte, que é a dona. Sem mapa, None
+        owners = [None] * size
+        if not equiv_lines:
+            return owners
+        starts = sorted((address, line) for line, address in equiv_lines.items())
+        for (address, line), (following, _) in zip(starts, starts[1:] + [(size, None)]):
+            owners[address:following] = [line] * (following - address)
+        return owners
+
+    def label(self, address):
+        line = self.owners[address]
+        return f'linha {line}' if line is not None else f'endereço {address}'
+
+    def loop_name(self, start, end):
+        if self.owners[start] is None:
+            return f'laço {start}-{end}'
+        return f'laço {self.owners[start]}-{self.owners[end]}'
+
+    def branch_counts(self, address): # (tomados, não tomados) de um desvio executado
+        if self.opcodes[address] == BRANCH:
+            return self.hits[address], 0
+        return self.taken[address], self.hits[address] - self.taken[address]
+
+    def find_loops(self):
+        # Um laço por cabeçalho (alvo de desvios para trás tomados): [início, fim, iterações, entradas]
+        loops = {}
+        for address, hits in enumerate(self.hits):
+            if hits and self.opcodes[address] in BRANCH_OPCODES and self.operands[address] <= address:
+                taken, _ = self.branch_counts(address)
+                if taken:
+                    loop = loops.setdefault(self.operands[address], [self.operands[address], address, 0, 0])
+                    loop[1] = max(loop[1], address)
+                    loop[2] += taken
+        for header, loop in loops.items():
+            loop[3] = self.hits[header] - loop[2] # Execuções do cabeçalho que não vieram do próprio laço
+        return sorted(loops.values())
+
+    def lines(self):
+        # Contadores por linha, da mais executada para a menos
+        records = {}
+        for address, hits in enumerate(self.hits):
+            if not hits:
+                continue
+            key = self.owners[address] if self.owners[address] is not None else f'@{address}'
+            record = records.setdefault(key, {'line': self.owners[address], 'address': address, 'hits': 0, 'taken': 0, 'not_taken': 0, 'iterations': 0})
+            record['hits'] += hits
+            if self.opcodes[address] in BRANCH_OPCODES:
+                taken, not_taken = self.branch_counts(address)
+                record['taken'] += taken
+                record['not_taken'] += not_taken
+        for start, end, iterations, entries in self.loops:
+            key = self.owners[start] if self.owners[start] is not None else f'@{start}'
+            if key in records:
+                records[key]['iterations'] += iterations
+        for record in records.values():
+            record['source'] = self.source_lines.get(record['line'], '')
+        return sorted(records.values(), key=lambda record: (-record['hits'], record['address']))
+
+    def report(self, limit=20):
+        lines = [f"{'linha':>8} {'instruções':>12} {'%':>6} {'desvios tomados':>18} {'iterações':>10}  código"]
+        for record in self.lines()[:limit or None]:
+            branches = record['taken'] + record['not_taken']
+            ratio = f"{record['taken']}/{branches} ({record['taken'] / branches:.0%})" if branches else '-'
+            name = record['line'] if record['line'] is not None else f"@{record['address']}"
+            share = record['hits'] / self.cycles if self.cycles else 0
+            lines.append(f"{name:>8} {record['hits']:>12,} {share:>6.1%} {ratio:>18} {record['iterations'] or '-':>10}  {record['source']}")
+        if self.loops:
+            lines.append('')
+            lines.append('laços (cabeçalho-último desvio para trás): iterações, entradas, iterações por entrada')
+            for start, end, iterations, entries in self.loops:
+                average = iterations / entries if entries > 0 else iterations
+                lines.append(f'  {self.loop_name(start, end)}: {iterations:,}, {entries:,}, {average:,.1f}')
+        return '\n'.join(lines)
+
+    def folded_stacks(self):
+        # Formato dos flamegraphs (flamegraph.pl, speedscope, inferno): 'quadro;quadro;... contagem'.
+        # A pilha de um endereço são os laços que o contêm, do mais externo ao mais interno, e a linha
+        stacks = {}
+        for address, hits in enumerate(self.hits):
+            if not hits:
+                continue
+            loops = sorted((loop for loop in self.loops if loop[0] <= address <= loop[1]), key=lambda loop: loop[0] - loop[1])
+            frames = ['programa'] + [self.loop_name(start, end) for start, end, _, _ in loops] + [self.label(address)]
+            stack = ';'.join(frames)
+            stacks[stack] = stacks.get(stack, 0) + hits
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.items())
+
+
+def run_batch(args):
+    try:
+        with open(args.batch, "r") as inputs_file:
+            inputs = [[int(value) for value in line.split()] for line in inputs_file if line.strip()]
+        if len({len(row) for row in inputs}) > 1:
+            raise SimpletronError('Todas as linhas de entrada devem ter o mesmo número de valores')
+        words, target, _ = load_words(args.binary, TARGETS.get(args.target))
+        machines = BatchSimpletron(words, inputs, max_cycles=args.max_cycles, target=target)
+    except (OSError, ValueError, ImportError, SimpletronError) as loaderr:
+        print(f"\n***Erro***: Simpletron: {loaderr}\n")
+        return 1
+    start = time.perf_counter()
+    outputs = machines.run()
+    elapsed = time.perf_counter() - start
+    for lane, output in enumerate(outputs):
+        error = f' ***Erro***: {machines.errors[lane]}' if machines.errors[lane] else ''
+        print(f"{lane}: {' '.join(map(str, output))}{error}")
+    cycles = int(machines.cycles.sum())
+    print(f'\n***Info***: {machines.lanes} máquinas, {cycles} instruções em {elapsed:.4f}s '
+          f'({cycles / elapsed if elapsed > 0 else 0:,.0f} instruções/s)')
+    return 1 if any(machines.errors) else 0
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Executa um programa SML (binary.txt) na Simpletron.')
+    arg_parser.add_argument('binary', nargs='?', default='binary.txt')
+    arg_parser.add_argument('-i', '--input', nargs='*', help='Valores de entrada (sem eles, lê do stdin)')
+    arg_parser.add_argument('--max-cycles', type=int, default=DEFAULT_MAX_CYCLES)
+    arg_parser.add_argument('--target', choices=tuple(TARGETS),
+                            help='Perfil da máquina (memória e largura das palavras); sem ele, detectado pela largura das palavras')
+    arg_parser.add_argument('--jit', action='store_true', help='Traduz o programa para Python antes de executar')
+    arg_parser.add_argument('--profile', nargs='?', type=int, const=20, metavar='N',
+                            help='Conta as execuções de cada instrução e imprime as N linhas SIMPLE mais executadas (0: todas; padrão: 20)')
+    arg_parser.add_argument('--flamegraph', metavar='ARQUIVO', help='Grava o perfil da execução em formato de flamegraph (pilhas dobradas)')
+    arg_parser.add_argument('--line-map', metavar='ARQUIVO',
+                            help='Mapa de linhas gravado pelo compilador com --line-map (padrão: <binary>.map, se existir)')
+    arg_parser.add_argument('--batch', metavar='ENTRADAS',
+                            help='Executa uma máquina por linha do arquivo (valores separados por espaço), com numpy')
+    args = arg_parser.parse_args(argv)
+    if args.batch:
+        return run_batch(args)
+
+    profile = args.profile is not None or args.flamegraph
+    line_map = args.line_map or (args.binary + '.map' if os.path.exists(args.binary + '.map') else None)
+    try:
+        machine = Simpletron.from_file(args.binary, TARGETS.get(args.target), inputs=args.input,
+                                           max_cycles=args.max_cycles, echo=True, jit=args.jit, profile=profile)
+        equiv_lines, source_lines = load_line_map(line_map) if profile and line_map else (machine.equiv_lines, {})
+    except (OSError, ValueError, KeyError, SimpletronError) as loaderr:
+        print(f"\n***Erro***: Simpletron: {loaderr}\n")
+        return 1
+    status = 0
+    try:
+        machine.run()
+    except (ValueError, SimpletronError) as vmerr:
+        print(f"\n***Erro***: Simpletron: {vmerr}\n")
+        status = 1
+    print(f'\n***Info***: {machine.cycles} instruções em {machine.elapsed:.4f}s '
+          f'({machine.instructions_per_second:,.0f} instruções/s)')
+    if profile: # Também depois de um erro: o perfil mostra onde a execução estava
+        execution_profile = ExecutionProfile(machine, equiv_lines, source_lines)
+        if args.profile is not None:
+            print(f'\n***Perfil***:\n{execution_profile.report(args.profile)}')
+        if args.flamegraph:
+            try:
+                with open(args.flamegraph, "w") as flamegraph_file:
+                    flamegraph_file.write(execution_profile.folded_stacks())
+            except OSError as writeerr:
+                print(f"\n***Erro***: Simpletron: {writeerr}\n")
+                status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+
+# ========== Imagem binária da SML ==========:
+# Alternativa ao binary.txt que não precisa ser interpretada para ser carregada. Cabeçalho
+# (little-endian): 'SMLB', versão, dígitos do operando do perfil, bytes por palavra (2 ou 4), um
+# byte reservado, palavras de código, de consts e de vars e número de linhas do mapa. Seguem os
+# pares (linha SIMPLE, endereço) de equiv_lines e as palavras, alinhadas ao tamanho da palavra.
+# A leitura usa mmap: as palavras são um memoryview sobre o arquivo, sem cópia
+
+MAGIC = b'SMLB'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxIIII')
+LINE_ENTRY = struct.Struct('<II')
+WORD_FORMATS = {2: 'h', 4: 'i'} # int16 basta para palavras de 4 dígitos; as maiores usam int32
+
+
+class ImageError(ValueError):
+    pass
+
+
+class SMLImage:
+    def __init__(self, words, operand_digits=2, regions=None, equiv_lines=None):
+        self.words = words # Sequência de ints: lista, array ou memoryview sobre o arquivo
+        self.operand_digits = operand_digits
+        self.regions = tuple(regions) if regions else (len(words), 0, 0) # Palavras de código, consts e vars
+        self.equiv_lines = equiv_lines or {} # Linha SIMPLE -> endereço da primeira instrução
+        self.mapped = None # mmap por trás de words, se a imagem veio de load
+
+    @property
+    def word_size(self):
+        return 2 if self.operand_digits <= 2 else 4
+
+    def pack(self):
+        size = self.word_size
+        header = HEADER.pack(MAGIC, VERSION, self.operand_digits, size, *self.regions, len(self.equiv_lines))
+        lines = b''.join(LINE_ENTRY.pack(line, address) for line, address in sorted(self.equiv_lines.items()))
+        padding = b'\0' * (-(len(header) + len(lines)) % size)
+        try:
+            words = struct.pack(f'<{len(self.words)}{WORD_FORMATS[size]}', *self.words)
+        except struct.error as error:
+            raise ImageError(f'Palavra não cabe em {size} bytes: {error}')
+        return header + lines + padding + words
+
+    @classmethod
+    def unpack(cls, buffer): # buffer: bytes ou mmap; as palavras ficam num memoryview sobre ele
+        if len(buffer) < HEADER.size:
+            raise ImageError('Arquivo curto demais para uma imagem SML')
+        magic, version, operand_digits, size, code, consts, vars, line_count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ImageError('Não é uma imagem SML (assinatura inválida)')
+        if version != VERSION or size not in WORD_FORMATS:
+            raise ImageError(f'Versão {version} da imagem SML não suportada')
+        offset = HEADER.size
+        equiv_lines = {}
+        for _ in range(line_count):
+            line, address = LINE_ENTRY.unpack_from(buffer, offset)
+            equiv_lines[line] = address
+            offset += LINE_ENTRY.size
+        offset += -offset % size
+        count = code + consts + vars
+        if offset + count * size > len(buffer):
+            raise ImageError('Imagem SML truncada')
+        view = memoryview(buffer)[offset:offset + count * size]
+        if sys.byteorder == 'little':
+            words = view.cast(WORD_FORMATS[size])
+        else: # Máquina big-endian: a cópia com os bytes trocados é inevitável
+            words = list(struct.unpack(f'<{count}{WORD_FORMATS[size]}', view))
+        return cls(words, operand_digits, (code, consts, vars), equiv_lines)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < HEADER.size:
+                raise ImageError('Arquivo curto demais para uma imagem SML')
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        image = cls.unpack(mapped)
+        image.mapped = mapped
+        return image
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self): # Libera o mmap; words deixa de ser válido
+        if self.mapped is not None:
+            if isinstance(self.words, memoryview):
+                self.words.release()
+            self.mapped.close()
+            self.mapped = None
+
+
+def is_image(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# ========== Conversão texto <-> binário ==========:
+def word_text(value, operand_digits): # Como o compilador grava: sinal e largura fixa
+    return f"{'-' if value < 0 else '+'}{abs(value):0{operand_digits + 2}d}"
+
+
+def read_text(path):
+    # Palavras de um binary.txt e os dígitos do operando, pela largura da palavra mais larga
+    with open(path, 'r') as text_file:
+        lines = [line.strip() for line in text_file if line.strip()]
+    try:
+        words = [int(line) for line in lines]
+    except ValueError as error:
+        raise ImageError(f'Palavra inválida: {error}')
+    digits = max((len(line.lstrip('+-')) for line in lines), default=4)
+    return words, max(2, digits - 2)
+
+
+def text_to_image(path, line_map=None):
+    # O mapa gravado pelo compilador com --line-map completa as regiões e equiv_lines
+    words, operand_digits = read_text(path)
+    regions, equiv_lines = None, None
+    if line_map and os.path.exists(line_map):
+        with open(line_map, 'r') as map_file:
+            data = json.load(map_file)
+        equiv_lines = {int(line): address for line, address in data['equiv_lines']}
+        regions = data.get('regions')
+    return SMLImage(words, operand_digits, regions, equiv_lines)
+
+
+def image_to_text(image):
+    return ''.join(word_text(word, image.operand_digits) + '\n' for word in image.words)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Converte programas SML entre texto (binary.txt) e imagem binária (.smb).')
+    arg_parser.add_argument('source', help='binary.txt ou imagem .smb (o formato é detectado pelo conteúdo)')
+    arg_parser.add_argument('output')
+    arg_parser.add_argument('--line-map', metavar='ARQUIVO', help='mapa de linhas do compilador, para o texto -> binário (padrão: <source>.map, se existir)')
+    args = arg_parser.parse_args(argv)
+    try:
+        if is_image(args.source):
+            image = SMLImage.load(args.source)
+            text = image_to_text(image)
+            with open(args.output, 'w') as output_file:
+                output_file.write(text)
+            print(f'{args.source} -> {args.output}: {len(image.words)} palavras em texto')
+            image.close()
+        else:
+            image = text_to_image(args.source, args.line_map or args.source + '.map')
+            data = image.pack()
+            with open(args.output, 'wb') as output_file:
+                output_file.write(data)
+            print(f'{args.source} -> {args.output}: {len(image.words)} palavras, {len(data)} bytes')
+    except (OSError, ValueError, KeyError) as error:
+        print(f'***Erro***: {error}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
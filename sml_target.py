@@ -0,0 +1,35 @@
+# ========== Máquina alvo ==========:
+# Opcodes da SML e perfis da Simpletron, usados pelo compilador (compiler.py) e pelo simulador
+# (simpletron.py): os dois leem a largura das palavras e o tamanho da memória daqui
+
+READ, WRITE = 10, 11
+LOAD, STORE = 20, 21
+ADD, SUBTRACT, DIVIDE, MULTIPLY, MODULE = 30, 31, 32, 33, 34
+BRANCH, BRANCHNEG, BRANCHZERO, HALT = 40, 41, 42, 43
+BRANCH_OPCODES = (BRANCH, BRANCHNEG, BRANCHZERO)
+
+
+class Target:
+    # Perfil da máquina: uma instrução é o opcode (2 dígitos) seguido do operando, que tem dígitos
+    # para endereçar toda a memória; dados usam a mesma largura de palavra
+    def __init__(self, name, memory_size, operand_digits):
+        self.name = name
+        self.memory_size = memory_size
+        self.operand_digits = operand_digits
+        self.scale = 10 ** operand_digits # opcode, operando = divmod(palavra, scale)
+        self.word_digits = 2 + operand_digits
+        self.word_max = 10 ** self.word_digits - 1
+        self.word_min = -self.word_max
+
+    def word(self, value): # '+2007' no perfil clássico, '+20007' com memória de 1000 palavras
+        return f"{'-' if value < 0 else '+'}{abs(value):0{self.word_digits}d}"
+
+    def instruction(self, opcode, operand):
+        return self.word(opcode * self.scale + operand)
+
+TARGETS = {target.name: target for target in (
+    Target('classic', 100, 2), # A Simpletron original: 100 palavras de 4 dígitos
+    Target('ext1000', 1000, 3),
+    Target('ext10000', 10000, 4),
+)}
+DEFAULT_TARGET = TARGETS['classic']
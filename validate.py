@@ -0,0 +1,431 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import re
+import sys
+import time
+
+import compiler
+import simpletron
+
+# Validação diferencial: cada programa do corpus é compilado em todos os níveis de otimização e
+# executado na Simpletron com as mesmas entradas. A saída de todos os níveis tem que ser a mesma;
+# o tamanho do código, os ciclos executados e o tempo de compilação de cada nível são relatados.
+# Com --cross-check, cada imagem também roda no interpretador, no tradutor (jit) e em lote
+# (BatchSimpletron), que têm que dar o mesmo rastro, até a mensagem de erro e os ciclos
+
+OPT_LEVELS = (0, 1, 2, 3)
+DEFAULT_MAX_CYCLES = 100000 # Os programas gerados sempre terminam bem antes disso
+INPUT_RANGE = (-20, 20)
+
+# ========== Corpus ==========:
+# Programas escritos à mão, que terminam com quaisquer entradas em INPUT_RANGE
+CORPUS = {
+    'soma': """10 input n
+20 let s = 0
+30 let i = 0
+40 if i >= n goto 80
+50 let i = i + 1
+60 let s = s + i * i
+70 goto 40
+80 print s
+90 end
+""",
+    'mdc': """10 input a
+20 input b
+30 if a >= 0 goto 50
+40 let a = 0 - a
+50 if b >= 0 goto 70
+60 let b = 0 - b
+70 if b == 0 goto 110
+80 let r = a % b
+90 let a = b
+100 let b = r
+105 goto 70
+110 print a
+120 end
+""",
+    'fatorial': """10 input n
+20 let f = 1
+30 let i = 1
+40 if i > n goto 90
+50 let f = f * i % 97
+60 print f
+70 let i = i + 1
+80 goto 40
+90 end
+""",
+    'fibonacci': """10 input n
+20 let a = 0
+30 let b = 1
+40 let i = 0
+50 if i >= n goto 120
+60 print a
+70 let t = (a + b) % 1000
+80 let a = b
+90 let b = t
+100 let i = i + 1
+110 goto 50
+120 end
+""",
+    'expressoes': """10 input a
+20 input b
+30 input c
+40 let x = (a + b) * (a - b) % 97
+50 print x
+60 let y = a * a - 2 * a * b + b * b
+70 print y
+80 let z = (c - (a - (b - 3))) * 2 + x / 7
+90 print z
+100 if a * 2 + 1 <= b - c goto 130
+110 let w = 0 - x
+120 print w
+130 end
+""",
+    'aninhado': """10 input n
+20 input m
+30 let s = 0
+40 let j = 0
+50 let i = 0
+60 let s = s + i * j + m
+70 let s = s % 97
+80 let i = i + 1
+90 if i < n goto 60
+100 let j = j + 1
+110 if j < m goto 50
+120 print s
+130 end
+""",
+}
+EXAMPLES = ('test2.txt', 'vars-test.txt', 'overflow-test.txt') # Exemplos do repositório, com o SML esperado antes do SIMPLE
+SIMPLE_MARKER = re.compile(r'^simple code:\s*$', re.IGNORECASE | re.MULTILINE)
+
+def simple_source(text): # Arquivos de exemplo trazem o SML esperado antes do marcador 'SIMPLE code:'
+    match = SIMPLE_MARKER.search(text)
+    return text[match.end():].lstrip('\n') if match else text
+
+
+def load_corpus(paths):
+    corpus = dict(CORPUS)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.txt'))
+        else:
+            files.append(path)
+    for path in files:
+        with open(path, 'r') as file:
+            corpus[os.path.basename(path)] = simple_source(file.read())
+    return corpus
+
+
+# ========== Gerador de programas SIMPLE ==========:
+# Programas pequenos (cabem nos 100 endereços na maioria das vezes) que sempre terminam: os
+# desvios para trás são só os dos laços contados, cujo contador o corpo do laço não altera, e
+# os desvios para frente não entram no meio de um laço (só no cabeçalho, logo depois do contador)
+LET_VARIABLES = 'abcdefgh'
+COUNTERS = 'ijk'
+INPUT_VARIABLES = 'abcd'
+COMPARISONS = ('<', '>', '<=', '>=', '==', '!=')
+
+def random_expr(rng, defined, depth):
+    if depth == 0 or rng.random() < 0.3:
+        return rng.choice(defined) if rng.random() < 0.7 else str(rng.randint(-9, 20))
+    op = rng.choice('+-*/%')
+    left = random_expr(rng, defined, depth - 1)
+    right = random_expr(rng, defined, depth - 1) if op not in '/%' else rng.choice((str(rng.randint(1, 9)), rng.choice(defined)))
+    text = f'{left} {op} {right}'
+    return f'({text})' if rng.random() < 0.5 else text
+
+
+def random_block(rng, lines, defined, count, counters):
+    # lines: [texto, índice da instrução alvo ou None]; o alvo vira número de linha no fim
+    starts = [] # Primeira instrução de cada item do bloco: os únicos alvos dos desvios para frente
+    jumps = []
+    for _ in range(count):
+        starts.append(len(lines))
+        kind = rng.random()
+        if kind < 0.45:
+            var = rng.choice(LET_VARIABLES)
+            lines.append([f'let {var} = {random_expr(rng, defined, 2)}', None])
+            defined.append(var)
+        elif kind < 0.6:
+            lines.append([f'print {rng.choice(defined)}', None])
+        elif kind < 0.75:
+            jumps.append(len(lines))
+            lines.append([f'if {random_expr(rng, defined, 1)} {rng.choice(COMPARISONS)} {random_expr(rng, defined, 1)} goto {{target}}', None])
+        elif kind < 0.85 and counters:
+            counter = counters[0]
+            lines.append([f'let {counter} = 0', None])
+            defined.append(counter)
+            entry = rng.random() < 0.3 # Laço também alcançado por 'goto' para o cabeçalho, não só pela linha anterior
+            if entry:
+                lines.append(['goto {target}', None])
+            body = len(lines)
+            if entry:
+                lines[body - 1][1] = body
+            random_block(rng, lines, defined, rng.randint(1, 4), counters[1:])
+            lines.append([f'let {counter} = {counter} + 1', None])
+            lines.append([f'if {counter} < {rng.randint(1, 6)} goto {{target}}', body])
+        elif kind < 0.9:
+            jumps.append(len(lines))
+            lines.append(['goto {target}', None])
+        else:
+            lines.append(['rem gerado', None])
+    end = len(lines) # A instrução depois do bloco sempre existe: o incremento do laço ou 'end'
+    for index in jumps:
+        lines[index][1] = rng.choice([start for start in starts if start > index] + [end])
+
+
+def random_program(seed, statements=10):
+    rng = random.Random(seed)
+    defined = rng.sample(INPUT_VARIABLES, rng.randint(1, 3))
+    lines = [[f'input {var}', None] for var in defined]
+    random_block(rng, lines, defined, statements, COUNTERS)
+    lines.append(['end', None])
+    numbers = [10 * (index + 1) for index in range(len(lines))]
+    return ''.join(f"{number} {text.format(target=numbers[target]) if target is not None else text}\n"
+                   for number, (text, target) in zip(numbers, lines))
+
+
+# Casos fixos de compile_stream contra compile_source: (fonte, max_errors). Os dois têm que devolver
+# os mesmos erros, sem deixar escapar TooManyErrors
+STREAM_CASES = {
+    'primeiro-token-inválido': ('@\n10 end\n', 1),
+    'alvo-inexistente-antes-de-erro': ('10 goto 99\n20 print z\n30 end\n', 1),
+}
+
+def input_count(source): # Valores de entrada consumidos: nenhum 'input' dos programas do corpus fica num laço
+    return len(re.findall(r'^\s*\d+\s+input\b', source, re.MULTILINE))
+
+
+# ========== Execução ==========:
+def compile_level(source, opt_level, target, repeat):
+    # Menor tempo em repeat compilações; um erro interno do compilador vira uma falha do programa
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = compiler.compile_source(source, compiler.CompileOptions(opt_level, target=target))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def execute(code, inputs, target, max_cycles, jit):
+    # Rastro da execução: a saída e como terminou ('halt', 'error' ou 'limit'), mais os ciclos.
+    # O tipo do erro não entra na comparação: a ordem de avaliação pode trocar um overflow por
+    # uma divisão por zero na mesma expressão
+    machine = simpletron.Simpletron(code, inputs=[str(value) for value in inputs], max_cycles=max_cycles, jit=jit,
+                                    target=simpletron.TARGETS[target])
+    try:
+        machine.run()
+        outcome, message = 'halt', None
+    except (simpletron.SimpletronError, ValueError) as error:
+        message = str(error)
+        outcome = 'limit' if machine.cycles >= max_cycles else 'error'
+    return {'output': machine.output, 'outcome': outcome, 'message': message, 'cycles': machine.cycles}
+
+
+def batch_traces(code, input_sets, target, max_cycles):
+    # Rastros de uma execução em lote, uma máquina por conjunto de entradas, no formato de execute
+    machines = simpletron.BatchSimpletron(code, input_sets, max_cycles=max_cycles, target=simpletron.TARGETS[target])
+    traces = []
+    for lane, output in enumerate(machines.run()):
+        cycles = int(machines.cycles[lane])
+        outcome = 'halt' if machines.halted[lane] else 'limit' if cycles >= max_cycles else 'error'
+        traces.append({'output': output, 'outcome': outcome, 'message': machines.errors[lane], 'cycles': cycles})
+    return traces
+
+
+def cross_check(code, input_sets, traces, target, max_cycles, jit):
+    # Divergências entre os modos de execução da mesma imagem: traces são os rastros do modo
+    # principal, um por conjunto de entradas
+    failures = []
+    for inputs, trace in zip(input_sets, traces):
+        other = execute(code, inputs, target, max_cycles, not jit)
+        if other != trace:
+            failures.append({'engine': 'interpretador' if jit else 'jit', 'inputs': inputs, 'expected': trace, 'got': other})
+    if simpletron.np is not None and input_sets:
+        for inputs, trace, batch in zip(input_sets, traces, batch_traces(code, input_sets, target, max_cycles)):
+            if batch != trace:
+                failures.append({'engine': 'lote', 'inputs': inputs, 'expected': trace, 'got': batch})
+    return failures
+
+
+def same_trace(expected, trace):
+    if 'limit' in (expected['outcome'], trace['outcome']): # Cada nível para num ponto diferente: só o começo da saída é comparável
+        size = min(len(expected['output']), len(trace['output']))
+        return expected['output'][:size] == trace['output'][:size]
+    return expected['output'] == trace['output'] and expected['outcome'] == trace['outcome']
+
+
+def validate_program(name, source, opt_levels, input_sets, target, max_cycles, repeat, jit, cross=False):
+    # Devolve o registro do programa: por nível, palavras, ciclos e tempo de compilação; e as divergências
+    record = {'name': name, 'status': 'ok', 'levels': {}, 'failures': []}
+    results = {}
+    for opt_level in opt_levels:
+        try:
+            result, elapsed = compile_level(source, opt_level, target, repeat)
+        except Exception as error: # Erro interno do compilador
+            record['failures'].append({'opt_level': opt_level, 'error': f'{type(error).__name__}: {error}'})
+            continue
+        results[opt_level] = result
+        record['levels'][opt_level] = {'words': len(result.code), 'cycles': 0, 'compile_seconds': elapsed, 'status': result.status}
+    statuses = {result.status for result in results.values()}
+    errors = {tuple(result.errors) for result in results.values()}
+    if len(errors) > 1:
+        record['failures'].append({'error': 'Os níveis relatam erros de compilação diferentes'})
+    if record['failures'] or statuses != {'ok'}: # Não há o que executar em todos os níveis
+        record['status'] = 'failed' if record['failures'] else 'skipped'
+        record['reason'] = ', '.join(sorted(statuses))
+        return record
+    record['runs'] = record['limited'] = 0
+    runs = {opt_level: [] for opt_level in results}
+    for inputs in input_sets:
+        traces = {opt_level: execute(result.code, inputs, target, max_cycles, jit) for opt_level, result in results.items()}
+        expected = traces[opt_levels[0]]
+        limited = 'limit' in {trace['outcome'] for trace in traces.values()}
+        record['limited'] += limited
+        for opt_level, trace in traces.items():
+            runs[opt_level].append(trace)
+            if not limited: # Os ciclos até o limite não são comparáveis entre os níveis
+                record['levels'][opt_level]['cycles'] += trace['cycles']
+            if not same_trace(expected, trace):
+                record['failures'].append({'opt_level': opt_level, 'inputs': inputs, 'expected': expected, 'got': trace})
+        record['runs'] += 1
+    if cross:
+        for opt_level, result in results.items():
+            for failure in cross_check(result.code, input_sets, runs[opt_level], target, max_cycles, jit):
+                record['failures'].append({'opt_level': opt_level, **failure})
+    if record['failures']:
+        record['status'] = 'failed'
+        record['source'] = source
+    return record
+
+
+def run_validation(corpus, opt_levels, inputs_per_program, target, max_cycles, repeat, jit, seed, cross=False):
+    rng = random.Random(seed)
+    records = []
+    for name, source in corpus.items():
+        count = input_count(source)
+        input_sets = [[rng.randint(*INPUT_RANGE) for _ in range(count)] for _ in range(inputs_per_program)]
+        records.append(validate_program(name, source, opt_levels, input_sets, target, max_cycles, repeat, jit, cross))
+    return records
+
+
+def validate_stream(name, source, max_errors, target):
+    # Registro no formato de validate_program, sem níveis: só as divergências entre os dois caminhos
+    record = {'name': f'stream:{name}', 'status': 'ok', 'levels': {}, 'failures': []}
+    options = compiler.CompileOptions(max_errors=max_errors, target=target)
+    try:
+        expected = compiler.compile_source(source, options)
+        got = compiler.compile_stream(io.StringIO(source), options)
+    except Exception as error:
+        record['failures'].append({'error': f'{type(error).__name__}: {error}'})
+    else:
+        if [str(error) for error in expected.errors] != [str(error) for error in got.errors]:
+            record['failures'].append({'error': f'compile_stream relata {[str(error) for error in got.errors]}, '
+                                                f'compile_source relata {[str(error) for error in expected.errors]}'})
+        elif expected.code != got.code:
+            record['failures'].append({'error': 'compile_stream gera código diferente de compile_source'})
+    if record['failures']:
+        record['status'] = 'failed'
+        record['source'] = source
+    return record
+
+
+def summarize(records, opt_levels):
+    # Totais por nível, só dos programas executados em todos os níveis, para que sejam comparáveis
+    validated = [record for record in records if record['status'] != 'skipped' and len(record['levels']) == len(opt_levels)]
+    levels = []
+    for opt_level in opt_levels:
+        levels.append({
+            'opt_level': opt_level,
+            'programs': len(validated),
+            'runs': sum(record.get('runs', 0) for record in validated),
+            'words': sum(record['levels'][opt_level]['words'] for record in validated),
+            'cycles': sum(record['levels'][opt_level]['cycles'] for record in validated),
+            'compile_seconds': sum(record['levels'][opt_level]['compile_seconds'] for record in validated),
+        })
+    return levels
+
+
+def format_table(levels):
+    base = levels[0]
+    relative = lambda value, reference: f'{value / reference * 100:6.1f}%' if reference else '      -'
+    reference = f"vs -O{base['opt_level']}"
+    rows = [f"{'nível':<6}{'programas':>10}{'execuções':>11}{'palavras':>10}{reference:>8}{'ciclos':>12}{reference:>8}{'compilação':>12}"]
+    for level in levels:
+        rows.append(f"-O{level['opt_level']:<4}{level['programs']:>10}{level['runs']:>11}{level['words']:>10} {relative(level['words'], base['words'])}"
+                    f"{level['cycles']:>12} {relative(level['cycles'], base['cycles'])}{level['compile_seconds'] * 1000:>10.1f}ms")
+    return '\n'.join(rows)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Compila programas SIMPLE em cada nível de otimização, executa na Simpletron e compara as saídas.')
+    arg_parser.add_argument('paths', nargs='*', help='arquivos ou diretórios com programas SIMPLE, além do corpus embutido')
+    arg_parser.add_argument('-O', '--opt-levels', type=int, nargs='+', choices=OPT_LEVELS, default=list(OPT_LEVELS))
+    arg_parser.add_argument('--random', type=int, default=200, metavar='N', help='programas gerados aleatoriamente (padrão: %(default)s)')
+    arg_parser.add_argument('--statements', type=int, default=10, help='instruções de cada programa gerado, sem contar as dos laços (padrão: %(default)s)')
+    arg_parser.add_argument('--inputs', type=int, default=5, metavar='N', help='conjuntos de entradas por programa (padrão: %(default)s)')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--target', choices=tuple(compiler.TARGETS), default=compiler.DEFAULT_TARGET.name)
+    arg_parser.add_argument('--max-cycles', type=int, default=DEFAULT_MAX_CYCLES)
+    arg_parser.add_argument('--repeat', type=int, default=1, help='compilações de cada programa em cada nível; vale a mais rápida')
+    arg_parser.add_argument('--jit', action='store_true', help='executa com o tradutor para Python da Simpletron')
+    arg_parser.add_argument('--cross-check', action='store_true',
+                            help='também executa cada imagem no outro modo (jit ou interpretador) e em lote (numpy), e compara os rastros')
+    arg_parser.add_argument('--no-examples', action='store_true', help='não inclui os exemplos do repositório (test2.txt, ...)')
+    arg_parser.add_argument('--json', metavar='ARQUIVO', help='grava os resultados em JSON')
+    args = arg_parser.parse_args(argv)
+
+    opt_levels = sorted(set(args.opt_levels))
+    here = os.path.dirname(os.path.abspath(__file__))
+    examples = [] if args.no_examples else [os.path.join(here, name) for name in EXAMPLES if os.path.exists(os.path.join(here, name))]
+    try:
+        corpus = load_corpus(examples + args.paths)
+    except (OSError, UnicodeDecodeError) as error:
+        print(f'***Erro***: Não foi possível ler o corpus: {error}')
+        return 4
+    for index in range(args.random):
+        corpus[f'aleatório-{args.seed}-{index}'] = random_program(args.seed * 1000003 + index, args.statements)
+
+    records = run_validation(corpus, opt_levels, args.inputs, args.target, args.max_cycles, args.repeat, args.jit, args.seed, args.cross_check)
+    records += [validate_stream(name, source, max_errors, args.target) for name, (source, max_errors) in STREAM_CASES.items()]
+    if args.cross_check and simpletron.np is None:
+        print('numpy não instalado: a execução em lote não foi comparada')
+    levels = summarize(records, opt_levels)
+    failed = [record for record in records if record['status'] == 'failed']
+    skipped = [record for record in records if record['status'] == 'skipped']
+    for record in failed:
+        for failure in record['failures']:
+            if 'inputs' in failure:
+                expected, got = failure['expected'], failure['got']
+                engine = f" ({failure['engine']})" if 'engine' in failure else ''
+                print(f"***Divergência***: {record['name']} -O{failure['opt_level']}{engine} entradas {failure['inputs']}: "
+                      f"esperado {expected['output']} ({expected['outcome']}, {expected['cycles']} ciclos), "
+                      f"obtido {got['output']} ({got['outcome']}: {got['message']}, {got['cycles']} ciclos)")
+            else:
+                print(f"***Divergência***: {record['name']}{' -O' + str(failure['opt_level']) if 'opt_level' in failure else ''}: {failure['error']}")
+        if 'source' in record:
+            print(record['source'])
+    print(format_table(levels))
+    limited = sum(record.get('limited', 0) for record in records)
+    print(f"{len(corpus)} programas: {len(failed)} com divergências, {len(skipped)} não executados (erros ou memória insuficiente)"
+          f"{f', {limited} execuções interrompidas pelo limite de ciclos' if limited else ''}")
+    if args.json:
+        results = {
+            'meta': {'python': platform.python_version(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'target': args.target,
+                     'seed': args.seed, 'random': args.random, 'inputs': args.inputs, 'jit': args.jit, 'cross_check': args.cross_check},
+            'levels': levels,
+            'programs': records,
+        }
+        compiler.write_atomic(args.json, json.dumps(results, indent=2, ensure_ascii=False) + '\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())